@@ -1,19 +1,94 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, has_request_context, jsonify, request, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from datetime import datetime, timedelta
-import mysql.connector
 import os
+import re
+import json
+import queue
+import time
+import hashlib
+import itertools
+import base64
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import uuid
+from functools import wraps
+from db_pool import ConnectionPool
+from storage import MySQLStorage, open_storage
+from data_versions import DataVersions
+from query_cache import QueryCache
+from run_events import EventHub, HubFull, sse
+from static_assets import AssetCache
+import run_sketches
+from metrics import CONTENT_TYPE, REGISTRY, Gauge, Histogram, TimedConnection
+from server import serve as serve_app
+from log_pipeline import LogPipeline
 
-app = Flask(__name__, static_folder='build', static_url_path='')
+# The React build is served from memory by send_asset(), not Flask's static route
+app = Flask(__name__, static_folder=None)
+BUILD_DIR = os.path.join(app.root_path, 'build')
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-handler = RotatingFileHandler('app.log', maxBytes=10000, backupCount=3)
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-app.logger.addHandler(handler)
+def log_context():
+    if has_request_context() and 'request_id' in g:
+        return {'request_id': g.request_id}
+    return None
+
+# Request threads only enqueue records; a background thread writes JSON lines
+# to LOG_FILE (see log_pipeline.py for the LOG_* settings)
+log_pipeline = LogPipeline.from_env(context=log_context).start()
+atexit.register(log_pipeline.stop)
+access_log = logging.getLogger('dashboard.access')
+
+# Request timing for /metrics. Routes are labelled by their URL rule, not
+# the path, so the number of series stays bounded.
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Time from the start of a request until its response body was sent',
+    ('route', 'method', 'status'),
+)
+SERIALIZE_SECONDS = Histogram(
+    'json_serialize_duration_seconds',
+    'Time spent encoding JSON response bodies',
+    ('route',),
+)
+
+def route_label():
+    if not has_request_context():
+        return 'none'
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex[:16]
+
+@app.after_request
+def observe_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        response.headers['X-Request-ID'] = g.request_id
+        labels = (route_label(), request.method, str(response.status_code))
+        fields = {'request_id': g.request_id, 'route': labels[0], 'method': labels[1], 'status': response.status_code}
+        path = request.full_path.rstrip('?')
+
+        # Streamed bodies are only finished once the server closes them
+        def finished():
+            elapsed = time.perf_counter() - start
+            REQUEST_SECONDS.observe(elapsed, *labels)
+            if access_log.isEnabledFor(logging.INFO):
+                access_log.info('%s %s %s', labels[1], path, labels[2], extra=dict(fields, duration_ms=round(elapsed * 1000, 2)))
+        response.call_on_close(finished)
+    return response
+
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            SERIALIZE_SECONDS.observe(time.perf_counter() - start, route_label())
+
+app.json = TimedJSONProvider(app)
 
 # Database configuration
 db_config = {
@@ -24,59 +99,246 @@ db_config = {
     'port': 3306
 }
 
-def get_db_connection():
+# DASHBOARD_DB=sqlite:///dashboard.db runs against a local file instead of RDS
+storage = open_storage(os.getenv('DASHBOARD_DB'), MySQLStorage(**db_config))
+
+def _connect():
     try:
-        conn = mysql.connector.connect(**db_config)
-        return conn
+        return TimedConnection(storage.connect())
     except Exception as e:
         app.logger.error(f"Database connection error: {str(e)}")
         raise
 
+db_pool = ConnectionPool(
+    _connect,
+    max_size=int(os.getenv('DB_POOL_SIZE', 10)),
+    timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+    max_age=int(os.getenv('DB_POOL_MAX_AGE', 1800)),
+)
+
+def get_db_connection():
+    """Check out a pooled connection; use as `with get_db_connection() as conn:`"""
+    return db_pool.connection()
+
+# Responses are cached until the listener or populate_db.py bumps the data
+# version of the repository and branch they cover
+data_versions = DataVersions(db_pool, interval=float(os.getenv('DATA_VERSION_POLL', 5)))
+query_cache = QueryCache(
+    max_bytes=int(os.getenv('QUERY_CACHE_MB', 64)) * 1024 * 1024,
+    ttl=float(os.getenv('QUERY_CACHE_TTL', 60)),
+)
+
+def request_scope():
+    """The (repo, branch) a request reads from; None means all of them"""
+    repo = request.args.get('repo') or None
+    branch = request.args.get('branch', 'main') or None
+    if repo == 'all':
+        repo = None
+    if branch == 'all':
+        branch = None
+    return repo, branch
+
+def cached(scope=request_scope):
+    """Serve repeated GETs from query_cache, keyed by path, arguments and format
+
+    Responses carry an ETag derived from the same key and data version, so a
+    client whose copy is current gets a 304 without any query running.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # QUERY_CACHE_TTL=0 turns caching and ETags off
+            if not query_cache.ttl:
+                return view(*args, **kwargs)
+            repo, branch = scope()
+            version = data_versions.version(repo, branch)
+            key = (
+                request.path,
+                tuple(sorted(request.args.items(multi=True))),
+                request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']),
+            )
+            # The TTL period is part of the tag because some responses, such as
+            # the time since the last push, change without new data
+            etag = hashlib.sha1(
+                repr((key, version, int(time.time() // query_cache.ttl))).encode()
+            ).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            hit = query_cache.get(key, version)
+            if hit is not None:
+                body, headers = hit
+                response = Response(body, headers=headers)
+                response.set_etag(etag)
+                return response
+
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            headers = [(k, v) for k, v in response.headers if k != 'Content-Length']
+            if not response.is_streamed:
+                query_cache.put(key, version, response.get_data(), headers)
+                return response
+
+            # stream_query reports whether its body ended cleanly; one cut short
+            # by an error must not be served to later clients
+            complete = getattr(response, 'stream_complete', lambda: True)
+
+            def tee(chunks):
+                parts, size = [], 0
+                for chunk in chunks:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    if parts is not None:
+                        parts.append(chunk)
+                        size += len(chunk)
+                        if size > query_cache.max_entry_bytes:
+                            parts = None
+                    yield chunk
+                if parts is not None and complete():
+                    query_cache.put(key, version, b''.join(parts), headers)
+
+            response.response = tee(response.response)
+            return response
+        return wrapper
+    return decorator
+
+RANGE_UNITS = {'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+def parse_range(value):
+    """Parse a range such as '24h', '7d', '12w' or '1y' into a timedelta"""
+    match = re.fullmatch(r'(\d+)([hdwy])', value or '')
+    if not match:
+        raise ValueError(f"Invalid range: {value}")
+    count, unit = int(match.group(1)), match.group(2)
+    if unit == 'y':
+        return timedelta(days=365 * count)
+    return timedelta(**{RANGE_UNITS[unit]: count})
+
+# SQL expression for the start of each chart bucket over the daily rollup
+ROLLUP_BUCKETS = {
+    'day': 'day',
+    'week': 'day - INTERVAL WEEKDAY(day) DAY',
+}
+
 @app.route('/api/metrics/dashboard', methods=['GET'])
+@cached()
 def get_dashboard_metrics():
+    """Run counts per time bucket and red-on-main for a repo and branch
+
+    Day and week buckets are read from workflowrun_daily_stats and cover
+    whole days; hour buckets are counted from workflowruns and are limited
+    to ranges of a week or less.
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        # Get daily workflow statistics for the past 7 days
-        cursor.execute("""
-            SELECT 
-                DATE(createtime) as date,
-                COUNT(*) as total,
-                SUM(CASE WHEN conclusion = 'success' THEN 1 ELSE 0 END) as success,
-                SUM(CASE WHEN conclusion = 'failure' THEN 1 ELSE 0 END) as failed
-            FROM workflowruns
-            WHERE createtime >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-            GROUP BY DATE(createtime)
-            ORDER BY date DESC
-        """)
-        
-        daily_data = cursor.fetchall()
-        
-        # Calculate red on main percentage (last 24 hours)
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_runs,
-                SUM(CASE WHEN conclusion = 'failure' THEN 1 ELSE 0 END) as failed_runs
-            FROM workflowruns
-            WHERE createtime >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
-        """)
-        
-        total_stats = cursor.fetchone()
-        red_on_main = (total_stats['failed_runs'] / total_stats['total_runs'] * 100) if total_stats['total_runs'] > 0 else 0
-        
-        # Get last push time
-        cursor.execute("""
-            SELECT createtime 
-            FROM workflowruns 
-            ORDER BY createtime DESC 
-            LIMIT 1
-        """)
-        
-        latest_run = cursor.fetchone()
+        try:
+            span = parse_range(request.args.get('range', '7d'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in ROLLUP_BUCKETS and bucket != 'hour':
+            return jsonify({'error': f"Invalid bucket: {bucket}"}), 400
+        if bucket == 'hour' and span > timedelta(days=7):
+            return jsonify({'error': 'Hourly buckets are limited to 7 days'}), 400
+        repo, branch = request_scope()
+        since = datetime.utcnow() - span
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+
+            if bucket == 'hour':
+                query = """
+                    SELECT
+                        DATE_FORMAT(createtime, '%%Y-%%m-%%d %%H:00') as date,
+                        COUNT(*) as total,
+                        SUM(conclusion = 'success') as success,
+                        SUM(conclusion = 'failure') as failed,
+                        SUM(conclusion = 'cancelled') as cancelled
+                    FROM workflowruns
+                    WHERE createtime >= %s
+                """
+                params = [since]
+                columns = {'repo': 'repo', 'branch': 'branchname'}
+            else:
+                query = f"""
+                    SELECT
+                        {ROLLUP_BUCKETS[bucket]} as date,
+                        SUM(total) as total,
+                        SUM(success) as success,
+                        SUM(failure) as failed,
+                        SUM(cancelled) as cancelled
+                    FROM workflowrun_daily_stats
+                    WHERE day >= %s
+                """
+                params = [since.date()]
+                columns = {'repo': 'repo', 'branch': 'branch'}
+            if repo:
+                query += f" AND {columns['repo']} = %s"
+                params.append(repo)
+            if branch:
+                query += f" AND {columns['branch']} = %s"
+                params.append(branch)
+            query += " GROUP BY 1 ORDER BY 1 DESC"
+            cursor.execute(query, params)
+            bucket_data = cursor.fetchall()
+
+            # Get last push time
+            query = "SELECT MAX(createtime) as createtime FROM workflowruns WHERE 1 = 1"
+            params = []
+            if repo:
+                query += " AND repo = %s"
+                params.append(repo)
+            if branch:
+                query += " AND branchname = %s"
+                params.append(branch)
+            cursor.execute(query, params)
+            latest_run = cursor.fetchone()
+
+            # Red on main is the current health of the branch: the failure
+            # share of the runs created in the last 24 hours, whatever the range
+            red_since = datetime.utcnow() - timedelta(hours=24)
+            scope = ""
+            scope_params = []
+            if repo:
+                scope += " AND repo = %s"
+                scope_params.append(repo)
+            if branch:
+                scope += " AND {branch} = %s"
+                scope_params.append(branch)
+            cursor.execute(
+                "SELECT COUNT(*) as total, SUM(conclusion = 'failure') as failed"
+                " FROM workflowruns WHERE createtime >= %s" + scope.format(branch='branchname'),
+                [red_since] + scope_params,
+            )
+            recent = cursor.fetchone()
+
+            # Failed runs of commits that also passed the same workflow. Flakiness
+            # is kept per day, so this share covers the days the last 24 hours touch.
+            cursor.execute(
+                "SELECT SUM(flaky_failures) as flaky FROM workflow_flakiness WHERE day >= %s"
+                + scope.format(branch='branch'),
+                [red_since.date()] + scope_params,
+            )
+            flaky_failures = int(cursor.fetchone()['flaky'] or 0)
+            cursor.execute(
+                "SELECT SUM(total) as total FROM workflowrun_daily_stats WHERE day >= %s"
+                + scope.format(branch='branch'),
+                [red_since.date()] + scope_params,
+            )
+            flaky_total = int(cursor.fetchone()['total'] or 0)
+            cursor.close()
+
+        recent_runs = int(recent['total'] or 0)
+        red_on_main = (int(recent['failed'] or 0) / recent_runs * 100) if recent_runs > 0 else 0
+        red_on_main_flaky = (flaky_failures / flaky_total * 100) if flaky_total > 0 else 0
+
         last_push = "N/A"
-        if latest_run:
-            time_diff = datetime.now() - latest_run['createtime']
+        if latest_run and latest_run['createtime']:
+            time_diff = datetime.utcnow() - latest_run['createtime']
             if time_diff.days > 0:
                 last_push = f"{time_diff.days}d"
             elif time_diff.seconds >= 3600:
@@ -86,22 +348,20 @@ def get_dashboard_metrics():
 
         # Format chart data
         chart_data = [{
-            'date': row['date'].strftime('%Y-%m-%d'),
+            'date': row['date'] if bucket == 'hour' else row['date'].strftime('%Y-%m-%d'),
             'Success': int(row['success'] or 0),
             'Failed': int(row['failed'] or 0),
+            'Cancelled': int(row['cancelled'] or 0),
             'total': int(row['total'] or 0)
-        } for row in daily_data]
+        } for row in bucket_data]
 
         metrics = {
             'redOnMain': f"{red_on_main:.1f}",
-            'redOnMainFlaky': "0.0",
+            'redOnMainFlaky': f"{red_on_main_flaky:.1f}",
             'lastMainPush': last_push,
             'lastDockerBuild': "N/A"
         }
 
-        cursor.close()
-        conn.close()
-
         return jsonify({
             'chartData': chart_data,
             'metrics': metrics
@@ -111,127 +371,646 @@ def get_dashboard_metrics():
         app.logger.error(f"Dashboard metrics error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def encode_cursor(*values):
+    """Opaque pagination cursor for the last row of a page"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return [datetime.fromisoformat(values[0])] + values[1:]
+
+def conclusion_status(conclusion):
+    return 'O' if conclusion == 'success' else ('X' if conclusion == 'failure' else '?')
+
+# Output fields of /api/metrics/workflowruns and the columns they are read from
+WORKFLOW_RUN_FIELDS = {
+    'workflowId': 'wr.id',
+    'gitid': 'wr.gitid',
+    'commitHash': 'wr.commithash',
+    'createTime': 'wr.createtime',
+    'repo': 'wr.repo',
+    'branch': 'wr.branchname',
+    'commitMessage': 'c.message',
+    'author': 'wr.author',
+    'workflowUrl': 'wr.url',
+    'workflowname': 'wr.workflowname',
+    'conclusion': 'wr.conclusion',
+    'os': 'wr.os',
+}
+
+def iter_rows(cursor, batch_size=500):
+    """Yield rows from an executed cursor, fetching `batch_size` at a time"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+def wants_ndjson():
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+def stream_query(query, params, format_row, batch_size=500, headers=None):
+    """Run a query and stream its rows as a JSON array, or as NDJSON when the
+    client's Accept header prefers application/x-ndjson
+
+    The query runs before the response starts, so connection and SQL errors
+    still become a 500; rows are then encoded `batch_size` at a time while
+    the pooled connection stays checked out until the body has been sent.
+    The status is already sent when a later error happens, so the body then
+    ends with an {"error": ...} object: the last NDJSON line, or appended
+    after the unterminated array so that parsing the JSON body fails.
+    """
+    conn = db_pool.acquire()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, params)
+    except Exception:
+        db_pool.release(conn, broken=True)
+        raise
+    ndjson = wants_ndjson()
+    state = {'done': False}
+    route = route_label()
+
+    def encode(rows, separator):
+        if ndjson:
+            return ''.join(json.dumps(format_row(row)) + '\n' for row in rows)
+        return separator + ','.join(json.dumps(format_row(row)) for row in rows)
+
+    def generate():
+        if not ndjson:
+            yield '['
+        separator = ''
+        encoding = 0.0
+        try:
+            rows = iter_rows(cursor, batch_size)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                start = time.perf_counter()
+                chunk = encode(batch, separator)
+                encoding += time.perf_counter() - start
+                separator = ','
+                yield chunk
+        except Exception as e:
+            app.logger.error(f"Streaming {route} failed: {str(e)}", exc_info=True)
+            yield '\n' + json.dumps({'error': str(e)}) + '\n'
+            return
+        if not ndjson:
+            yield ']'
+        SERIALIZE_SECONDS.observe(encoding, route)
+        state['done'] = True
+
+    def close():
+        if state['done']:
+            cursor.close()
+        # An abandoned stream leaves unread rows behind, so drop the connection
+        db_pool.release(conn, broken=not state['done'])
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson' if ndjson else 'application/json',
+        headers=headers,
+    )
+    response.stream_complete = lambda: state['done']
+    response.call_on_close(close)
+    return response
+
+def run_results(row):
+    """Per-platform status summary kept for older clients"""
+    results = {
+        'Linux': '?', 'Win': '?', 'Mac': '?',
+        'Doc': '?', 'Lint': '?', 'Test': '?'
+    }
+    status = conclusion_status(row['wr.conclusion'])
+    if row['wr.os']:
+        key = {'windows': 'Win', 'macos': 'Mac'}.get(row['wr.os'].lower(), row['wr.os'])
+        if key in results:
+            results[key] = status
+    name = (row['wr.workflowname'] or '').lower()
+    for word, key in (('doc', 'Doc'), ('lint', 'Lint'), ('test', 'Test')):
+        if word in name:
+            results[key] = status
+            break
+    return results
+
+def format_run_field(field, value):
+    if field == 'createTime':
+        return value.isoformat() if value else None
+    if field in ('workflowId', 'gitid', 'commitHash'):
+        return str(value)
+    if field == 'commitMessage':
+        return value or ''
+    return value
+
 @app.route('/api/metrics/workflowruns', methods=['GET'])
+@cached()
 def get_workflow_runs():
+    """Workflow runs, newest first
+
+    At most `limit` runs are returned; when there are more, the
+    `X-Next-Cursor` response header holds the `cursor` for the next page.
+    `fields` selects a comma-separated subset of the output fields. The
+    `X-Since` header can be passed back as `since` to get only the runs
+    written by the listener after this response.
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
         days = request.args.get('days', default=7, type=int)
         repo_filter = request.args.get('repo', default=None)
         branch_filter = request.args.get('branch', default='main', type=str)
-        
-        # Updated query to properly handle workflow runs and commits
-        query = """
-            SELECT 
-                wr.id as workflow_id,
-                wr.gitid,
-                wr.commithash,
-                wr.author,
-                wr.createtime,
-                wr.repo,
-                wr.branchname,
-                wr.workflowname,
-                wr.os,
-                wr.conclusion,
-                wr.url as workflow_url,
-                c.message as commit_message
+        limit = max(1, min(request.args.get('limit', default=1000, type=int), 5000))
+        cursor_arg = request.args.get('cursor')
+        since = request.args.get('since', type=int)
+        if request.args.get('fields'):
+            fields = request.args.get('fields').split(',')
+            unknown = [f for f in fields if f not in WORKFLOW_RUN_FIELDS and f != 'results']
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        else:
+            fields = list(WORKFLOW_RUN_FIELDS) + ['results']
+
+        # The page key is always selected; results needs the os, name and conclusion
+        columns = {'wr.createtime', 'wr.id'}
+        columns.update(WORKFLOW_RUN_FIELDS[f] for f in fields if f != 'results')
+        if 'results' in fields:
+            columns.update(('wr.os', 'wr.workflowname', 'wr.conclusion'))
+        columns = sorted(columns)
+
+        if since is not None:
+            # Only runs the listener has written since the client's last request
+            conditions = ["wr.gitid IN (SELECT gitid FROM run_events WHERE id > %s)"]
+            params = [since]
+        else:
+            conditions = ["wr.createtime >= DATE_SUB(NOW(), INTERVAL %s DAY)"]
+            params = [days]
+
+        if repo_filter and repo_filter != 'all':
+            conditions.append("wr.repo = %s")
+            params.append(repo_filter)
+
+        if branch_filter and branch_filter != 'all':
+            conditions.append("wr.branchname = %s")
+            params.append(branch_filter)
+
+        if cursor_arg:
+            try:
+                createtime, run_id = decode_cursor(cursor_arg)
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            conditions.append("(wr.createtime, wr.id) < (%s, %s)")
+            params += [createtime, run_id]
+
+        where = " WHERE " + " AND ".join(conditions)
+
+        # Find the last run of this page up front so the next-page cursor can
+        # go in a header before the rows are streamed
+        headers = {}
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Read before the runs, so changes racing this request are sent again
+            # rather than missed by the client's next since= request
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM run_events")
+            headers['X-Since'] = str(cursor.fetchone()[0])
+            cursor.execute(
+                "SELECT wr.createtime, wr.id FROM workflowruns wr" + where
+                + " ORDER BY wr.createtime DESC, wr.id DESC LIMIT 2 OFFSET %s",
+                params + [limit - 1],
+            )
+            boundary = cursor.fetchall()
+            cursor.close()
+        if len(boundary) == 2:
+            # Bounding by key rather than LIMIT keeps pages contiguous when
+            # newer runs arrive between the two queries
+            where += " AND (wr.createtime, wr.id) >= (%s, %s)"
+            params += list(boundary[0])
+            headers['X-Next-Cursor'] = encode_cursor(*boundary[0])
+
+        query = f"""
+            SELECT {', '.join(f'{column} AS `{column}`' for column in columns)}
             FROM workflowruns wr
-            LEFT JOIN commits c ON wr.commithash = c.hash AND wr.repo = c.repo
-            WHERE wr.createtime >= DATE_SUB(NOW(), INTERVAL %s DAY)
         """
-        
+        if 'c.message' in columns:
+            query += " LEFT JOIN commits c ON wr.commithash = c.hash AND wr.repo = c.repo"
+        query += where + " ORDER BY wr.createtime DESC, wr.id DESC"
+
+        def format_row(row):
+            run = {}
+            for field in fields:
+                if field == 'results':
+                    run['results'] = run_results(row)
+                else:
+                    run[field] = format_run_field(field, row[WORKFLOW_RUN_FIELDS[field]])
+            return run
+
+        return stream_query(query, params, format_row, headers=headers)
+
+    except Exception as e:
+        app.logger.error(f"Workflow runs error: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# Workflow columns shown by the waterfall view when the client does not send its own
+DEFAULT_WATERFALL_COLUMNS = {
+    'iree-org/iree': ['CI', 'PkgCI', 'Publish Website', 'Linux', 'Mac', 'ARM64',
+                      'Windows', 'LLVM', 'Debug', 'TSAN', 'GCC'],
+    'nod-ai/shark-ai': ['shortfin', 'sharktank', 'pkgci'],
+}
+DEFAULT_WATERFALL_FALLBACK = ['CI', 'Pkg']
+
+def run_column_keys(row):
+    """Waterfall columns a run can fill: its workflow name, OS and job type"""
+    keys = [row['workflowname']]
+    if row['os']:
+        os_key = {'windows': 'Windows', 'macos': 'Mac'}.get(row['os'].lower(), row['os'])
+        keys.append(os_key)
+    name = (row['workflowname'] or '').lower()
+    for word, key in (('doc', 'Doc'), ('lint', 'Lint'), ('test', 'Test')):
+        if word in name:
+            keys.append(key)
+            break
+    return keys
+
+def waterfall_commits(cursor, filters, params, after, count):
+    """The next `count` commits after the cursor position `after`
+
+    A commit's position is (latest run time, hash, repo), newest first. Runs
+    are scanned newest first from the cursor in batches, and each new commit
+    met is a candidate; its latest run is then looked up for the candidates
+    only, and those whose latest run lies before the cursor (shown on an
+    earlier page) are dropped. A page therefore reads the runs of roughly
+    `count` commits rather than aggregating the whole window.
+    """
+    batch = count * 20
+    commits, seen = [], set()
+    scan_after = after
+    while len(commits) < count:
+        scan_query = f"""
+            SELECT wr.commithash, wr.repo, wr.createtime, wr.id AS run_id
+            FROM workflowruns wr
+            WHERE 1 = 1 {filters}
+        """
+        scan_params = list(params)
+        if scan_after is not None:
+            # Runs of the cursor's own commit at its latest time were already shown
+            scan_query += """
+                AND (wr.createtime < %s
+                    OR (wr.createtime = %s AND (wr.commithash, wr.repo, wr.id) < (%s, %s, %s)))
+            """
+            latest, commit_hash, repo = scan_after[:3]
+            run_id = scan_after[3] if len(scan_after) > 3 else -1
+            scan_params += [latest, latest, commit_hash, repo, run_id]
+        scan_query += """
+            ORDER BY wr.createtime DESC, wr.commithash DESC, wr.repo DESC, wr.id DESC
+            LIMIT %s
+        """
+        cursor.execute(scan_query, scan_params + [batch])
+        runs = cursor.fetchall()
+        candidates = []
+        for run in runs:
+            key = (run['commithash'], run['repo'])
+            if key not in seen:
+                seen.add(key)
+                candidates.append((run['createtime'], run['commithash'], run['repo']))
+        if candidates:
+            pairs = ", ".join(["(%s, %s)"] * len(candidates))
+            cursor.execute(f"""
+                SELECT wr.commithash, wr.repo, MAX(wr.createtime) AS latest
+                FROM workflowruns wr
+                WHERE (wr.commithash, wr.repo) IN ({pairs}) {filters}
+                GROUP BY wr.commithash, wr.repo
+            """, [v for _, commit_hash, repo in candidates for v in (commit_hash, repo)] + params)
+            latest = {(row['commithash'], row['repo']): row['latest'] for row in cursor.fetchall()}
+            for position in candidates:
+                if after is None or latest[position[1:]] == position[0]:
+                    commits.append({'commithash': position[1], 'repo': position[2],
+                                    'latest': position[0]})
+        if len(runs) < batch:
+            break
+        last = runs[-1]
+        scan_after = (last['createtime'], last['commithash'], last['repo'], last['run_id'])
+    return commits[:count]
+
+@app.route('/api/metrics/waterfall', methods=['GET'])
+@cached()
+def get_waterfall():
+    """Workflow runs grouped by commit, one status cell per workflow column
+
+    Commits are ordered by their most recent run and paginated with `limit`
+    and the `nextCursor` returned by the previous page.
+    """
+    try:
+        days = request.args.get('days', default=30, type=int)
+        limit = max(1, min(request.args.get('limit', default=50, type=int), 500))
+        repo_filter = request.args.get('repo', default=None)
+        branch_filter = request.args.get('branch', default='main', type=str)
+        cursor_arg = request.args.get('cursor')
+        if request.args.get('columns'):
+            columns = request.args.get('columns').split(',')
+        else:
+            columns = DEFAULT_WATERFALL_COLUMNS.get(repo_filter, DEFAULT_WATERFALL_FALLBACK)
+        column_index = {column: i for i, column in enumerate(columns)}
+
+        filters = " AND wr.createtime >= DATE_SUB(NOW(), INTERVAL %s DAY)"
         params = [days]
-        
         if repo_filter and repo_filter != 'all':
-            query += " AND wr.repo = %s"
+            filters += " AND wr.repo = %s"
             params.append(repo_filter)
-        
         if branch_filter and branch_filter != 'all':
-            query += " AND wr.branchname = %s"
+            filters += " AND wr.branchname = %s"
             params.append(branch_filter)
-            
-        query += """
-            ORDER BY wr.createtime DESC
-        """
-        
-        cursor.execute(query, params)
-        
-        runs = []
-        for row in cursor.fetchall():
-            # Initialize default results
-            results = {
-                'Linux': '?', 'Win': '?', 'Mac': '?', 
-                'Doc': '?', 'Lint': '?', 'Test': '?'
-            }
-            
-            # Parse concatenated results
-            if row['os']:
-                key = row['os']
-                if key.lower() == 'windows':
-                    key = 'Win'
-                elif key.lower() == 'macos':
-                    key = 'Mac'
-                
-                if key in results:
-                    results[key] = 'O' if row['conclusion'] == 'success' else ('X' if row['conclusion'] == 'failure' else '?')
-            
-            # Also check for special workflow types
-            if row['workflowname']:
-                if 'doc' in row['workflowname'].lower():
-                    results['Doc'] = 'O' if row['conclusion'] == 'success' else ('X' if row['conclusion'] == 'failure' else '?')
-                elif 'lint' in row['workflowname'].lower():
-                    results['Lint'] = 'O' if row['conclusion'] == 'success' else ('X' if row['conclusion'] == 'failure' else '?')
-                elif 'test' in row['workflowname'].lower():
-                    results['Test'] = 'O' if row['conclusion'] == 'success' else ('X' if row['conclusion'] == 'failure' else '?')
-
-            run = {
-                'workflowId': str(row['workflow_id']),
-                'gitid': str(row['gitid']),
-                'commitHash': str(row['commithash']),
-                'createTime': row['createtime'].isoformat() if row['createtime'] else None,
-                'repo': row['repo'],
-                'branch': row['branchname'],
-                'commitMessage': row['commit_message'] or '',
-                'author': row['author'],
-                'workflowUrl': row['workflow_url'],
-                'workflowname': row['workflowname'],
-                'conclusion': row['conclusion'],
-                'os': row['os'],
-                'results': results
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+
+            after = None
+            if cursor_arg:
+                try:
+                    after = tuple(decode_cursor(cursor_arg))
+                except (ValueError, TypeError):
+                    return jsonify({'error': 'Invalid cursor'}), 400
+            commits = waterfall_commits(cursor, filters, params, after, limit + 1)
+
+            has_more = len(commits) > limit
+            commits = commits[:limit]
+            runs = []
+            if commits:
+                pairs = ", ".join(["(%s, %s)"] * len(commits))
+                cursor.execute(f"""
+                    SELECT
+                        wr.commithash,
+                        wr.repo,
+                        wr.createtime,
+                        wr.branchname,
+                        wr.workflowname,
+                        wr.os,
+                        wr.conclusion,
+                        wr.author,
+                        wr.url as workflow_url,
+                        c.message as commit_message
+                    FROM workflowruns wr
+                    LEFT JOIN commits c ON wr.commithash = c.hash AND wr.repo = c.repo
+                    WHERE (wr.commithash, wr.repo) IN ({pairs}) {filters}
+                    ORDER BY wr.createtime DESC
+                """, [v for commit in commits for v in (commit['commithash'], commit['repo'])] + params)
+                runs = cursor.fetchall()
+            cursor.close()
+
+        rows = {}
+        for commit in commits:
+            rows[(commit['commithash'], commit['repo'])] = {
+                'commitHash': commit['commithash'],
+                'repo': commit['repo'],
+                'createTime': commit['latest'].isoformat() if commit['latest'] else None,
+                'cells': [None] * len(columns),
             }
-            runs.append(run)
+        # Runs arrive newest first, so the first run seen for a cell wins
+        for run in runs:
+            row = rows[(run['commithash'], run['repo'])]
+            if 'author' not in row:
+                row.update({
+                    'branch': run['branchname'],
+                    'author': run['author'],
+                    'commitMessage': run['commit_message'] or '',
+                    'workflowUrl': run['workflow_url'],
+                })
+            for key in run_column_keys(run):
+                i = column_index.get(key)
+                if i is not None and row['cells'][i] is None:
+                    row['cells'][i] = {'status': conclusion_status(run['conclusion']),
+                                       'url': run['workflow_url']}
 
-        cursor.close()
-        conn.close()
-        
-        app.logger.info(f"Returning {len(runs)} workflow runs")
-        return jsonify(runs)
+        next_cursor = None
+        if has_more:
+            last = commits[-1]
+            next_cursor = encode_cursor(last['latest'], last['commithash'], last['repo'])
+
+        return jsonify({
+            'columns': columns,
+            'rows': list(rows.values()),
+            'nextCursor': next_cursor
+        })
 
     except Exception as e:
-        app.logger.error(f"Workflow runs error: {str(e)}", exc_info=True)
+        app.logger.error(f"Waterfall error: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/metrics/flaky', methods=['GET'])
+@cached()
+def get_flaky_workflows():
+    """Workflows ranked by flake rate over the last `days` days
+
+    Read from workflow_flakiness. A commit is flaky for a workflow when the
+    workflow both failed and passed on it on the same OS.
+    """
+    try:
+        days = request.args.get('days', default=14, type=int)
+        limit = max(1, min(request.args.get('limit', default=20, type=int), 500))
+        min_commits = request.args.get('minCommits', default=5, type=int)
+        repo, branch = request_scope()
+
+        query = """
+            SELECT
+                repo,
+                workflowname,
+                SUM(commits) as commits,
+                SUM(flaky_commits) as flaky_commits,
+                SUM(runs) as runs,
+                SUM(failures) as failures,
+                SUM(flaky_failures) as flaky_failures,
+                SUM(flips) as flips,
+                SUM(recoveries) as recoveries
+            FROM workflow_flakiness
+            WHERE day >= %s
+        """
+        params = [(datetime.utcnow() - timedelta(days=days)).date()]
+        if repo:
+            query += " AND repo = %s"
+            params.append(repo)
+        if branch:
+            query += " AND branch = %s"
+            params.append(branch)
+        query += " GROUP BY repo, workflowname"
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+
+        workflows = [{
+            'repo': row['repo'],
+            'workflow': row['workflowname'],
+            'commits': int(row['commits']),
+            'flakyCommits': int(row['flaky_commits']),
+            'flakeRate': round(int(row['flaky_commits']) / int(row['commits']) * 100, 1),
+            'runs': int(row['runs']),
+            'failures': int(row['failures']),
+            'flakyFailures': int(row['flaky_failures']),
+            'flips': int(row['flips']),
+            'recoveries': int(row['recoveries']),
+        } for row in rows if int(row['commits']) >= max(min_commits, 1)]
+        workflows.sort(key=lambda w: (w['flakeRate'], w['flakyFailures']), reverse=True)
+
+        return jsonify({'days': days, 'workflows': workflows[:limit]})
+
+    except Exception as e:
+        app.logger.error(f"Flaky workflows error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
-    
+
+def repo_scope():
+    """Percentile sketches cover every branch of a repository"""
+    return request_scope()[0], None
+
+@app.route('/api/metrics/percentiles', methods=['GET'])
+@cached(scope=repo_scope)
+def get_percentiles():
+    """Queue time or runtime percentiles per day or week
+
+    Merges the daily sketches in workflowrun_sketches, so the cost grows with
+    the number of days and workflows in range, not with the number of runs.
+    """
+    try:
+        try:
+            span = parse_range(request.args.get('range', '30d'))
+            percentiles = [float(p) for p in request.args.get('q', '50,95,99').split(',')]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if any(p < 0 or p > 100 for p in percentiles):
+            return jsonify({'error': 'Percentiles must be between 0 and 100'}), 400
+        metric = request.args.get('metric', 'queuetime')
+        if metric not in run_sketches.METRICS:
+            return jsonify({'error': f"Invalid metric: {metric}"}), 400
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in ROLLUP_BUCKETS:
+            return jsonify({'error': f"Invalid bucket: {bucket}"}), 400
+        repo, _ = repo_scope()
+
+        query = "SELECT day, sketch FROM workflowrun_sketches WHERE metric = %s AND day >= %s"
+        params = [metric, (datetime.utcnow() - span).date()]
+        for column, value in (('repo', repo), ('workflowname', request.args.get('workflow')), ('os', request.args.get('os'))):
+            if value:
+                query += f" AND {column} = %s"
+                params.append(value)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            days = run_sketches.load(cursor.fetchall())
+            cursor.close()
+
+        buckets = {}
+        for day, sketch in days.items():
+            start = day - timedelta(days=day.weekday()) if bucket == 'week' else day
+            buckets.setdefault(start, run_sketches.Sketch()).merge(sketch)
+        overall = run_sketches.Sketch()
+        for sketch in buckets.values():
+            overall.merge(sketch)
+
+        def summary(sketch):
+            values = sketch.quantiles([p / 100 for p in percentiles])
+            row = {'count': sketch.count}
+            row.update((f"p{p:g}", None if v is None else round(v, 1)) for p, v in zip(percentiles, values))
+            return row
+
+        return jsonify({
+            'metric': metric,
+            'series': [dict(date=start.strftime('%Y-%m-%d'), **summary(buckets[start])) for start in sorted(buckets)],
+            'overall': summary(overall),
+        })
+
+    except Exception as e:
+        app.logger.error(f"Percentiles error: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+def format_run_event(row):
+    """Compact delta sent to waterfall clients for one changed run"""
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'gitid': str(row['gitid']),
+        'repo': row['repo'],
+        'branch': row['branchname'],
+        'commitHash': row['commithash'],
+        'workflowname': row['workflowname'],
+        'os': row['os'],
+        'status': row['status'],
+        'conclusion': row['conclusion'],
+        'result': conclusion_status(row['conclusion']),
+        'workflowUrl': row['url'],
+        'createTime': row['createtime'].isoformat() if row['createtime'] else None,
+        'queuetime': row['queuetime'],
+        'columns': run_column_keys(row),
+    }
+
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', 32))
+# Every open stream holds a server thread, so leave the rest for API requests
+event_hub = EventHub(
+    db_pool,
+    format_run_event,
+    interval=float(os.getenv('EVENT_POLL_INTERVAL', 1)),
+    max_queue=int(os.getenv('EVENT_CLIENT_QUEUE', 256)),
+    max_subscribers=int(os.getenv('SSE_MAX_CLIENTS', SERVER_THREADS // 2)),
+)
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+
+@app.route('/api/stream')
+def stream_events():
+    """Server-Sent Events stream of run changes, filtered by repo and branch
+
+    A `reset` event tells the client to reload and reconnect without a
+    Last-Event-ID, either because it asked to resume from an event that is
+    no longer buffered or because it fell too far behind. Once
+    SSE_MAX_CLIENTS streams are open, further clients get a 503.
+    """
+    repo, branch = request_scope()
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    try:
+        subscription = event_hub.subscribe(repo, branch, last_id)
+    except HubFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while subscription is not None and not subscription.overflowed:
+                try:
+                    event = subscription.queue.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    # Comment lines keep proxies from closing an idle stream
+                    yield ': heartbeat\n\n'
+                    continue
+                yield sse(event['id'], event['kind'], event)
+            yield 'event: reset\ndata: {}\n\n'
+        finally:
+            unsubscribe()
+
+    def unsubscribe():
+        if subscription is not None:
+            event_hub.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # Also covers clients that disconnect before the stream starts
+    response.call_on_close(unsubscribe)
+    return response
+
+@app.route('/api/stream/stats')
+def stream_stats():
+    return jsonify(event_hub.stats())
+
 @app.route('/api/metrics/repos')
 def get_repos():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        query = "SELECT Id, name FROM repos ORDER BY name"
-        cursor.execute(query)
-        
-        repos = []
-        for row in cursor.fetchall():
-            repos.append({
-                'id': row['Id'],
-                'name': row['name']
-            })
-            
-        cursor.close()
-        conn.close()
-        
-        return jsonify(repos)
+        return stream_query(
+            "SELECT Id, name FROM repos ORDER BY name",
+            (),
+            lambda row: {'id': row['Id'], 'name': row['name']},
+        )
     except Exception as e:
         app.logger.error(f"Error getting repos: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -239,38 +1018,92 @@ def get_repos():
 @app.route('/api/db-schema')
 def db_schema():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
         
-        # Get column information for workflowruns table
-        cursor.execute("""
-            SELECT COLUMN_NAME, DATA_TYPE 
-            FROM INFORMATION_SCHEMA.COLUMNS 
-            WHERE TABLE_NAME = 'workflowruns'
-            AND TABLE_SCHEMA = 'shark_dashboard_db'
-        """)
+            # Get column information for workflowruns table
+            if storage.dialect == 'sqlite':
+                cursor.execute("SELECT name AS COLUMN_NAME, type AS DATA_TYPE FROM pragma_table_info('workflowruns')")
+            else:
+                cursor.execute("""
+                    SELECT COLUMN_NAME, DATA_TYPE 
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_NAME = 'workflowruns'
+                    AND TABLE_SCHEMA = DATABASE()
+                """)
         
-        columns = cursor.fetchall()
+            columns = cursor.fetchall()
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         return jsonify(columns)
     except Exception as e:
         return jsonify({"error": str(e)})
-    
+
+Gauge(
+    'db_pool_connections',
+    'Connections of the API server pool by state',
+    lambda: {(state,): db_pool.stats()[state] for state in ('in_use', 'idle', 'waiting')},
+    ('state',),
+)
+Gauge(
+    'query_cache_requests_total',
+    'Response cache lookups by outcome',
+    lambda: {('hit',): query_cache.stats()['hits'], ('miss',): query_cache.stats()['misses']},
+    ('outcome',),
+    kind='counter',
+)
+Gauge('sse_subscribers', 'Open /api/stream connections', lambda: event_hub.stats()['subscribers'])
+Gauge('log_records_dropped_total', 'Log records dropped because the log queue was full', lambda: log_pipeline.stats()['dropped'], kind='counter')
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/cache')
+def cache_stats():
+    return jsonify(query_cache.stats())
+
+@app.route('/api/db-pool')
+def db_pool_stats():
+    return jsonify(db_pool.stats())
+
+# The build is loaded and compressed once at startup; rebuilds need a restart
+assets = AssetCache(BUILD_DIR)
+app.logger.info(f"Loaded {assets.load()} frontend assets")
+
+def send_asset(path):
+    asset = assets.get(path)
+    if asset is None:
+        return send_from_directory(BUILD_DIR, path)
+    encoding = assets.encoding(asset, request.accept_encodings)
+    body, etag = asset.variants[encoding]
+    response = Response(body, mimetype=asset.mimetype)
+    response.headers['Cache-Control'] = asset.cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/api/assets')
+def asset_stats():
+    return jsonify(assets.stats())
+
 # Serve React App - root path
 @app.route('/')
 def serve():
-    return send_from_directory(app.static_folder, 'index.html')
+    return send_asset('index.html')
 
 # Catch all routes to handle React Router
 @app.route('/<path:path>')
 def static_proxy(path):
-    return send_from_directory(app.static_folder, path)
+    return send_asset(path)
 
 if __name__ == '__main__':
     app.logger.info("Starting Flask application...")
     port = int(os.getenv('PORT', 80))
-    debug = os.getenv('FLASK_ENV') == 'development'
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    if os.getenv('FLASK_ENV') == 'development':
+        app.run(host='0.0.0.0', port=port, debug=True)
+    else:
+        serve_app(app, port=port, threads=SERVER_THREADS)
@@ -0,0 +1,227 @@
+import threading
+import time
+
+
+class BatchWriter:
+    """Groups writes arriving within a short window into executemany calls
+
+    Rows are buffered in arrival order. A background thread flushes the buffer
+    once `max_delay` seconds have passed since the first buffered row, or as soon
+    as `max_rows` rows are waiting. Each flush merges consecutive rows of the
+    same statement into one executemany, so statements still run in the order
+    they arrived, followed by a single commit. Statements added with
+    `last=True` run after all the others, once per distinct set of parameters,
+    which suits recomputing derived rows.
+
+    If the batch fails it is retried one row at a time, so a single bad row
+    only costs itself. If the database cannot be reached at all, the batch and
+    its callbacks go back to the front of the buffer and are retried after
+    `retry_delay` seconds. After `close()` those retries go on for at most
+    `close_timeout` seconds; rows still unwritten then are abandoned without
+    running their callbacks.
+    """
+
+    def __init__(
+        self, pool, max_rows=500, max_delay=0.05, retry_delay=1.0, close_timeout=10.0
+    ):
+        self.pool = pool
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.close_timeout = close_timeout
+        self._pending = []
+        self._pending_last = {}
+        self._pending_rows = 0
+        self._callbacks = []
+        self._first_at = None
+        self._retry_at = 0.0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._close_deadline = None
+        self._started = time.monotonic()
+        self._stats = {
+            "rows": 0,
+            "flushes": 0,
+            "errors": 0,
+            "retries": 0,
+            "dropped_rows": 0,
+            "abandoned_rows": 0,
+            "flush_time_total": 0.0,
+            "last_batch_rows": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, sql, params, last=False):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchWriter is closed")
+            if last:
+                self._pending_last.setdefault(sql, {})[tuple(params)] = None
+            else:
+                self._pending.append((sql, params))
+            self._pending_rows += 1
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            if self._pending_rows == 1 or self._pending_rows >= self.max_rows:
+                self._cond.notify()
+
+    def barrier(self, callback):
+        """Call `callback` once everything added before it has been committed
+
+        Callbacks wait with their batch while the database is unreachable.
+        """
+        with self._cond:
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            self._callbacks.append(callback)
+            self._cond.notify()
+
+    def _take(self):
+        batch = (self._pending, self._pending_last, self._callbacks)
+        self._pending = []
+        self._pending_last = {}
+        self._pending_rows = 0
+        self._callbacks = []
+        self._first_at = None
+        return batch
+
+    def _requeue(self, batch):
+        """Put a batch that could not be written back in front of newer rows"""
+        rows, last, callbacks = batch
+        with self._cond:
+            self._pending = rows + self._pending
+            for sql, params in last.items():
+                merged = dict(params)
+                merged.update(self._pending_last.get(sql, {}))
+                self._pending_last[sql] = merged
+            self._pending_rows = len(self._pending) + sum(
+                len(params) for params in self._pending_last.values()
+            )
+            self._callbacks = callbacks + self._callbacks
+            self._first_at = time.monotonic()
+            self._retry_at = self._first_at + self.retry_delay
+
+    @staticmethod
+    def _statements(rows, last):
+        """Merge consecutive rows of one statement into (sql, [params]) groups"""
+        groups = []
+        for sql, params in rows:
+            if groups and groups[-1][0] == sql:
+                groups[-1][1].append(params)
+            else:
+                groups.append((sql, [params]))
+        groups += [(sql, list(params)) for sql, params in last.items()]
+        return groups
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._first_at is None and not self._closed:
+                    self._cond.wait()
+                if self._first_at is None:
+                    return
+                while self._first_at is not None:
+                    now = time.monotonic()
+                    if self._closed and now >= self._close_deadline:
+                        self._abandon()
+                        return
+                    if now < self._retry_at:
+                        until = self._retry_at
+                        if self._closed:
+                            until = min(until, self._close_deadline)
+                        self._cond.wait(until - now)
+                        continue
+                    if self._closed or self._pending_rows >= self.max_rows:
+                        break
+                    remaining = self._first_at + self.max_delay - now
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+
+    def _abandon(self):
+        # Called with _cond held, once close_timeout has run out
+        rows, last, _ = self._take()
+        count = len(rows) + sum(len(params) for params in last.values())
+        self._stats["abandoned_rows"] += count
+        print(f"Abandoning {count} unwritten rows on close")
+
+    def _write(self, batch):
+        """Write `batch`; False means it was requeued and nothing committed"""
+        rows, last, _ = batch
+        statements = self._statements(rows, last)
+        if not statements:
+            return True
+        count = sum(len(params) for _, params in statements)
+        start = time.monotonic()
+        try:
+            with self.pool.connection() as conn:
+                c = conn.cursor()
+                try:
+                    for sql, params in statements:
+                        c.executemany(sql, params)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    self._stats["errors"] += 1
+                    print(f"Batch write of {count} rows failed, retrying row by row: {e}")
+                    self._write_rows(conn, c, statements)
+                c.close()
+        except Exception as e:
+            self._stats["retries"] += 1
+            print(f"Batch write of {count} rows failed, will retry: {e}")
+            self._requeue(batch)
+            return False
+        self._stats["rows"] += count
+        self._stats["flushes"] += 1
+        self._stats["last_batch_rows"] = count
+        self._stats["flush_time_total"] += time.monotonic() - start
+        return True
+
+    def _write_rows(self, conn, c, statements):
+        """Apply a failed batch one row at a time, skipping rows that fail alone
+
+        A failure on a connection that is no longer healthy is raised instead,
+        since then the row is not at fault and the whole batch is requeued.
+        """
+        for sql, params in statements:
+            for row in params:
+                try:
+                    c.execute(sql, row)
+                except Exception as e:
+                    if not self.pool._healthy(conn):
+                        raise
+                    self._stats["dropped_rows"] += 1
+                    print(f"Dropping row {row!r} for {sql.split()[0]}: {e}")
+        conn.commit()
+
+    def flush(self):
+        """Synchronously write everything buffered so far"""
+        # Taking and writing under one lock keeps batches in arrival order
+        with self._flush_lock:
+            with self._cond:
+                batch = self._take()
+            if self._write(batch):
+                for callback in batch[2]:
+                    callback()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._close_deadline = time.monotonic() + self.close_timeout
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        stats = dict(self._stats)
+        with self._cond:
+            stats["pending_rows"] = self._pending_rows
+        elapsed = time.monotonic() - self._started
+        flush_time = stats.pop("flush_time_total")
+        stats["rows_per_sec"] = stats["rows"] / elapsed if elapsed else 0.0
+        stats["avg_batch_rows"] = stats["rows"] / stats["flushes"] if stats["flushes"] else 0.0
+        stats["avg_flush_time"] = flush_time / stats["flushes"] if stats["flushes"] else 0.0
+        return stats
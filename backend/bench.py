@@ -0,0 +1,293 @@
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from resource import getrusage, RUSAGE_SELF
+
+import synthetic_data
+from migrate import Migrator
+from storage import open_storage
+
+# Endpoints driven by the API benchmark; {repo} is the busiest synthetic repo
+API_PATHS = [
+    "/api/metrics/dashboard?range=30d&repo={repo}",
+    "/api/metrics/dashboard?range=7d&bucket=hour&repo={repo}",
+    "/api/metrics/dashboard?range=1y&bucket=week&branch=all",
+    "/api/metrics/workflowruns?days=30&limit=500&repo={repo}",
+    "/api/metrics/workflowruns?days=7&limit=100&branch=all",
+    "/api/metrics/waterfall?days=30&repo={repo}",
+    "/api/metrics/repos",
+]
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted `values`"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+def drive(send, items, concurrency):
+    """Call `send(item)` for every item from `concurrency` threads
+
+    `send` returns a label (for example the endpoint) and whether the call
+    succeeded. Returns per-label latencies and error counts, and the elapsed
+    wall time.
+    """
+    items = iter(items)
+    lock = threading.Lock()
+    latencies, errors = {}, {}
+
+    def worker():
+        while True:
+            with lock:
+                item = next(items, None)
+            if item is None:
+                return
+            start = time.perf_counter()
+            try:
+                label, ok = send(item)
+            except Exception as e:
+                print(f"Request failed: {e}")
+                label, ok = "error", False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.setdefault(label, []).append(elapsed)
+                if not ok:
+                    errors[label] = errors.get(label, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def http(url, data=None):
+    """Status of a GET, or of a JSON POST when `data` is given"""
+    request = urllib.request.Request(url)
+    if data is not None:
+        request.data = json.dumps(data).encode()
+        request.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def bench_api(args, repo):
+    """Concurrent GETs against app.py, in process unless --url is given"""
+    if args.url:
+
+        def get(path):
+            return http(args.url.rstrip("/") + path)
+
+    else:
+        os.environ["DASHBOARD_DB"] = args.db
+        # One access log line per request would flood the report
+        os.environ.setdefault("LOG_LEVELS", "dashboard.access=WARNING")
+        if args.cold:
+            # Entries larger than a quarter of the cache are never stored
+            os.environ["QUERY_CACHE_MB"] = "0"
+        import app
+
+        local = threading.local()
+
+        def get(path):
+            if not hasattr(local, "client"):
+                local.client = app.app.test_client()
+            response = local.client.get(path)
+            response.get_data()
+            response.close()
+            return response.status_code
+
+    paths = [template.format(repo=repo) for template in API_PATHS]
+
+    def send(template_index):
+        status = get(paths[template_index])
+        return API_PATHS[template_index], status < 400
+
+    requests = itertools.islice(itertools.cycle(range(len(paths))), args.requests)
+    latencies, errors, elapsed = drive(send, requests, args.concurrency)
+    results = {
+        label: summarize(values, errors.get(label, 0), elapsed)
+        for label, values in latencies.items()
+    }
+    everything = [value for values in latencies.values() for value in values]
+    results["all"] = summarize(everything, sum(errors.values()), elapsed)
+    return results
+
+
+def bench_listener(args, generator):
+    """Replay webhook deliveries into listener.py and time acks and ingestion"""
+    payloads = itertools.islice(synthetic_data.webhooks(generator), args.events)
+    if args.listener_url:
+        base = args.listener_url.rstrip("/")
+
+        def post(payload):
+            return http(base + "/webhook", payload)
+
+        def pending():
+            with urllib.request.urlopen(base + "/stats") as response:
+                stats = json.load(response)
+            queue = stats["queue"]
+            return queue["enqueued"] - queue["processed"] - queue["failed"] + (
+                stats["writer"]["pending_rows"]
+            )
+
+        dashboard = None
+    else:
+        from listener import Dashboard
+
+        dashboard = Dashboard(
+            None,
+            generator.repos,
+            None,
+            db=args.db,
+            workers=args.workers,
+            spool_dir=tempfile.mkdtemp(prefix="bench-spool-"),
+        )
+        local = threading.local()
+
+        def post(payload):
+            if not hasattr(local, "client"):
+                local.client = dashboard.app.test_client()
+            return local.client.post("/webhook", json=payload).status_code
+
+        def pending():
+            queue = dashboard.ingest.stats()
+            return queue["enqueued"] - queue["processed"] - queue["failed"]
+
+    rejected = [0]
+
+    def send(payload):
+        # A full ingest queue answers 503; retry the way GitHub redelivers
+        while True:
+            status = post(payload)
+            if status != 503:
+                return "webhook", status == 202
+            rejected[0] += 1
+            time.sleep(0.05)
+
+    start = time.perf_counter()
+    latencies, errors, elapsed = drive(send, payloads, args.concurrency)
+    while pending():
+        time.sleep(0.01)
+    if dashboard is not None:
+        dashboard.writer.flush()
+    ingested = time.perf_counter() - start
+    results = summarize(latencies.get("webhook", []), sum(errors.values()), elapsed)
+    results["rejected"] = rejected[0]
+    results["ingest_seconds"] = ingested
+    results["events_per_sec"] = results["requests"] / ingested if ingested else 0.0
+    if dashboard is not None:
+        dashboard.stop()
+    return results
+
+
+def report(name, results):
+    print(
+        f"{name:<58} {results['requests']:>7} {results['errors']:>6}"
+        f" {results['throughput']:>9.1f} {results['p50_ms']:>8.1f}"
+        f" {results['p95_ms']:>8.1f} {results['p99_ms']:>8.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Bench",
+        description="load-test the API and listener against synthetic data",
+    )
+    parser.add_argument(
+        "--db", default="sqlite:///bench.db", help="database URL to benchmark"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=0,
+        help="generate this many synthetic runs into the database first",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="synthetic data seed")
+    parser.add_argument(
+        "--only", choices=("api", "listener"), help="run only one benchmark"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="concurrent clients"
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=2000, help="API requests to send"
+    )
+    parser.add_argument(
+        "--events", type=int, default=5000, help="webhook deliveries to replay"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="listener ingest worker threads"
+    )
+    parser.add_argument(
+        "--cold",
+        action="store_true",
+        help="disable the API response cache so every request runs its queries",
+    )
+    parser.add_argument("--url", help="benchmark a running app.py instead")
+    parser.add_argument("--listener-url", help="benchmark a running listener instead")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    generator = synthetic_data.Generator(max(args.runs, 1), seed=args.seed)
+    if args.runs:
+        storage = open_storage(args.db)
+        conn = storage.connect()
+        print(f"Generating {args.runs} synthetic runs")
+        synthetic_data.load(conn, generator)
+        # Indexes are cheaper to build once the data is in
+        Migrator(conn, storage.dialect).migrate()
+        conn.close()
+    results = {}
+    print(
+        f"{'benchmark':<58} {'reqs':>7} {'errors':>6} {'req/s':>9}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    if args.only in (None, "api"):
+        results["api"] = bench_api(args, generator.repos[0])
+        for label, summary in results["api"].items():
+            report(label, summary)
+    if args.only in (None, "listener"):
+        # A different seed, so replayed runs are new rows rather than updates
+        replay = synthetic_data.Generator(
+            args.events, seed=args.seed + 1, days=1
+        )
+        results["listener"] = bench_listener(args, replay)
+        report("webhook acks", results["listener"])
+        print(
+            f"Ingested {results['listener']['requests']} events in"
+            f" {results['listener']['ingest_seconds']:.1f}s"
+            f" ({results['listener']['events_per_sec']:.1f}/s),"
+            f" {results['listener']['rejected']} rejected with 503"
+        )
+    results["peak_rss_mb"] = getrusage(RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Peak memory: {results['peak_rss_mb']:.0f} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
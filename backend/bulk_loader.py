@@ -0,0 +1,118 @@
+import itertools
+import queue
+import threading
+
+
+def upsert_sql(table, columns, key_columns, rows):
+    """Build a multi-row INSERT ... ON DUPLICATE KEY UPDATE for `rows` rows"""
+    update = [column for column in columns if column not in key_columns]
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+        + ", ".join([placeholders] * rows)
+        + " ON DUPLICATE KEY UPDATE "
+        + ", ".join(f"{column} = VALUES({column})" for column in update)
+    )
+
+
+def bulk_upsert(cursor, table, columns, key_columns, rows, chunk_size=500):
+    """Upsert rows with one multi-row statement per chunk; returns rows written
+
+    `rows` may be any iterable; it is consumed one chunk at a time.
+    """
+    rows = iter(rows)
+    written = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return written
+        cursor.execute(
+            upsert_sql(table, columns, key_columns, len(chunk)),
+            [value for row in chunk for value in row],
+        )
+        written += len(chunk)
+
+
+_CLOSE = object()
+
+
+class BulkLoader:
+    """Writes rows from a producer thread in multi-row chunks on a background thread
+
+    The producer calls `add` for each row and `checkpoint` to run a statement
+    (for example saving sync progress) in the same transaction as the rows
+    added before it. Each chunk of `chunk_size` rows is written with one
+    statement and committed. The queue between the two threads is bounded, so
+    a slow database slows the producer down instead of buffering without limit.
+    Errors raised by the writer are re-raised in the producer.
+    """
+
+    def __init__(
+        self, conn, table, columns, key_columns, chunk_size=500, max_chunks=4
+    ):
+        self.conn = conn
+        self.table = table
+        self.columns = columns
+        self.key_columns = key_columns
+        self.chunk_size = chunk_size
+        self.written = 0
+        self._queue = queue.Queue(maxsize=chunk_size * max_chunks)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"load-{table}", daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, entry):
+        if self._error is not None:
+            raise self._error
+        while True:
+            try:
+                self._queue.put(entry, timeout=1)
+                return
+            except queue.Full:
+                if self._error is not None:
+                    raise self._error
+
+    def add(self, row):
+        self._put(("row", row))
+
+    def checkpoint(self, fn):
+        """Run fn(cursor) after the rows added so far, before their commit"""
+        self._put(("checkpoint", fn))
+
+    def _run(self):
+        c = self.conn.cursor()
+        rows, checkpoints = [], []
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is not _CLOSE:
+                    kind, value = entry
+                    (rows if kind == "row" else checkpoints).append(value)
+                    if len(rows) < self.chunk_size:
+                        continue
+                self.written += bulk_upsert(
+                    c, self.table, self.columns, self.key_columns, rows
+                )
+                for fn in checkpoints:
+                    fn(c)
+                self.conn.commit()
+                rows, checkpoints = [], []
+                if entry is _CLOSE:
+                    return
+        except Exception as e:
+            self._error = e
+            # Keep draining so a blocked producer notices the error
+            while True:
+                if self._queue.get() is _CLOSE:
+                    return
+        finally:
+            c.close()
+
+    def close(self):
+        """Write and commit everything added so far"""
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,189 @@
+import argparse
+import datetime
+
+from sqlauthenticator import connector
+from storage import MySQLStorage, Table, create_tables, open_storage
+
+# Upper bounds (seconds) of the histogram buckets; a last bucket holds the rest
+RUNTIME_BUCKETS = (60, 300, 900, 1800, 3600, 7200)
+QUEUETIME_BUCKETS = (10, 60, 300, 900, 1800, 3600)
+
+
+def _hist_columns(name, buckets):
+    return [f"{name}_hist_{i}" for i in range(len(buckets) + 1)]
+
+
+def _hist_sums(column, buckets):
+    sums = [f"SUM(wr.{column} < {bound})" for bound in buckets[:1]]
+    sums += [
+        f"SUM(wr.{column} >= {low} AND wr.{column} < {high})"
+        for low, high in zip(buckets, buckets[1:])
+    ]
+    sums.append(f"SUM(wr.{column} >= {buckets[-1]})")
+    return sums
+
+
+HIST_COLUMNS = _hist_columns("runtime", RUNTIME_BUCKETS) + _hist_columns(
+    "queuetime", QUEUETIME_BUCKETS
+)
+
+# One row per repository, branch, workflow and day. Only the workflow name
+# follows the day in the key, so a repo/branch range is one index scan.
+DAILY_STATS_TABLE = Table(
+    "workflowrun_daily_stats",
+    [
+        ("repo", "VARCHAR(50) NOT NULL"),
+        ("branch", "VARCHAR(255) NOT NULL"),
+        ("workflowname", "VARCHAR(255) NOT NULL"),
+        ("day", "DATE NOT NULL"),
+        ("total", "INT NOT NULL DEFAULT 0"),
+        ("success", "INT NOT NULL DEFAULT 0"),
+        ("failure", "INT NOT NULL DEFAULT 0"),
+        ("cancelled", "INT NOT NULL DEFAULT 0"),
+        ("runtime_sum", "DOUBLE NOT NULL DEFAULT 0"),
+        ("queuetime_sum", "DOUBLE NOT NULL DEFAULT 0"),
+    ]
+    + [(column, "INT NOT NULL DEFAULT 0") for column in HIST_COLUMNS],
+    primary_key=("repo", "branch", "day", "workflowname"),
+    indexes={"day": ("day",)},
+)
+
+STAT_COLUMNS = [
+    "total",
+    "success",
+    "failure",
+    "cancelled",
+    "runtime_sum",
+    "queuetime_sum",
+] + HIST_COLUMNS
+
+_AGGREGATES = ["COUNT(*)"] + [
+    f"COALESCE({total}, 0)"
+    for total in [
+        "SUM(wr.conclusion = 'success')",
+        "SUM(wr.conclusion = 'failure')",
+        "SUM(wr.conclusion = 'cancelled')",
+        "SUM(wr.runtime)",
+        "SUM(wr.queuetime)",
+    ]
+    + _hist_sums("runtime", RUNTIME_BUCKETS)
+    + _hist_sums("queuetime", QUEUETIME_BUCKETS)
+]
+
+
+def _refresh_sql(join, where):
+    return f"""
+    INSERT INTO workflowrun_daily_stats
+        (repo, branch, workflowname, day, {", ".join(STAT_COLUMNS)})
+    SELECT
+        COALESCE(wr.repo, ''),
+        COALESCE(wr.branchname, ''),
+        COALESCE(wr.workflowname, ''),
+        DATE(wr.createtime),
+        {", ".join(_AGGREGATES)}
+    FROM workflowruns wr
+    {join}
+    WHERE {where}
+    GROUP BY 1, 2, 3, 4
+    ON DUPLICATE KEY UPDATE
+        {", ".join(f"{column} = VALUES({column})" for column in STAT_COLUMNS)}
+"""
+
+
+# Buckets whose counts are stale. The listener marks a run's bucket before
+# and after writing the run, so when a run moves to another branch, workflow
+# or day the bucket it left is recounted as well as the one it joined.
+DIRTY_BUCKETS_TABLE = Table(
+    "workflowrun_daily_stats_dirty",
+    [
+        ("repo", "VARCHAR(50) NOT NULL"),
+        ("branch", "VARCHAR(255) NOT NULL"),
+        ("workflowname", "VARCHAR(255) NOT NULL"),
+        ("day", "DATE NOT NULL"),
+    ],
+    primary_key=("repo", "branch", "day", "workflowname"),
+)
+
+MARK_RUN_BUCKET = """
+    INSERT INTO workflowrun_daily_stats_dirty (repo, branch, workflowname, day)
+    SELECT
+        COALESCE(repo, ''),
+        COALESCE(branchname, ''),
+        COALESCE(workflowname, ''),
+        DATE(createtime)
+    FROM workflowruns
+    WHERE gitid = %s AND createtime IS NOT NULL
+    ON DUPLICATE KEY UPDATE day = VALUES(day)
+"""
+
+# Recounting the marked buckets takes these statements, in this order. Rows of
+# buckets left empty are deleted rather than kept with their old counts. They
+# are idempotent, so replayed or repeated events leave the buckets correct.
+REFRESH_MARKED_BUCKETS = [
+    """
+    DELETE FROM workflowrun_daily_stats
+    WHERE (repo, branch, workflowname, day) IN (
+        SELECT repo, branch, workflowname, day FROM workflowrun_daily_stats_dirty
+    )
+    """,
+    _refresh_sql(
+        """JOIN workflowrun_daily_stats_dirty d
+        ON COALESCE(wr.repo, '') = d.repo
+        AND COALESCE(wr.branchname, '') = d.branch
+        AND COALESCE(wr.workflowname, '') = d.workflowname""",
+        """wr.createtime >= d.day
+        AND wr.createtime < DATE(d.day) + INTERVAL 1 DAY""",
+    ),
+    "DELETE FROM workflowrun_daily_stats_dirty",
+]
+
+# Recounts every bucket of one day
+REFRESH_DAY = _refresh_sql(
+    "", "wr.createtime >= %s AND wr.createtime < %s + INTERVAL 1 DAY"
+)
+
+
+def rebuild(conn, since=None):
+    """Recompute the rollup one day at a time, committing after each day
+
+    Run times are stored in UTC, so days run up to the current UTC date.
+    """
+    create_tables(conn, [DAILY_STATS_TABLE])
+    c = conn.cursor()
+    c.execute("SELECT MIN(createtime) FROM workflowruns")
+    first = c.fetchone()[0]
+    if first is None:
+        c.close()
+        return 0
+    day = max(first.date(), since) if since else first.date()
+    days = 0
+    while day <= datetime.datetime.utcnow().date():
+        c.execute("DELETE FROM workflowrun_daily_stats WHERE day = %s", (day,))
+        c.execute(REFRESH_DAY, (day, day))
+        conn.commit()
+        day += datetime.timedelta(days=1)
+        days += 1
+    c.close()
+    return days
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Daily-Stats",
+        description="rebuild the workflowrun_daily_stats rollup from workflowruns",
+    )
+    parser.add_argument("-pwd", "--password", help="Password to remote database")
+    parser.add_argument(
+        "--db", help="database URL, e.g. sqlite:///dashboard.db (default: RDS)"
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.date.fromisoformat,
+        help="only rebuild days from this date (YYYY-MM-DD) on",
+    )
+    args = parser.parse_args()
+    storage = open_storage(args.db, MySQLStorage(lambda: connector(args.password)))
+    conn = storage.connect()
+    days = rebuild(conn, args.since)
+    conn.close()
+    print(f"Rebuilt {days} days of workflow run statistics")
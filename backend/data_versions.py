@@ -0,0 +1,75 @@
+import threading
+import time
+
+from storage import Table
+
+DATA_VERSIONS_TABLE = Table(
+    "data_versions",
+    [
+        ("repo", "VARCHAR(50) NOT NULL"),
+        ("branch", "VARCHAR(255) NOT NULL"),
+        ("version", "BIGINT NOT NULL DEFAULT 0"),
+    ],
+    primary_key=("repo", "branch"),
+)
+
+# Writers run this in the same transaction as the rows they change. An empty
+# branch means "anything in the repository may have changed".
+BUMP_VERSION = """
+    INSERT INTO data_versions (repo, branch, version)
+    VALUES (%s, %s, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1
+"""
+
+
+class DataVersions:
+    """Polls the data_versions table so readers can tell when data changed
+
+    `version(repo, branch)` returns a value that changes whenever a writer
+    bumps that repository and branch; `repo=None` or `branch=None` cover every
+    repository or every branch. Versions only ever grow, so sums are enough.
+    """
+
+    def __init__(self, pool, interval=5):
+        self.pool = pool
+        self.interval = interval
+        self._versions = {}
+        self._repo_totals = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="data-versions", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        try:
+            with self.pool.connection() as conn:
+                c = conn.cursor()
+                c.execute("SELECT repo, branch, version FROM data_versions")
+                rows = c.fetchall()
+                c.close()
+        except Exception as e:
+            print(f"Could not read data versions: {e}")
+            return
+        versions = {(repo, branch): version for repo, branch, version in rows}
+        repo_totals = {}
+        for (repo, _), version in versions.items():
+            repo_totals[repo] = repo_totals.get(repo, 0) + version
+        with self._lock:
+            self._versions = versions
+            self._repo_totals = repo_totals
+            self._total = sum(repo_totals.values())
+
+    def version(self, repo=None, branch=None):
+        with self._lock:
+            if repo is None:
+                return self._total
+            if branch is None:
+                return self._repo_totals.get(repo, 0)
+            return (
+                self._versions.get((repo, branch), 0),
+                self._versions.get((repo, ""), 0),
+            )
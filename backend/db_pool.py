@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection can be checked out within the timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of database connections with health checks and recycling"""
+
+    def __init__(self, factory, max_size=10, timeout=5.0, max_age=1800, max_idle=300):
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'in_use': 0,
+            'waiting': 0,
+            'checkouts': 0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'broken': 0,
+            'checkout_time_total': 0.0,
+            'checkout_time_max': 0.0,
+        }
+
+    def _expired(self, conn, idle_since):
+        now = time.monotonic()
+        if now - self._created.get(id(conn), now) > self.max_age:
+            return True
+        return now - idle_since > self.max_idle
+
+    @staticmethod
+    def _healthy(conn):
+        """Cheap liveness check run before handing out an idle connection"""
+        try:
+            if hasattr(conn, 'is_connected'):
+                return conn.is_connected()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Check out a connection, waiting up to `timeout` seconds"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            conn = self._reserve(deadline)
+            if conn is None:
+                break
+            # Health checks are network round trips, so they run outside the
+            # lock; a dead connection must not stall every other checkout.
+            if self._healthy(conn):
+                with self._cond:
+                    return self._checked_out(conn, start)
+            with self._cond:
+                self._stats['recycled'] += 1
+                self._stats['in_use'] -= 1
+                self._size -= 1
+                self._created.pop(id(conn), None)
+                self._cond.notify()
+            self._close(conn)
+
+        # Open new connections outside the lock so a slow handshake does not
+        # block threads returning connections to the pool.
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._stats['in_use'] -= 1
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created[id(conn)] = time.monotonic()
+            self._stats['created'] += 1
+            return self._checked_out(conn, start)
+
+    def _reserve(self, deadline):
+        """Take an idle connection, or a slot for a new one (returns None)
+
+        Either way the caller owns a slot counted in `_size` and `in_use`.
+        """
+        expired = []
+        try:
+            with self._cond:
+                self._stats['waiting'] += 1
+                try:
+                    while True:
+                        while self._idle:
+                            conn, idle_since = self._idle.pop()
+                            if self._expired(conn, idle_since):
+                                self._stats['recycled'] += 1
+                                self._size -= 1
+                                self._created.pop(id(conn), None)
+                                expired.append(conn)
+                                continue
+                            self._stats['in_use'] += 1
+                            return conn
+                        if self._size < self.max_size:
+                            self._size += 1
+                            self._stats['in_use'] += 1
+                            return None
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats['timeouts'] += 1
+                            raise PoolTimeout(
+                                f"no database connection available after {self.timeout}s"
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._stats['waiting'] -= 1
+        finally:
+            for conn in expired:
+                self._close(conn)
+
+    def _checked_out(self, conn, start):
+        elapsed = time.monotonic() - start
+        self._stats['checkouts'] += 1
+        self._stats['checkout_time_total'] += elapsed
+        self._stats['checkout_time_max'] = max(self._stats['checkout_time_max'], elapsed)
+        return conn
+
+    def release(self, conn, broken=False):
+        """Return a connection to the pool, closing it if it is broken"""
+        if not broken:
+            try:
+                # Never hand the next caller a connection with an open transaction
+                conn.rollback()
+            except Exception:
+                broken = True
+        with self._cond:
+            self._stats['in_use'] -= 1
+            if broken:
+                self._stats['broken'] += 1
+                self._size -= 1
+                self._created.pop(id(conn), None)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that always returns the connection to the pool"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not self._healthy(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close(self):
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            for conn in idle:
+                self._created.pop(id(conn), None)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['max_size'] = self.max_size
+        checkouts = stats.pop('checkout_time_total')
+        stats['checkout_time_avg'] = checkouts / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
@@ -0,0 +1,251 @@
+import argparse
+import datetime
+
+import pandas as pd
+
+from bulk_loader import bulk_upsert
+from sqlauthenticator import connector
+from storage import MySQLStorage, Table, create_tables, open_storage
+
+# Runs are grouped by repository, commit, workflow and OS; an OS matrix entry
+# that always fails on one platform is a real failure, not a flake
+GROUP = ["repo", "commithash", "workflowname", "os"]
+OUTCOMES = ("success", "failure")
+
+RUN_COLUMNS = [
+    "gitid",
+    "repo",
+    "branchname",
+    "workflowname",
+    "os",
+    "commithash",
+    "createtime",
+    "conclusion",
+]
+
+KEY_COLUMNS = ["repo", "branch", "workflowname", "os", "day"]
+STAT_COLUMNS = [
+    "commits",
+    "flaky_commits",
+    "runs",
+    "failures",
+    "flaky_failures",
+    "flips",
+    "recoveries",
+]
+
+# One row per repository, branch, workflow, OS and day. A commit's runs of a
+# workflow on one OS count towards the branch and day of the first of them.
+FLAKINESS_TABLE = Table(
+    "workflow_flakiness",
+    [
+        ("repo", "VARCHAR(50) NOT NULL"),
+        ("branch", "VARCHAR(255) NOT NULL"),
+        ("workflowname", "VARCHAR(255) NOT NULL"),
+        ("os", "VARCHAR(100) NOT NULL"),
+        ("day", "DATE NOT NULL"),
+    ]
+    + [(column, "INT NOT NULL DEFAULT 0") for column in STAT_COLUMNS],
+    primary_key=("repo", "branch", "day", "workflowname", "os"),
+    indexes={"day": ("day",)},
+)
+
+_OUTCOME_FILTER = "conclusion IN ('success', 'failure') AND commithash IS NOT NULL"
+
+RUNS_BETWEEN = f"""
+    SELECT {", ".join(RUN_COLUMNS)}
+    FROM workflowruns
+    WHERE createtime >= %s AND createtime < %s AND {_OUTCOME_FILTER}
+"""
+
+RUN_KEYS = """
+    SELECT repo, commithash, workflowname, os
+    FROM workflowruns
+    WHERE gitid IN ({})
+"""
+
+# Each query is driven by the index whose leading column it fixes: the
+# commit index for runs of given commits, idx_wr_sketch for one day of one
+# workflow on one OS
+DAYS_OF_COMMITS = """
+    SELECT DISTINCT repo, commithash, workflowname, os, DATE(createtime)
+    FROM workflowruns
+    WHERE commithash IN ({})
+"""
+
+COMMITS_OF_DAY = """
+    SELECT DISTINCT commithash
+    FROM workflowruns
+    WHERE repo <=> %s
+        AND workflowname <=> %s
+        AND os <=> %s
+        AND createtime >= %s
+        AND createtime < %s + INTERVAL 1 DAY
+"""
+
+COMMIT_RUNS = f"""
+    SELECT {", ".join(RUN_COLUMNS)}
+    FROM workflowruns
+    WHERE commithash IN ({{}}) AND repo <=> %s AND {_OUTCOME_FILTER}
+"""
+
+
+def score(runs):
+    """Flakiness counts per repository, branch, workflow and day
+
+    `runs` is a DataFrame with RUN_COLUMNS. A group of runs (see GROUP) that
+    both failed and succeeded is flaky, and its failures are flaky failures.
+    Flips count outcome changes between consecutive runs of a group and
+    recoveries the failures followed by a success.
+    """
+    runs = runs[runs.conclusion.isin(OUTCOMES) & runs.commithash.notna()]
+    if runs.empty:
+        return pd.DataFrame(columns=KEY_COLUMNS + STAT_COLUMNS)
+    runs = runs.fillna({"repo": "", "branchname": "", "workflowname": "", "os": ""})
+    runs = runs.assign(createtime=pd.to_datetime(runs.createtime))
+    runs = runs.sort_values(["createtime", "gitid"], kind="stable")
+    failed = runs.conclusion.eq("failure").astype(int)
+    previous = failed.groupby([runs[column] for column in GROUP], sort=False).shift()
+    flip = previous.notna() & failed.ne(previous)
+    runs = runs.assign(failed=failed, flip=flip, recovery=flip & failed.eq(0))
+    groups = runs.groupby(GROUP, sort=False).agg(
+        branch=("branchname", "first"),
+        day=("createtime", "first"),
+        runs=("failed", "size"),
+        failures=("failed", "sum"),
+        flips=("flip", "sum"),
+        recoveries=("recovery", "sum"),
+    )
+    flaky = (groups.failures > 0) & (groups.failures < groups.runs)
+    groups = groups.assign(
+        day=groups.day.dt.date,
+        commits=1,
+        flaky_commits=flaky.astype(int),
+        flaky_failures=groups.failures.where(flaky, 0),
+    )
+    return groups.reset_index().groupby(KEY_COLUMNS, as_index=False)[
+        STAT_COLUMNS
+    ].sum()
+
+
+def _frame(cursor):
+    return pd.DataFrame(cursor.fetchall(), columns=RUN_COLUMNS)
+
+
+def store(cursor, scores):
+    rows = (
+        tuple(row[: len(KEY_COLUMNS)]) + tuple(int(v) for v in row[len(KEY_COLUMNS) :])
+        for row in scores.itertuples(index=False)
+    )
+    return bulk_upsert(
+        cursor, FLAKINESS_TABLE.name, KEY_COLUMNS + STAT_COLUMNS, KEY_COLUMNS, rows
+    )
+
+
+def _chunks(values, chunk_size=500):
+    values = list(values)
+    for start in range(0, len(values), chunk_size):
+        yield values[start : start + chunk_size]
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def refresh(cursor, gitids):
+    """Recount every day the commits of these runs ran the same workflows on
+
+    Days are recounted from their runs, so they are correct however often
+    a run is refreshed. Returns the repositories whose counts changed.
+    """
+    keys = set()
+    for chunk in _chunks(gitids):
+        cursor.execute(RUN_KEYS.format(_placeholders(chunk)), chunk)
+        keys.update(cursor.fetchall())
+    days = set()
+    for chunk in _chunks({commithash for _, commithash, _, _ in keys}):
+        cursor.execute(DAYS_OF_COMMITS.format(_placeholders(chunk)), chunk)
+        days.update(
+            (repo, workflow, os, day)
+            for repo, commithash, workflow, os, day in cursor.fetchall()
+            if (repo, commithash, workflow, os) in keys
+        )
+    # One frame for every day, so scoring is one vectorized pass
+    runs = {}
+    for repo, workflow, os, day in days:
+        cursor.execute(COMMITS_OF_DAY, (repo, workflow, os, day, day))
+        for chunk in _chunks(commithash for (commithash,) in cursor.fetchall()):
+            cursor.execute(COMMIT_RUNS.format(_placeholders(chunk)), chunk + [repo])
+            runs.update((row[0], row) for row in cursor.fetchall())
+    scores = score(pd.DataFrame(list(runs.values()), columns=RUN_COLUMNS))
+    days = {
+        (repo or "", workflow or "", os or "", day) for repo, workflow, os, day in days
+    }
+    for day in days:
+        cursor.execute(
+            "DELETE FROM workflow_flakiness WHERE repo = %s AND workflowname = %s"
+            " AND os = %s AND day = %s",
+            day,
+        )
+    # The same commits' other workflows, and commits that first ran the
+    # workflow on an earlier day, belong to other rows
+    keep = [
+        (row.repo, row.workflowname, row.os, row.day) in days
+        for row in scores.itertuples(index=False)
+    ]
+    store(cursor, scores[pd.Series(keep, index=scores.index, dtype=bool)])
+    return {repo for repo, _, _, _ in days}
+
+
+def rebuild(conn, since=None, window_days=30, lookback_days=7):
+    """Recount flakiness `window_days` at a time, committing after each window
+
+    Each window also reads the runs of the `lookback_days` on either side,
+    so commits whose runs straddle a window edge are counted whole, on the
+    day of their first run.
+    """
+    create_tables(conn, [FLAKINESS_TABLE])
+    c = conn.cursor()
+    c.execute("SELECT MIN(createtime) FROM workflowruns")
+    first = c.fetchone()[0]
+    if first is None:
+        c.close()
+        return 0
+    start = day = max(first.date(), since) if since else first.date()
+    lookback = datetime.timedelta(days=lookback_days)
+    # Run times are UTC, so the last day is the current UTC date
+    today = datetime.datetime.utcnow().date()
+    while day <= today:
+        end = day + datetime.timedelta(days=window_days)
+        c.execute(RUNS_BETWEEN, (day - lookback, end + lookback))
+        scores = score(_frame(c))
+        c.execute(
+            "DELETE FROM workflow_flakiness WHERE day >= %s AND day < %s", (day, end)
+        )
+        store(c, scores[(scores.day >= day) & (scores.day < end)])
+        conn.commit()
+        day = end
+    c.close()
+    return (today - start).days + 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Flaky-Runs",
+        description="rebuild the workflow_flakiness counts from workflowruns",
+    )
+    parser.add_argument("-pwd", "--password", help="Password to remote database")
+    parser.add_argument(
+        "--db", help="database URL, e.g. sqlite:///dashboard.db (default: RDS)"
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.date.fromisoformat,
+        help="only rebuild days from this date (YYYY-MM-DD) on",
+    )
+    args = parser.parse_args()
+    storage = open_storage(args.db, MySQLStorage(lambda: connector(args.password)))
+    conn = storage.connect()
+    days = rebuild(conn, args.since)
+    conn.close()
+    print(f"Rebuilt {days} days of workflow flakiness")
@@ -0,0 +1,257 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_API_URL = "https://api.github.com"
+
+
+class RateLimiter:
+    """Caps concurrent requests and shrinks the cap as the rate limit runs out
+
+    Every response reports X-RateLimit-Remaining and X-RateLimit-Reset. With
+    plenty of budget left all `max_concurrency` slots are used; below
+    `low_water` remaining requests the limiter drops to one request at a time,
+    and at zero it blocks everyone until the reset time.
+    """
+
+    def __init__(self, max_concurrency=8, low_water=500):
+        self.max_concurrency = max_concurrency
+        self.low_water = low_water
+        self.limit = max_concurrency
+        self.remaining = None
+        self.reset_at = 0.0
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                pause = self.reset_at - time.time() if self.remaining == 0 else 0
+                if pause > 0:
+                    self._cond.wait(pause)
+                    continue
+                if self._active < self.limit:
+                    self._active += 1
+                    return
+                self._cond.wait()
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def update(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None:
+            return
+        with self._cond:
+            self.remaining = int(remaining)
+            if reset is not None:
+                self.reset_at = float(reset)
+            if self.remaining == 0:
+                self.limit = 1
+            elif self.remaining < self.low_water:
+                share = self.max_concurrency * self.remaining // self.low_water
+                self.limit = max(1, share)
+            else:
+                self.limit = self.max_concurrency
+            self._cond.notify_all()
+
+    def pause_until(self, when):
+        with self._cond:
+            self.remaining = 0
+            self.reset_at = max(self.reset_at, when)
+
+
+class MemoryEtagStore:
+    """Least-recently-used ETag cache kept for the life of the client
+
+    Stores map a request key to (etag, body). A `persistent` store keeps its
+    entries across runs, so GitHubClient also caches every page of a listing
+    in it rather than just the first.
+    """
+
+    persistent = False
+
+    def __init__(self, size=256):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached:
+                self._entries.move_to_end(key)
+            return cached
+
+    def put(self, key, etag, body):
+        with self._lock:
+            self._entries[key] = (etag, body)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class GitHubClient:
+    """Minimal REST client for the GitHub API used by populate_db.py
+
+    Requests share a connection pool and are throttled by a RateLimiter.
+    GET responses are cached by ETag in `etags` (in memory unless a persistent
+    store such as populate_db's DatabaseEtagStore is given), so repeating a
+    request, in this run or a later one, sends If-None-Match and a 304 (which
+    does not count against the rate limit) returns the cached body. Transient failures and rate-limit responses are
+    retried with jittered exponential backoff. `base_url` can point at a local
+    fake API server for testing.
+    """
+
+    def __init__(
+        self,
+        token=None,
+        base_url=DEFAULT_API_URL,
+        max_workers=8,
+        max_retries=5,
+        backoff=1.0,
+        max_backoff=60.0,
+        timeout=30,
+        etag_cache_size=256,
+        etags=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        self.limiter = RateLimiter(max_workers)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="github")
+        self.max_workers = max_workers
+        self.etags = etags or MemoryEtagStore(etag_cache_size)
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "not_modified": 0, "retries": 0}
+
+    def _url(self, path):
+        return path if path.startswith("http") else self.base_url + path
+
+    def _count(self, name):
+        # Requests run on the executor threads
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _sleep_before_retry(self, attempt, response=None):
+        self._count("retries")
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                time.sleep(float(retry_after))
+                return
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                reset = float(response.headers.get("X-RateLimit-Reset", time.time()))
+                self.limiter.pause_until(reset + 1)
+                return
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        time.sleep(random.uniform(delay / 2, delay))
+
+    def get(self, path, params=None, cache=True):
+        """GET a path and return (json, response)
+
+        With `cache=False` the ETag store is neither read nor written.
+        """
+        url = self._url(path)
+        key = url
+        if params:
+            key += "?" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+        for attempt in range(self.max_retries + 1):
+            headers = {}
+            cached = self.etags.get(key) if cache else None
+            if cached:
+                headers["If-None-Match"] = cached[0]
+            self.limiter.acquire()
+            try:
+                self._count("requests")
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"GitHub request to {url} failed ({e}), retrying")
+                self._sleep_before_retry(attempt)
+                continue
+            finally:
+                self.limiter.release()
+            self.limiter.update(response.headers)
+            if response.status_code == 304 and cached:
+                self._count("not_modified")
+                return cached[1], response
+            if response.status_code == 429 or response.status_code >= 500 or (
+                response.status_code == 403
+                and (
+                    response.headers.get("X-RateLimit-Remaining") == "0"
+                    or "Retry-After" in response.headers
+                )
+            ):
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                self._sleep_before_retry(attempt, response)
+                continue
+            response.raise_for_status()
+            body = response.json()
+            etag = response.headers.get("ETag")
+            if etag and cache:
+                self.etags.put(key, etag, body)
+            return body, response
+
+    def paginate(self, path, params=None, key=None):
+        """Yield items from every page, fetching the next page in the background
+
+        `key` names the list inside the response object for endpoints such as
+        /actions/runs that wrap their results. Only the first page is cached for
+        conditional requests, unless the ETag store is persistent; at most one
+        page is buffered ahead of the consumer.
+        """
+        params = dict(params or {})
+        params.setdefault("per_page", 100)
+        future = self.executor.submit(self.get, path, params)
+        while future is not None:
+            body, response = future.result()
+            next_url = response.links.get("next", {}).get("url")
+            # The next URL already carries the query string
+            future = (
+                self.executor.submit(
+                    self.get, next_url, cache=self.etags.persistent
+                )
+                if next_url
+                else None
+            )
+            yield from (body[key] if key else body)
+
+    def map(self, fn, items, window=None):
+        """Like map(), but runs fn concurrently with at most `window` calls in flight
+
+        Results are yielded in input order, and `items` is consumed lazily.
+        """
+        window = window or self.max_workers * 2
+        pending = deque()
+        for item in items:
+            pending.append(self.executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
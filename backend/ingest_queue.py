@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class IngestQueue:
+    """Bounded in-process queues drained by a pool of worker threads
+
+    Each worker drains its own queue and items are routed to a worker by
+    `key(item)`, so items with the same key are handled one at a time and in
+    the order they were submitted. `submit` never blocks for longer than
+    `put_timeout`; when the item's queue is full it returns False so the caller
+    can push back on the sender.
+    """
+
+    def __init__(self, handler, workers=4, max_size=1000, put_timeout=0.0, key=None):
+        self.handler = handler
+        self.put_timeout = put_timeout
+        self.key = key
+        self.max_size = max_size
+        per_worker = max(1, -(-max_size // workers))
+        self._queues = [queue.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._accepting = True
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+            "enqueue_time_total": 0.0,
+            "enqueue_time_max": 0.0,
+            "process_time_total": 0.0,
+            "process_time_max": 0.0,
+            "wait_time_total": 0.0,
+        }
+        self._workers = [
+            threading.Thread(
+                target=self._run, args=(q,), name=f"ingest-{i}", daemon=True
+            )
+            for i, q in enumerate(self._queues)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, item, timeout=None):
+        """Queue an item for processing; returns False if it was rejected"""
+        if not self._accepting:
+            return False
+        if timeout is None:
+            timeout = self.put_timeout
+        start = time.monotonic()
+        target = self._queue_for(item)
+        try:
+            if timeout:
+                target.put((item, start), timeout=timeout)
+            else:
+                target.put_nowait((item, start))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._stats["enqueued"] += 1
+            self._stats["enqueue_time_total"] += elapsed
+            self._stats["enqueue_time_max"] = max(
+                self._stats["enqueue_time_max"], elapsed
+            )
+        return True
+
+    def _queue_for(self, item):
+        if self.key is None or len(self._queues) == 1:
+            return min(self._queues, key=lambda q: q.qsize())
+        return self._queues[hash(self.key(item)) % len(self._queues)]
+
+    def _run(self, items):
+        while True:
+            entry = items.get()
+            try:
+                if entry is _STOP:
+                    return
+                item, enqueued_at = entry
+                start = time.monotonic()
+                failed = False
+                try:
+                    self.handler(item)
+                except Exception as e:
+                    failed = True
+                    print(f"Ingest worker failed to process event: {e}")
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self._stats["failed" if failed else "processed"] += 1
+                    self._stats["wait_time_total"] += start - enqueued_at
+                    self._stats["process_time_total"] += elapsed
+                    self._stats["process_time_max"] = max(
+                        self._stats["process_time_max"], elapsed
+                    )
+            finally:
+                items.task_done()
+
+    def shutdown(self, timeout=30.0):
+        """Stop accepting new items and wait for queued ones to be processed"""
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        while (
+            any(q.unfinished_tasks for q in self._queues)
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.05)
+        for q in self._queues:
+            q.put(_STOP)
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats["processed"] + stats["failed"]
+        enqueue_time = stats.pop("enqueue_time_total")
+        process_time = stats.pop("process_time_total")
+        wait_time = stats.pop("wait_time_total")
+        stats["depth"] = self.depth()
+        stats["capacity"] = self.max_size
+        stats["enqueue_time_avg"] = (
+            enqueue_time / stats["enqueued"] if stats["enqueued"] else 0.0
+        )
+        stats["process_time_avg"] = process_time / done if done else 0.0
+        stats["wait_time_avg"] = wait_time / done if done else 0.0
+        return stats
@@ -5,154 +5,74 @@ import datetime
 import time
 import argparse
 import json
+from bulk_loader import bulk_upsert
+from data_versions import DATA_VERSIONS_TABLE, BUMP_VERSION
+from run_events import RUN_EVENTS_TABLE
+from storage import SCHEMA, SQLiteStorage, create_tables
+import daily_stats
+import flaky_runs
+import run_sketches
+from daily_stats import DAILY_STATS_TABLE, DIRTY_BUCKETS_TABLE
+from flaky_runs import FLAKINESS_TABLE
+from run_sketches import SKETCH_TABLE
 
 def init_database(db_file):
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-    c.execute("PRAGMA foreign_keys = ON;")
-
-    # Create tables
-    tables = [
-        """
-        CREATE TABLE IF NOT EXISTS repos (
-            id INTEGER PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS branches (
-            id INTEGER PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL,
-            author TEXT,
-            repo TEXT NOT NULL
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS commits (
-            id INTEGER PRIMARY KEY,
-            hash TEXT UNIQUE NOT NULL,
-            author TEXT,
-            message TEXT,
-            time REAL NOT NULL,
-            repo TEXT NOT NULL
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS workflows (
-            id INTEGER PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL,
-            url TEXT NOT NULL,
-            repo TEXT NOT NULL
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS workflowruns (
-            id INTEGER PRIMARY KEY,
-            branch INTEGER NOT NULL,
-            commitid INTEGER NOT NULL,
-            workflow INTEGER NOT NULL,
-            author TEXT,
-            runtime REAL DEFAULT 0.0,
-            createtime REAL,
-            starttime REAL,
-            endtime REAL,
-            queuetime REAL DEFAULT 0.0,
-            status TEXT,
-            conclusion TEXT,
-            url TEXT,
-            gitid INT UNIQUE,
-            archivedbranchname TEXT,
-            archivedcommithash TEXT,
-            archivedworkflowname TEXT,
-            repo TEXT NOT NULL
-        )
-        """
-    ]
-
-    for table in tables:
-        c.execute(table)
-    
-    conn.commit()
+    conn = SQLiteStorage(db_file).connect()
+    create_tables(conn, SCHEMA + [DATA_VERSIONS_TABLE, DAILY_STATS_TABLE, DIRTY_BUCKETS_TABLE, RUN_EVENTS_TABLE, SKETCH_TABLE, FLAKINESS_TABLE])
     conn.close()
 
-def get_branch_id(cursor, branch_name, repo):
-    """Get branch ID or insert if not exists"""
-    cursor.execute("SELECT id FROM branches WHERE name = ? AND repo = ?", (branch_name, repo))
-    result = cursor.fetchone()
-    if result:
-        return result[0]
-    
-    cursor.execute("INSERT INTO branches (name, repo) VALUES (?, ?)", (branch_name, repo))
-    return cursor.lastrowid
-
-def get_commit_id(cursor, commit_hash, repo):
-    """Get commit ID or return None if not found"""
-    cursor.execute("SELECT id FROM commits WHERE hash = ? AND repo = ?", (commit_hash, repo))
-    result = cursor.fetchone()
-    return result[0] if result else None
-
-def get_workflow_id(cursor, workflow_name, repo):
-    """Get workflow ID or return None if not found"""
-    cursor.execute("SELECT id FROM workflows WHERE name = ? AND repo = ?", (workflow_name, repo))
-    result = cursor.fetchone()
-    return result[0] if result else None
+def to_datetime(value):
+    """Times in the JSON data may be unix timestamps or ISO strings"""
+    if value is None or isinstance(value, str):
+        return value and datetime.datetime.fromisoformat(value.replace('Z', ''))
+    return datetime.datetime.utcfromtimestamp(value)
 
 def update_database(db_file, repo_name, workflow_data):
     """Update database with provided workflow data"""
-    conn = sqlite3.connect(db_file)
+    conn = SQLiteStorage(db_file).connect()
     c = conn.cursor()
 
     try:
-        # Insert repo if not exists
-        c.execute("INSERT OR IGNORE INTO repos (name) VALUES (?)", (repo_name,))
-
-        # Update branches
-        for branch in workflow_data.get('branches', []):
-            c.execute(
-                "INSERT OR REPLACE INTO branches (name, repo) VALUES (?, ?)",
-                (branch['name'], repo_name)
-            )
-
-        # Update commits
-        for commit in workflow_data.get('commits', []):
-            c.execute(
-                "INSERT OR REPLACE INTO commits (hash, author, message, time, repo) VALUES (?, ?, ?, ?, ?)",
-                (commit['hash'], commit['author'], commit['message'], commit['time'], repo_name)
+        c.execute(
+            "INSERT INTO repos (name) VALUES (%s) ON DUPLICATE KEY UPDATE name = VALUES(name)",
+            (repo_name,)
+        )
+        bulk_upsert(
+            c, 'branches', ('name', 'repo'), ('name',),
+            ((branch['name'], repo_name) for branch in workflow_data.get('branches', []))
+        )
+        bulk_upsert(
+            c, 'commits', ('hash', 'author', 'message', 'time', 'repo'), ('hash',),
+            (
+                (commit['hash'], commit['author'], commit['message'], to_datetime(commit['time']), repo_name)
+                for commit in workflow_data.get('commits', [])
             )
-
-        # Update workflows
-        for workflow in workflow_data.get('workflows', []):
-            c.execute(
-                "INSERT OR REPLACE INTO workflows (name, url, repo) VALUES (?, ?, ?)",
-                (workflow['name'], workflow['url'], repo_name)
+        )
+        bulk_upsert(
+            c, 'workflows', ('name', 'url', 'repo'), ('name',),
+            ((workflow['name'], workflow['url'], repo_name) for workflow in workflow_data.get('workflows', []))
+        )
+        bulk_upsert(
+            c, 'workflowruns',
+            ('gitid', 'author', 'runtime', 'createtime', 'starttime', 'endtime', 'queuetime',
+             'status', 'conclusion', 'url', 'branchname', 'commithash', 'workflowname', 'repo'),
+            ('gitid',),
+            (
+                (
+                    run['gitid'], run['author'], run['runtime'], to_datetime(run['createtime']),
+                    to_datetime(run['starttime']), to_datetime(run['endtime']), run['queuetime'],
+                    run['status'], run['conclusion'], run['url'],
+                    run['branch_name'], run['commit_hash'], run['workflow_name'], repo_name
+                )
+                for run in workflow_data.get('workflow_runs', [])
             )
-
-        # Update workflow runs
-        for run in workflow_data.get('workflow_runs', []):
-            # Get required foreign keys
-            branch_id = get_branch_id(c, run['branch_name'], repo_name)
-            commit_id = get_commit_id(c, run['commit_hash'], repo_name)
-            workflow_id = get_workflow_id(c, run['workflow_name'], repo_name)
-
-            if commit_id is None or workflow_id is None:
-                print(f"Skipping workflow run - Missing references for commit {run['commit_hash']} or workflow {run['workflow_name']}")
-                continue
-
-            c.execute("""
-                INSERT OR REPLACE INTO workflowruns 
-                (branch, commitid, workflow, author, runtime, createtime, starttime, 
-                endtime, queuetime, status, conclusion, url, gitid, 
-                archivedbranchname, archivedcommithash, archivedworkflowname, repo)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                branch_id, commit_id, workflow_id, run['author'], run['runtime'],
-                run['createtime'], run['starttime'], run['endtime'], run['queuetime'],
-                run['status'], run['conclusion'], run['url'], run['gitid'],
-                run['branch_name'], run['commit_hash'], run['workflow_name'], repo_name
-            ))
-
+        )
+        c.execute(BUMP_VERSION, (repo_name, ''))
         conn.commit()
+        daily_stats.rebuild(conn)
+        run_sketches.rebuild(conn)
+        flaky_runs.rebuild(conn)
 
     except Exception as e:
         print(f"Error updating database: {e}")
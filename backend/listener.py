@@ -2,37 +2,258 @@ from github import Github
 import datetime, time
 import numpy as np
 import pandas as pd
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import tqdm
 import pickle
 import os
 import argparse
 from sqlauthenticator import connector
+from server import serve
+from storage import SCHEMA, MySQLStorage, create_tables, open_storage
+from db_pool import ConnectionPool
+from batch_writer import BatchWriter
+from ingest_queue import IngestQueue
+from spool import Spool
+from repo_registry import RepoRegistry
+from data_versions import DATA_VERSIONS_TABLE, BUMP_VERSION
+from daily_stats import (
+    DAILY_STATS_TABLE,
+    DIRTY_BUCKETS_TABLE,
+    MARK_RUN_BUCKET,
+    REFRESH_MARKED_BUCKETS,
+)
+import flaky_runs
+import run_sketches
+from run_refresher import RunRefresher
+from run_events import RUN_EVENTS_TABLE, RECORD_EVENT, PRUNE_EVENTS, RUN_EVENT_KINDS
+from metrics import (
+    CONTENT_TYPE,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    TimedConnection,
+    render,
+)
 import json
+import signal
+import sys
+import threading
+
+WEBHOOK_EVENTS = Counter(
+    "webhook_events_total",
+    "Webhook deliveries by GitHub event type, action and outcome",
+    ("event", "action", "outcome"),
+)
+INGEST_LAG = Histogram(
+    "ingest_lag_seconds",
+    "Time from receiving a webhook until its rows were committed",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
 
 
 class Dashboard:
 
-    def __init__(self, key, repo, password, port=5000):
+    def __init__(
+        self,
+        key,
+        repos,
+        password,
+        port=5000,
+        config=None,
+        pool_size=5,
+        batch_rows=500,
+        batch_delay=0.05,
+        workers=4,
+        queue_size=1000,
+        spool_dir="spool",
+        db=None,
+        threads=8,
+    ):
         self.key = key
-        self.repo_path = repo
+        # One GitHub client, connection pool and writer shared by every repository
         self.github = Github(self.key)
-        self.repo = self.github.get_repo(self.repo_path)
         self.password = password
+        self.storage = open_storage(
+            db, MySQLStorage(lambda: connector(self.password))
+        )
+        self.pool = ConnectionPool(
+            lambda: TimedConnection(self.storage.connect()), max_size=pool_size
+        )
+        with self.pool.connection() as conn:
+            create_tables(
+                conn,
+                SCHEMA
+                + [
+                    DATA_VERSIONS_TABLE,
+                    DAILY_STATS_TABLE,
+                    DIRTY_BUCKETS_TABLE,
+                    RUN_EVENTS_TABLE,
+                    run_sketches.SKETCH_TABLE,
+                    flaky_runs.FLAKINESS_TABLE,
+                ],
+            )
+        if isinstance(repos, str):
+            repos = [repos]
+        self.repos = RepoRegistry(repos, config=config, pool=self.pool)
+        self.writer = BatchWriter(
+            self.pool, max_rows=batch_rows, max_delay=batch_delay
+        )
+        self.spool = Spool(spool_dir)
+        self.derived = RunRefresher(
+            self.pool, [run_sketches.refresh, flaky_runs.refresh]
+        )
+        self.ingest = IngestQueue(
+            self.apply, workers=workers, max_size=queue_size, key=self.ordering_key
+        )
+        self.events = 0
+        self.started = time.monotonic()
         self.app = Flask(__name__)
         self.app.add_url_rule(
             "/webhook", "webhook", self.handle_webhook, methods=["POST"]
         )
+        self.app.add_url_rule("/stats", "stats", self.handle_stats, methods=["GET"])
+        self.app.add_url_rule(
+            "/metrics", "metrics", self.handle_metrics, methods=["GET"]
+        )
+        # Per instance, so a second Dashboard or the API server's gauges in
+        # the same process don't repeat a name in the exposition
+        self.registry = Registry()
+        Gauge(
+            "ingest_queue_depth",
+            "Events waiting to be applied",
+            self.ingest.depth,
+            registry=self.registry,
+        )
+        Gauge(
+            "batch_writer_pending_rows",
+            "Rows buffered for the next batch write",
+            lambda: self.writer.stats()["pending_rows"],
+            registry=self.registry,
+        )
+        Gauge(
+            "db_pool_connections",
+            "Connections of the listener pool by state",
+            lambda: {
+                (state,): self.pool.stats()[state]
+                for state in ("in_use", "idle", "waiting")
+            },
+            ("state",),
+            registry=self.registry,
+        )
         self.port = port
+        self.threads = threads
 
     def start(self):
-        self.app.run(host="0.0.0.0", port=self.port, debug=True)
+        # Replayed events are queued before any live webhook is accepted, so
+        # per-run ordering keeps an older spooled event from overwriting a
+        # newer live one
+        self.replay()
+        threading.Thread(target=self.prune, name="event-prune", daemon=True).start()
+        serve(self.app, port=self.port, threads=self.threads)
 
     def stop(self):
-        pass
+        self.ingest.shutdown()
+        self.writer.close()
+        self.derived.flush()
+        self.spool.close()
+        self.pool.close()
+
+    def prune(self, keep_days=7, interval=3600):
+        """Drop run events API servers no longer need for Last-Event-ID resume"""
+        while True:
+            self.writer.add(PRUNE_EVENTS, (keep_days,), last=True)
+            time.sleep(interval)
+
+    def replay(self):
+        """Re-apply events spooled before the last shutdown but never committed
+
+        An event the queue turns away is offered again until it is taken.
+        """
+        count = self.spool.replay(
+            lambda data, position: self.ingest.submit(
+                (data, position, None), timeout=3600
+            )
+        )
+        if count:
+            print(f"Replayed {count} spooled events")
+
+    def handle_stats(self):
+        elapsed = time.monotonic() - self.started
+        return jsonify(
+            {
+                "events": self.events,
+                "events_per_sec": self.events / elapsed if elapsed else 0.0,
+                "repos": self.repos.names(),
+                "queue": self.ingest.stats(),
+                "spool": self.spool.stats(),
+                "writer": self.writer.stats(),
+                "derived": self.derived.stats(),
+                "pool": self.pool.stats(),
+            }
+        )
+
+    def handle_metrics(self):
+        return Response(render(self.registry, REGISTRY), content_type=CONTENT_TYPE)
 
     def handle_webhook(self):
-        data = request.get_json()
+        received = time.monotonic()
+        data = request.get_json(silent=True)
+        event = request.headers.get("X-GitHub-Event", "unknown")
+        if not isinstance(data, dict):
+            WEBHOOK_EVENTS.inc(event, "", "invalid")
+            return "invalid payload", 400
+        action = str(data.get("action", ""))
+        repo = self.repo_of(data)
+        if repo not in self.repos:
+            WEBHOOK_EVENTS.inc(event, action, "unregistered")
+            return f"repository {repo} is not registered", 404
+        position = self.spool.append(data)
+        if not self.ingest.submit((data, position, received)):
+            # GitHub will redeliver, so the spooled copy is not needed
+            self.spool.ack(position)
+            WEBHOOK_EVENTS.inc(event, action, "rejected")
+            return "ingest queue full", 503, {"Retry-After": "5"}
+        WEBHOOK_EVENTS.inc(event, action, "accepted")
+        self.events += 1
+        return "", 202
+
+    def apply(self, item):
+        data, position, received = item
+        self.process_event(data)
+        self.writer.barrier(lambda: self.committed(position, received))
+
+    def committed(self, position, received):
+        self.spool.ack(position)
+        # Replayed events were received by an earlier process
+        if received is not None:
+            INGEST_LAG.observe(time.monotonic() - received)
+
+    @classmethod
+    def ordering_key(cls, item):
+        """Events for one run (or one repository's pushes) go to one worker
+
+        The run upsert overwrites status and conclusion unconditionally, so a
+        stale `in_progress` applied after `completed` would win.
+        """
+        data = item[0]
+        run_id = data.get("workflow_run", {}).get("id") or data.get(
+            "workflow_job", {}
+        ).get("run_id")
+        if run_id is not None:
+            return ("run", run_id)
+        return ("repo", cls.repo_of(data))
+
+    @staticmethod
+    def repo_of(data):
+        return data.get("repository", {}).get("full_name")
+
+    def bump_version(self, data, branch=""):
+        """Tell API servers that cached results for this branch are stale"""
+        self.writer.add(BUMP_VERSION, (self.repo_of(data), branch or ""), last=True)
+
+    def process_event(self, data):
         # handle new branch creation
         if data.get("ref_type") == "branch":
             try:
@@ -56,17 +277,13 @@ class Dashboard:
                 self.add_initial_queue_time(data)
             except Exception as e:
                 print(e)
-        return "", 200
 
     def add_initial_queue_time(self, data):
         start_time = datetime.datetime.fromisoformat(
             data.get("workflow_job", {}).get("started_at").replace("Z", "")
         )
         run_id = data.get("workflow_job", {}).get("run_id")
-        conn = connector(self.password)
-        c = conn.cursor()
-        c.execute("USE shark_dashboard_db")
-        c.execute(
+        self.writer.add(
             """
         UPDATE workflowruns
         SET 
@@ -74,17 +291,17 @@ class Dashboard:
             queuetime = TIMESTAMPDIFF(SECOND, createtime, %s)
         WHERE 
             gitid = %s 
-            AND queuetime = 0.0;
+            AND queuetime = 0.0
         """,
             (start_time, start_time, run_id),
         )
-        conn.commit()
-        conn.close()
+        self.writer.add(MARK_RUN_BUCKET, (run_id,))
+        self.refresh_buckets()
+        self.writer.add(RECORD_EVENT, ("queue_time", run_id), last=True)
+        self.writer.barrier(lambda: self.derived.touch(run_id))
+        self.bump_version(data)
 
     def add_commit(self, data):
-        conn = connector(self.password)
-        c = conn.cursor()
-        c.execute("USE shark_dashboard_db")
         print("ADDING COMMIT")
         branch_name = data.get("ref").replace("refs/heads/", "")
         pusher = data.get("pusher", {}).get("name")
@@ -99,7 +316,7 @@ class Dashboard:
                 commit_time = None
                 author = None
             message = commit.get("message")
-            c.execute(
+            self.writer.add(
                 """
                 INSERT INTO commits (hash, author, message, time, repo, forced, authorurl)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
@@ -109,43 +326,39 @@ class Dashboard:
                     time = VALUES(time),
                     repo = VALUES(repo),
                     forced = forced,
-                    authorurl = VALUES(authorurl);
+                    authorurl = VALUES(authorurl)
                 """,
                 (
                     commit_hash,
                     author,
                     message,
                     commit_time,
-                    self.repo_path,
+                    self.repo_of(data),
                     commit_forced,
                     "https://github.com/" + author,
                 ),
             )
-        conn.commit()
-        conn.close()
+        self.bump_version(data, branch_name)
 
     def add_branch(self, data):
-        conn = connector(self.password)
-        c = conn.cursor()
-        c.execute("USE shark_dashboard_db")
         print("ADDING BRANCH")
         branch_name = data.get("ref")
         author = data.get("sender", {}).get("login")
-        c.execute(
+        self.writer.add(
             """
-            INSERT INTO branches (name, repo)
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE repo = VALUES(repo);
+            INSERT INTO branches (name, author, repo)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE repo = VALUES(repo)
             """,
-            (branch_name, author, self.repo_path),
+            (branch_name, author, self.repo_of(data)),
         )
-        conn.commit()
-        conn.close()
+
+    def refresh_buckets(self):
+        """Recount the marked daily_stats buckets once the batch is written"""
+        for sql in REFRESH_MARKED_BUCKETS:
+            self.writer.add(sql, (), last=True)
 
     def add_workflow_run(self, data):
-        conn = connector(self.password)
-        c = conn.cursor()
-        c.execute("USE shark_dashboard_db")
         print("ADDING WORKFLOW RUN")
         workflow_run = data.get("workflow_run", {})
         workflow_name = workflow_run.get("name")
@@ -165,11 +378,11 @@ class Dashboard:
         started_at_dt = datetime.datetime.fromisoformat(
             workflow_run.get("run_started_at").replace("Z", "")
         )
-        try:
-            runtime = workflow_run.timing().run_duration_ms / 100
-        except:
-            runtime = (updated_at_dt - started_at_dt).total_seconds()
-        c.execute(
+        # The payload is a dict, so there is no timing() call to ask GitHub for
+        runtime = (updated_at_dt - started_at_dt).total_seconds()
+        # The bucket the run is in now, in case this update moves it elsewhere
+        self.writer.add(MARK_RUN_BUCKET, (gitid,))
+        self.writer.add(
             """
             INSERT INTO workflowruns 
                 (gitid, author, runtime, createtime, endtime, status, conclusion, url, branchname, commithash, workflowname, repo)
@@ -186,7 +399,7 @@ class Dashboard:
                 branchname = VALUES(branchname),
                 commithash = VALUES(commithash),
                 workflowname = VALUES(workflowname),
-                repo = VALUES(repo);
+                repo = VALUES(repo)
             """,
             (
                 gitid,
@@ -200,11 +413,17 @@ class Dashboard:
                 branch_name,
                 commit_hash,
                 workflow_name,
-                self.repo_path,
+                self.repo_of(data),
             ),
         )
-        conn.commit()
-        conn.close()
+        # Recount the run's day in the rollup, now that its conclusion may differ
+        self.writer.add(MARK_RUN_BUCKET, (gitid,))
+        self.refresh_buckets()
+        kind = RUN_EVENT_KINDS.get(data.get("action"), "run_updated")
+        self.writer.add(RECORD_EVENT, (kind, gitid), last=True)
+        # Sketches and flakiness are rebuilt from committed rows, so queue the run then
+        self.writer.barrier(lambda: self.derived.touch(gitid))
+        self.bump_version(data, branch_name)
 
 
 if __name__ == "__main__":
@@ -212,12 +431,77 @@ if __name__ == "__main__":
         prog="Backend-Listener",
         description="starts the listener to live update the database",
     )
-    parser.add_argument("-r", "--repo", help="repository to scrape data from")
+    parser.add_argument(
+        "-r",
+        "--repo",
+        action="append",
+        default=[],
+        help="repository to accept events from, can be given more than once",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="JSON file listing repositories, re-read while running",
+    )
     parser.add_argument("-k", "--key", help="repository key")
-    parser.add_argument("-p", "--port", help="port to expose", default=5000)
+    parser.add_argument("-p", "--port", type=int, help="port to expose", default=5000)
     parser.add_argument(
         "-pwd", "--password", help="Password to remote database"
     )
+    parser.add_argument(
+        "--db", help="database URL, e.g. sqlite:///dashboard.db (default: RDS)"
+    )
+    parser.add_argument(
+        "--pool-size", type=int, default=5, help="database connections to keep open"
+    )
+    parser.add_argument(
+        "--batch-rows",
+        type=int,
+        default=500,
+        help="flush buffered writes once this many rows are waiting",
+    )
+    parser.add_argument(
+        "--batch-delay",
+        type=float,
+        default=0.05,
+        help="seconds to wait for more writes before flushing a batch",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="threads applying queued events"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1000,
+        help="events to buffer before rejecting webhooks with 503",
+    )
+    parser.add_argument(
+        "--spool-dir",
+        default="spool",
+        help="directory for the on-disk log of received events",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=8, help="threads answering HTTP requests"
+    )
     args = parser.parse_args()
-    dashboard = Dashboard(args.key, args.repo, args.password, args.port)
-    dashboard.start()
+    dashboard = Dashboard(
+        args.key,
+        args.repo,
+        args.password,
+        args.port,
+        config=args.config,
+        pool_size=args.pool_size,
+        batch_rows=args.batch_rows,
+        batch_delay=args.batch_delay,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        spool_dir=args.spool_dir,
+        db=args.db,
+        threads=args.threads,
+    )
+    # Let SIGTERM from systemd unwind through the finally block to drain the queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        dashboard.start()
+    finally:
+        dashboard.stop()
@@ -0,0 +1,195 @@
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Attributes every LogRecord has; anything else was passed with `extra=`
+_STANDARD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with `extra=` fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD:
+                entry[key] = value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the fields `context()` returns, such as the current request id"""
+
+    def __init__(self, context):
+        super().__init__()
+        self.context = context
+
+    def filter(self, record):
+        for key, value in (self.context() or {}).items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records below WARNING, per logger
+
+    `rates` maps logger names to the fraction kept; a logger without an
+    entry uses its nearest configured ancestor's. Warnings and errors are
+    always kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved = {}
+
+    def rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            parent = name
+            while parent not in self.rates and "." in parent:
+                parent = parent.rsplit(".", 1)[0]
+            rate = self._resolved[name] = self.rates.get(parent, 1.0)
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class AsyncHandler(QueueHandler):
+    """Hands records to a background writer without ever blocking
+
+    The message is rendered here, since its arguments may change once the
+    caller moves on, but JSON encoding and file I/O happen on the writer
+    thread. When the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self._traceback = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = self._traceback.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_pairs(spec, convert):
+    """"a=1,b.c=2" -> {"a": convert("1"), "b.c": convert("2")}"""
+    pairs = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, value = item.partition("=")
+        pairs[name.strip()] = convert(value.strip())
+    return pairs
+
+
+class LogPipeline:
+    """Root logging through a bounded queue to a rotating JSON log file
+
+    Callers only format the message and enqueue the record; one listener
+    thread encodes it and writes the file and stderr. `levels` sets
+    per-logger levels and `sample` per-logger sampling rates (see
+    SamplingFilter). `context` returns extra fields for every record and runs
+    in the thread that logs, so it can read request-local state.
+    """
+
+    def __init__(
+        self,
+        path="app.log",
+        level="INFO",
+        levels=None,
+        sample=None,
+        max_bytes=50 * 1024 * 1024,
+        backups=5,
+        queue_size=10000,
+        context=None,
+        stream=sys.stderr,
+    ):
+        self.level = level
+        self.levels = levels or {}
+        self.handler = AsyncHandler(queue_size)
+        if sample:
+            self.handler.addFilter(SamplingFilter(sample))
+        if context is not None:
+            self.handler.addFilter(ContextFilter(context))
+        outputs = []
+        if path:
+            outputs.append(
+                RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+            )
+        if stream is not None:
+            outputs.append(logging.StreamHandler(stream))
+        formatter = JSONFormatter()
+        for output in outputs:
+            output.setFormatter(formatter)
+        self.listener = QueueListener(self.handler.queue, *outputs)
+
+    @classmethod
+    def from_env(cls, context=None):
+        """Settings from LOG_FILE, LOG_LEVEL, LOG_LEVELS, LOG_SAMPLE,
+        LOG_MAX_MB, LOG_BACKUPS and LOG_QUEUE_SIZE"""
+        return cls(
+            path=os.getenv("LOG_FILE", "app.log"),
+            level=os.getenv("LOG_LEVEL", "INFO").upper(),
+            levels=parse_pairs(os.getenv("LOG_LEVELS"), str.upper),
+            sample=parse_pairs(os.getenv("LOG_SAMPLE"), float),
+            max_bytes=int(float(os.getenv("LOG_MAX_MB", 50)) * 1024 * 1024),
+            backups=int(os.getenv("LOG_BACKUPS", 5)),
+            queue_size=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+            context=context,
+        )
+
+    def start(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        for name, level in self.levels.items():
+            logging.getLogger(name).setLevel(level)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """Write out what is still queued"""
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        for output in self.listener.handlers:
+            output.close()
+
+    def stats(self):
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped,
+        }
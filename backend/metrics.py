@@ -0,0 +1,233 @@
+import bisect
+import re
+import threading
+import time
+
+# Seconds; covers a cached hit through a slow RDS scan
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram; `observe` is a bisect and a locked add"""
+
+    def __init__(
+        self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=None
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        with self._lock:
+            series = {labels: (list(c), s) for labels, (c, s) in self._series.items()}
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket = _labels(names, labels + (bound,))
+                yield f"{self.name}_bucket{bucket} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Gauge:
+    """Value read from `fn` at scrape time, so updating it costs nothing
+
+    `fn` returns a number, or a dict from label value tuples to numbers. Pass
+    kind="counter" for totals some other component already keeps.
+    """
+
+    def __init__(self, name, help, fn, labelnames=(), kind="gauge", registry=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        (registry or REGISTRY).register(self)
+
+    def collect(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        return render(self)
+
+
+def render(*registries):
+    """Metrics of several registries as one exposition
+
+    A name is emitted once, from the first registry that has it, so an
+    instance registry can shadow a process-wide metric of the same name.
+    """
+    lines = []
+    seen = set()
+    for registry in registries:
+        for metric in registry.metrics():
+            if metric.name in seen:
+                continue
+            seen.add(metric.name)
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                print(f"Could not collect {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing statements and fetching their rows",
+    ("query", "phase"),
+)
+QUERY_ROWS = Counter(
+    "db_query_rows_total", "Rows fetched from the database", ("query",)
+)
+
+_STATEMENT = re.compile(
+    r"^[\s(]*(?:(SELECT|DELETE)\b.*?\bFROM|(INSERT|REPLACE)\b.*?\bINTO|(UPDATE))"
+    r"\s+`?(\w+)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def query_label(sql):
+    """Statement verb and first table, e.g. "SELECT workflowruns"
+
+    Queries are built with varying filters, so the label is kept this coarse
+    to bound the number of series.
+    """
+    match = _STATEMENT.match(sql)
+    if match is None:
+        return sql.split(None, 1)[0].upper() if sql.strip() else "unknown"
+    verb = match.group(1) or match.group(2) or match.group(3)
+    return f"{verb.upper()} {match.group(4).lower()}"
+
+
+class TimedCursor:
+    """Cursor proxy recording execute and fetch time and rows per statement"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._label = "unknown"
+
+    def _timed(self, phase, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter() - start, self._label, phase)
+
+    def execute(self, sql, params=()):
+        self._label = query_label(sql)
+        return self._timed("execute", self._cursor.execute, sql, params)
+
+    def executemany(self, sql, params):
+        self._label = query_label(sql)
+        return self._timed("execute", self._cursor.executemany, sql, params)
+
+    def fetchone(self):
+        row = self._timed("fetch", self._cursor.fetchone)
+        if row is not None:
+            QUERY_ROWS.inc(self._label)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed("fetch", self._cursor.fetchmany, *args)
+        QUERY_ROWS.inc(self._label, amount=len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._timed("fetch", self._cursor.fetchall)
+        QUERY_ROWS.inc(self._label, amount=len(rows))
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Connection proxy whose cursors are TimedCursors"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
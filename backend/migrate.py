@@ -0,0 +1,239 @@
+import argparse
+import sys
+
+from sqlauthenticator import connector
+from storage import SCHEMA, MySQLStorage, SQLiteStorage, create_tables, open_storage
+
+# Each migration is (version, description, steps). A step is
+# ("index", table, name, columns).
+MIGRATIONS = [
+    (
+        1,
+        "workflowruns indexes for the API and listener queries",
+        [
+            # workflowruns/waterfall/dashboard filtered by repo and branch,
+            # newest first, and the last push time
+            (
+                "index",
+                "workflowruns",
+                "idx_wr_repo_branch_time",
+                ("repo", "branchname", "createtime", "id"),
+            ),
+            # the same listings across every repository, and hourly buckets
+            ("index", "workflowruns", "idx_wr_time", ("createtime", "id")),
+            # runs of the commits on a waterfall page
+            ("index", "workflowruns", "idx_wr_commit", ("commithash", "repo")),
+            # recounting one workflow's day in workflowrun_daily_stats
+            (
+                "index",
+                "workflowruns",
+                "idx_wr_bucket",
+                ("repo", "branchname", "workflowname", "createtime"),
+            ),
+        ],
+    ),
+    (
+        2,
+        "workflowruns index for rebuilding one percentile sketch bucket",
+        [
+            (
+                "index",
+                "workflowruns",
+                "idx_wr_sketch",
+                ("repo", "workflowname", "os", "createtime"),
+            ),
+        ],
+    ),
+]
+
+# Hot queries and the index each should use. The gitid lookups of the
+# listener, including add_initial_queue_time, are served by the unique key on
+# gitid and need no index of their own.
+VERIFY_QUERIES = [
+    (
+        "runs of a branch, newest first",
+        "SELECT id FROM workflowruns WHERE repo = %s AND branchname = %s"
+        " AND createtime >= %s ORDER BY createtime DESC, id DESC LIMIT 100",
+        ("iree-org/iree", "main", "2000-01-01"),
+        "idx_wr_repo_branch_time",
+    ),
+    (
+        "runs of every repository, newest first",
+        "SELECT id FROM workflowruns WHERE createtime >= %s"
+        " ORDER BY createtime DESC, id DESC LIMIT 100",
+        ("2000-01-01",),
+        "idx_wr_time",
+    ),
+    (
+        "runs of one commit",
+        "SELECT id FROM workflowruns WHERE commithash = %s AND repo = %s",
+        ("0" * 40, "iree-org/iree"),
+        "idx_wr_commit",
+    ),
+    (
+        "runs in one daily statistics bucket",
+        "SELECT COUNT(*) FROM workflowruns WHERE repo = %s AND branchname = %s"
+        " AND workflowname = %s AND createtime >= %s AND createtime < %s",
+        ("iree-org/iree", "main", "CI", "2000-01-01", "2000-01-02"),
+        "idx_wr_bucket",
+    ),
+    (
+        "runs in one percentile sketch bucket",
+        "SELECT runtime FROM workflowruns WHERE repo = %s AND workflowname = %s"
+        " AND os = %s AND createtime >= %s AND createtime < %s",
+        ("iree-org/iree", "CI", "linux", "2000-01-01", "2000-01-02"),
+        "idx_wr_sketch",
+    ),
+    (
+        "commit message join",
+        "SELECT message FROM commits WHERE hash = %s AND repo = %s",
+        ("0" * 40, "iree-org/iree"),
+        None,
+    ),
+]
+
+
+class Migrator:
+    """Applies MIGRATIONS to a MySQL or SQLite connection, once each
+
+    Applied versions are recorded in schema_migrations, and every step also
+    checks whether its index already exists, so running the tool again, or
+    against a database changed by hand, is harmless.
+    """
+
+    def __init__(self, conn, dialect):
+        self.conn = conn
+        self.dialect = dialect
+
+    def _sql(self, sql):
+        return sql.replace("%s", "?") if self.dialect == "sqlite" else sql
+
+    def _query(self, sql, params=()):
+        c = self.conn.cursor()
+        c.execute(self._sql(sql), params)
+        rows = c.fetchall()
+        c.close()
+        return rows
+
+    def _execute(self, sql, params=()):
+        c = self.conn.cursor()
+        c.execute(self._sql(sql), params)
+        c.close()
+
+    def has_index(self, table, name):
+        if self.dialect == "sqlite":
+            rows = self._query(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = %s",
+                (name,),
+            )
+        else:
+            rows = self._query(
+                "SELECT 1 FROM information_schema.statistics"
+                " WHERE table_schema = DATABASE() AND table_name = %s"
+                " AND index_name = %s",
+                (table, name),
+            )
+        return bool(rows)
+
+    def applied(self):
+        self._execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT NOT NULL PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        self.conn.commit()
+        return {row[0] for row in self._query("SELECT version FROM schema_migrations")}
+
+    def apply_step(self, step):
+        kind, table, name = step[:3]
+        if kind == "index":
+            if self.has_index(table, name):
+                return
+            self._execute(f"CREATE INDEX {name} ON {table} ({', '.join(step[3])})")
+        else:
+            raise ValueError(f"Unknown migration step {kind}")
+
+    def migrate(self, target=None):
+        """Apply every pending migration up to `target`; returns versions applied"""
+        done = self.applied()
+        applied = []
+        for version, description, steps in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            print(f"Applying migration {version}: {description}")
+            for step in steps:
+                self.apply_step(step)
+            self._execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description),
+            )
+            self.conn.commit()
+            applied.append(version)
+        return applied
+
+    def explain(self, sql, params):
+        """Names of the indexes the database plans to use for a query"""
+        if self.dialect == "sqlite":
+            rows = self._query("EXPLAIN QUERY PLAN " + sql, params)
+            used = set()
+            for row in rows:
+                detail = row[-1]
+                if " INDEX " in detail:
+                    used.add(detail.split(" INDEX ")[1].split()[0])
+            return used
+        c = self.conn.cursor(dictionary=True)
+        c.execute("EXPLAIN " + sql, params)
+        rows = c.fetchall()
+        c.close()
+        return {row["key"] for row in rows if row["key"]}
+
+    def verify(self):
+        """EXPLAIN every hot query; returns False if one misses its index"""
+        ok = True
+        for description, sql, params, expected in VERIFY_QUERIES:
+            used = self.explain(sql, params)
+            if expected is None:
+                good = bool(used)
+            else:
+                good = expected in used
+            ok = ok and good
+            status = "ok" if good else "MISSING INDEX"
+            print(f"{status:>13}  {description}: {', '.join(sorted(used)) or 'none'}")
+        return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Migrate",
+        description="apply schema migrations to the dashboard database",
+    )
+    parser.add_argument("-pwd", "--password", help="Password to remote database")
+    parser.add_argument(
+        "--db", help="database URL, e.g. sqlite:///dashboard.db (default: RDS)"
+    )
+    parser.add_argument("--sqlite", help="migrate this SQLite file instead of MySQL")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check with EXPLAIN that the hot queries use their indexes",
+    )
+    args = parser.parse_args()
+    if args.sqlite:
+        storage = SQLiteStorage(args.sqlite)
+    else:
+        storage = open_storage(
+            args.db, MySQLStorage(lambda: connector(args.password))
+        )
+    migrator = Migrator(storage.connect(), storage.dialect)
+    # A new database starts from the unified schema
+    create_tables(migrator.conn, SCHEMA)
+    applied = migrator.migrate(args.target)
+    print(f"Applied {len(applied)} migrations" if applied else "Schema is up to date")
+    if args.verify and not migrator.verify():
+        sys.exit(1)
+    migrator.conn.close()
@@ -1,10 +1,386 @@
 import os
-from github import Github
 import datetime, time
+import hashlib
+import json
+from resource import getrusage, RUSAGE_SELF
 import argparse
 from sqlauthenticator import connector
+from github_client import GitHubClient, DEFAULT_API_URL
+from db_pool import ConnectionPool
+from bulk_loader import BulkLoader, bulk_upsert
+from data_versions import DATA_VERSIONS_TABLE, BUMP_VERSION
+from storage import SCHEMA, MySQLStorage, Table, create_tables, open_storage
+import daily_stats
+import flaky_runs
+import run_sketches
 from tqdm import tqdm
 
+# Rows are written with one multi-row statement and committed per chunk, so
+# an interrupted sync keeps its progress
+CHUNK_SIZE = 500
+
+COMMIT_COLUMNS = ("hash", "author", "message", "time", "repo", "authorurl")
+
+WORKFLOW_RUN_COLUMNS = (
+    "gitid",
+    "author",
+    "runtime",
+    "createtime",
+    "starttime",
+    "endtime",
+    "queuetime",
+    "status",
+    "conclusion",
+    "url",
+    "branchname",
+    "commithash",
+    "workflowname",
+    "repo",
+)
+
+# High-water marks for incremental syncs. last_time is the newest item time of
+# the last completed sync and last_gitid the first item it listed;
+# pass_high/pass_low bound the items already written by a sync that was
+# interrupted (as of `updated`), so a rerun can skip them.
+SYNC_STATE_TABLE = Table(
+    "sync_state",
+    [
+        ("repo", "VARCHAR(50) NOT NULL"),
+        ("resource", "VARCHAR(20) NOT NULL"),
+        ("last_time", "DATETIME NULL"),
+        ("last_gitid", "VARCHAR(100) NULL"),
+        ("pass_high", "DATETIME NULL"),
+        ("pass_low", "DATETIME NULL"),
+        ("updated", "DATETIME NULL"),
+    ],
+    primary_key=("repo", "resource"),
+)
+
+
+# ETags and bodies of GitHub responses, so repeated syncs (and reruns of a
+# full scrape) are answered with 304s that do not count against the rate limit
+ETAG_TABLE = Table(
+    "github_etags",
+    [
+        ("cache_key", "CHAR(40) NOT NULL"),
+        ("etag", "VARCHAR(255) NOT NULL"),
+        ("body", "MEDIUMTEXT NOT NULL"),
+        ("updated", "DATETIME NOT NULL"),
+    ],
+    primary_key=("cache_key",),
+)
+
+
+class DatabaseEtagStore:
+    """Persistent ETag store for GitHubClient, kept in the github_etags table
+
+    Entries not refreshed for `max_age_days` are deleted by `prune`.
+    """
+
+    persistent = True
+
+    def __init__(self, storage, pool_size=8, max_age_days=30):
+        self.pool = ConnectionPool(storage.connect, max_size=pool_size)
+        self.max_age_days = max_age_days
+
+    @staticmethod
+    def _key(key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                "SELECT etag, body FROM github_etags WHERE cache_key = %s",
+                (self._key(key),),
+            )
+            row = c.fetchone()
+            c.close()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put(self, key, etag, body):
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            c.execute(
+                """
+                INSERT INTO github_etags (cache_key, etag, body, updated)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    etag = VALUES(etag),
+                    body = VALUES(body),
+                    updated = VALUES(updated)
+                """,
+                (
+                    self._key(key),
+                    etag,
+                    json.dumps(body, separators=(",", ":")),
+                    datetime.datetime.utcnow(),
+                ),
+            )
+            conn.commit()
+            c.close()
+
+    def prune(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            days=self.max_age_days
+        )
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM github_etags WHERE updated < %s", (cutoff,))
+            conn.commit()
+            c.close()
+
+    def close(self):
+        self.pool.close()
+
+
+def load_sync_state(c, repo, resource):
+    """Return the stored high-water mark for a repo and resource"""
+    c.execute(
+        """
+        SELECT last_time, last_gitid, pass_high, pass_low, updated
+        FROM sync_state WHERE repo = %s AND resource = %s
+        """,
+        (repo, resource),
+    )
+    row = c.fetchone()
+    if row is None:
+        row = (None, None, None, None, None)
+    return dict(
+        zip(("last_time", "last_gitid", "pass_high", "pass_low", "updated"), row)
+    )
+
+
+def save_sync_state(c, repo, resource, state):
+    c.execute(
+        """
+        INSERT INTO sync_state
+            (repo, resource, last_time, last_gitid, pass_high, pass_low, updated)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            last_time = VALUES(last_time),
+            last_gitid = VALUES(last_gitid),
+            pass_high = VALUES(pass_high),
+            pass_low = VALUES(pass_low),
+            updated = VALUES(updated);
+        """,
+        (
+            repo,
+            resource,
+            state["last_time"],
+            state["last_gitid"],
+            state["pass_high"],
+            state["pass_low"],
+            state.get("updated") or datetime.datetime.utcnow(),
+        ),
+    )
+
+
+def parse_time(value):
+    """Parse a GitHub timestamp such as 2024-01-31T12:00:00Z into naive UTC"""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace("Z", ""))
+
+
+def get_workflow_run_row(client, workflow_run, repo):
+    """Build a workflowruns row, fetching the run's first job and timing"""
+    branch = workflow_run["head_branch"]
+    commit = workflow_run["head_sha"]
+    workflow_name = workflow_run["name"]
+    url = workflow_run["url"]
+    gitid = workflow_run["id"]
+    author = (workflow_run.get("actor") or {}).get("login")
+    status = workflow_run["status"]
+    conclusion = workflow_run["conclusion"]
+    createtime = parse_time(workflow_run["created_at"])
+    try:
+        jobs, _ = client.get(workflow_run["jobs_url"], {"per_page": 1})
+        starttime = parse_time(jobs["jobs"][0]["started_at"])
+    except Exception:
+        starttime = parse_time(workflow_run.get("run_started_at"))
+    endtime = parse_time(workflow_run["updated_at"])
+    if status != "queued":
+        queuetime = (starttime - createtime).total_seconds()
+    else:
+        queuetime = (endtime - createtime).total_seconds()
+    try:
+        timing, _ = client.get(f"{url}/timing")
+        runtime = timing["run_duration_ms"] / 1000
+    except Exception:
+        runtime = (endtime - starttime).total_seconds()
+    return (
+        gitid,
+        author,
+        runtime,
+        createtime,
+        starttime,
+        endtime,
+        queuetime,
+        status,
+        conclusion,
+        url,
+        branch,
+        commit,
+        workflow_name,
+        repo,
+    )
+
+
+def sync(
+    conn,
+    repo,
+    resource,
+    items,
+    to_row,
+    item_time,
+    item_id,
+    incremental,
+    max_items=-1,
+    mapper=map,
+    chunk_size=CHUNK_SIZE,
+    ordered=True,
+    item_updated=None,
+    item_done=None,
+):
+    """Write items newest first, stopping at the previous sync's high-water mark
+
+    With `ordered`, `items` must be ordered newest first by `item_time`, and
+    paging stops at the first item older than the mark. Otherwise (commits
+    are listed in topological order, so their dates are not monotonic) paging
+    only stops at the first item the previous sync listed, and the caller is
+    expected to bound `items` by time itself. Items are filtered before
+    `to_row` runs, so `mapper` (e.g. GitHubClient.map) only fetches details for
+    items that will actually be written. Rows are handed to a BulkLoader,
+    which writes them while the next ones are fetched and commits every
+    `chunk_size` rows together with the bounds of what this pass has written,
+    so a rerun after an interrupted ordered sync skips those items, unless
+    `item_updated` shows they changed after they were written. `item_done`
+    tells whether an item is final; the mark stops at the oldest one that is
+    not, so the next sync fetches it again. Returns the time of the oldest
+    item written, or None.
+    """
+    c = conn.cursor()
+    state = load_sync_state(c, repo, resource) if incremental else None
+    c.close()
+    skip_low = state["pass_low"] if incremental and ordered else None
+    skip_high = state["pass_high"] if incremental and ordered else None
+    if incremental and skip_low is None:
+        # While a pass is in progress `updated` records when it started, so a
+        # rerun knows which skipped items may have changed since they were written
+        state["updated"] = datetime.datetime.utcnow()
+    if resource == "commits":
+        loader = BulkLoader(conn, "commits", COMMIT_COLUMNS, ("hash",), chunk_size)
+    else:
+        loader = BulkLoader(
+            conn, "workflowruns", WORKFLOW_RUN_COLUMNS, ("gitid",), chunk_size
+        )
+    newest_time = newest_id = oldest_time = None
+    written = 0
+    progress = {"taken": 0, "skipped": 0, "complete": True, "oldest_incomplete": None}
+
+    def track(item, created):
+        if item_done is not None and not item_done(item):
+            oldest = progress["oldest_incomplete"]
+            progress["oldest_incomplete"] = created if oldest is None else min(oldest, created)
+
+    def checkpoint():
+        # Committed chunks also make API servers drop their cached results
+        loader.checkpoint(lambda c: c.execute(BUMP_VERSION, (repo, "")))
+        if incremental:
+            snapshot = dict(state)
+            loader.checkpoint(lambda c: save_sync_state(c, repo, resource, snapshot))
+
+    def select():
+        for item in items:
+            if max_items != -1 and progress["taken"] >= max_items:
+                # Older items were never fetched; keep the pass bounds so the
+                # next sync continues from here instead of jumping over the gap
+                progress["complete"] = False
+                return
+            progress["taken"] += 1
+            created = item_time(item)
+            if incremental:
+                if item_id(item) == state["last_gitid"]:
+                    return
+                if (
+                    ordered
+                    and state["last_time"] is not None
+                    and created < state["last_time"]
+                ):
+                    return
+                if (
+                    skip_low is not None
+                    and skip_low <= created <= skip_high
+                    and not (
+                        item_updated is not None
+                        and state["updated"] is not None
+                        and item_updated(item) > state["updated"]
+                    )
+                ):
+                    # Written by the interrupted pass and unchanged since
+                    progress["skipped"] += 1
+                    track(item, created)
+                    continue
+            yield item, created
+
+    # page fetch -> select -> row transform (detail fetches) -> batched write.
+    # Every stage is a generator or a bounded queue, so memory does not grow
+    # with the number of items synced.
+    rows = mapper(lambda selected: (selected, to_row(selected[0])), select())
+    bar = tqdm(rows, desc=f"Syncing {resource}", unit=" rows")
+    try:
+        for (item, created), row in bar:
+            if newest_id is None:
+                newest_id = item_id(item)
+            newest_time = created if newest_time is None else max(newest_time, created)
+            track(item, created)
+            loader.add(row)
+            written += 1
+            oldest_time = created if oldest_time is None else min(oldest_time, created)
+            # Items above an interrupted pass leave a gap until we reach it, so
+            # the recorded bounds only move once everything above them is written
+            if incremental and ordered and (skip_low is None or created < skip_low):
+                state["pass_high"] = max(newest_time, skip_high or newest_time)
+                state["pass_low"] = created
+            if written % chunk_size == 0:
+                checkpoint()
+                bar.set_postfix(skipped=progress["skipped"], refresh=False)
+    except BaseException:
+        # Keep everything fetched so far, with matching progress, before failing
+        try:
+            checkpoint()
+            loader.close()
+        except Exception as e:
+            print(f"Could not save {resource} fetched before the failure: {e}")
+        raise
+
+    if incremental and progress["complete"]:
+        marks = [
+            mark
+            for mark in (newest_time, skip_high, state["last_time"])
+            if mark is not None
+        ]
+        oldest_incomplete = progress["oldest_incomplete"]
+        if oldest_incomplete is not None:
+            # Runs still in progress must be fetched again by the next sync to
+            # pick up their conclusion, so the mark stops at the oldest of them
+            state["last_time"], state["last_gitid"] = oldest_incomplete, None
+        elif marks:
+            state["last_time"] = max(marks)
+            if ordered:
+                state["last_gitid"] = (
+                    newest_id if newest_time == max(marks) else None
+                )
+            elif newest_id is not None:
+                state["last_gitid"] = newest_id
+        state["pass_high"] = state["pass_low"] = state["updated"] = None
+    checkpoint()
+    loader.close()
+    print(f"{resource}: wrote {written}, skipped {progress['skipped']} already synced")
+    return oldest_time
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog="Local-Database", description="Initialize Local DataBase"
@@ -23,73 +399,58 @@ if __name__ == "__main__":
         "--last_time",
         type=int,
         default=0,
-        help="Only scrape data back to this date",
+        help="Only scrape data back to this date (unix timestamp)",
     )
     parser.add_argument(
         "-pwd", "--password", help="Password to remote database"
     )
+    parser.add_argument(
+        "--db", help="database URL, e.g. sqlite:///dashboard.db (default: RDS)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch commits and workflow runs newer than the last sync",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="Maximum concurrent GitHub API requests",
+    )
+    parser.add_argument(
+        "--api-url",
+        default=DEFAULT_API_URL,
+        help="GitHub API base URL, e.g. a local fake server for testing",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="Rows per multi-row insert and commit",
+    )
     args = parser.parse_args()
-    conn = connector(args.password)
+    storage = open_storage(args.db, MySQLStorage(lambda: connector(args.password)))
+    conn = storage.connect()
     c = conn.cursor()
     c.execute("USE shark_dashboard_db")
     # c.execute("PRAGMA foreign_keys = ON;")
+    create_tables(conn, SCHEMA + [DATA_VERSIONS_TABLE, SYNC_STATE_TABLE, ETAG_TABLE])
 
     print("POPULATING DATABASE")
-    github = Github(args.key)
-    repo = github.get_repo(args.repo)
-
-    def get_workflow_run_row(workflow_run, repo):
-        branch = workflow_run.head_branch
-        commit = workflow_run.head_sha
-        workflow_name = workflow_run.name
-        url = workflow_run.url
-        gitid = workflow_run.id
-        author = workflow_run.actor.login
-        status = workflow_run.status
-        conclusion = workflow_run.conclusion
-        jobs = workflow_run.jobs()
-        createtime = workflow_run.created_at
-        try:
-            starttime = jobs[0].started_at
-        except:
-            starttime = workflow_run.run_started_at
-        endtime = workflow_run.updated_at
-        if status != "queued":
-            queuetime = time.mktime(starttime.timetuple()) - time.mktime(
-                createtime.timetuple()
-            )
-        else:
-            queuetime = time.mktime(endtime.timetuple()) - time.mktime(
-                createtime.timetuple()
-            )
-        try:
-            runtime = workflow_run.timing().run_duration_ms / 100
-        except:
-            runtime = time.mktime(endtime.timetuple()) - time.mktime(
-                starttime.timetuple()
-            )
-        return (
-            gitid,
-            author,
-            runtime,
-            createtime,
-            starttime,
-            endtime,
-            queuetime,
-            status,
-            conclusion,
-            url,
-            branch,
-            commit,
-            workflow_name,
-            repo,
-        )
+    etags = DatabaseEtagStore(storage, pool_size=args.workers)
+    etags.prune()
+    client = GitHubClient(
+        args.key, base_url=args.api_url, max_workers=args.workers, etags=etags
+    )
+    repo_path = f"/repos/{args.repo}"
 
     conn.close()
 
     print("POPULATING REPO")
 
-    conn = connector(args.password)
+    conn = storage.connect()
     c = conn.cursor()
     c.execute("USE shark_dashboard_db")
     c.execute(
@@ -103,125 +464,123 @@ if __name__ == "__main__":
     conn.commit()
     conn.close()
 
+    floor = (
+        datetime.datetime.utcfromtimestamp(args.last_time) if args.last_time else None
+    )
+
+    def since(resource):
+        """Earliest creation time worth asking GitHub for"""
+        marks = [floor]
+        if args.incremental:
+            conn = storage.connect()
+            c = conn.cursor()
+            state = load_sync_state(c, args.repo, resource)
+            conn.close()
+            marks.append(state["last_time"])
+        marks = [mark for mark in marks if mark is not None]
+        return max(marks) if marks else None
+
     print("POPULATING BRANCHES")
 
-    branches = repo.get_branches()
-    branch_values = [(branch.name, args.repo) for branch in branches]
-    conn = connector(args.password)
+    branches = client.paginate(f"{repo_path}/branches")
+    branch_values = ((branch["name"], args.repo) for branch in branches)
+    conn = storage.connect()
     c = conn.cursor()
     c.execute("USE shark_dashboard_db")
-    for branch_value in branch_values:
-        c.execute(
-            """
-            INSERT INTO branches (name, repo)
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE repo = VALUES(repo);
-
-            """,
-            branch_value,
-        )
+    bulk_upsert(
+        c, "branches", ("name", "repo"), ("name",), branch_values, args.chunk_size
+    )
     conn.commit()
     conn.close()
 
     print("POPULATING COMMITS")
 
-    commits = repo.get_commits()
-    commit_values = [
-        (
-            str(commit.sha),
-            commit.commit.author.name,
-            commit.commit.message,
-            commit.commit.author.date,
+    commits_since = since("commits")
+    commits = client.paginate(
+        f"{repo_path}/commits",
+        {"since": f"{commits_since:%Y-%m-%dT%H:%M:%SZ}"} if commits_since else None,
+    )
+    conn = storage.connect()
+    conn.cursor().execute("USE shark_dashboard_db")
+    sync(
+        conn,
+        args.repo,
+        "commits",
+        commits,
+        lambda commit: (
+            commit["sha"],
+            commit["commit"]["author"]["name"],
+            commit["commit"]["message"],
+            parse_time(commit["commit"]["author"]["date"]),
             args.repo,
-            "https://github.com/" + commit.commit.author.name,
-        )
-        for commit in commits
-    ]
-    conn = connector(args.password)
-    c = conn.cursor()
-    c.execute("USE shark_dashboard_db")
-    print("ADDING COMMITS")
-    for i in tqdm(range(len(commit_values)), desc="Adding Commits to DB"):
-        commit_value = commit_values[i]
-        c.execute(
-            """
-            INSERT INTO commits (hash, author, message, time, repo, authorurl)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE 
-                author = VALUES(author),
-                message = VALUES(message),
-                time = VALUES(time),
-                repo = VALUES(repo),
-                authorurl = VALUES(authorurl);
-            """,
-            commit_value,
-        )
-    conn.commit()
+            "https://github.com/" + commit["commit"]["author"]["name"],
+        ),
+        # Author dates survive rebases and cherry-picks; GitHub's `since`
+        # filters on the committer date, so the mark must use it too
+        lambda commit: parse_time(commit["commit"]["committer"]["date"]),
+        lambda commit: commit["sha"],
+        args.incremental,
+        chunk_size=args.chunk_size,
+        ordered=False,
+    )
     conn.close()
 
     print("POPULATING WORKFLOWS")
 
-    workflows = repo.get_workflows()
-    workflow_values = [
-        (workflow.name, workflow.url, args.repo) for workflow in workflows
-    ]
-    conn = connector(args.password)
+    workflows = client.paginate(f"{repo_path}/actions/workflows", key="workflows")
+    workflow_values = (
+        (workflow["name"], workflow["url"], args.repo) for workflow in workflows
+    )
+    conn = storage.connect()
     c = conn.cursor()
     c.execute("USE shark_dashboard_db")
-    for i in tqdm(range(len(workflow_values)), desc="Adding Wrokflows to DB"):
-        workflow_value = workflow_values[i]
-        c.execute(
-            """
-            INSERT INTO workflows (name, url, repo)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                url = VALUES(url),
-                repo = VALUES(repo);
-            """,
-            workflow_value,
-        )
+    bulk_upsert(
+        c,
+        "workflows",
+        ("name", "url", "repo"),
+        ("name",),
+        workflow_values,
+        args.chunk_size,
+    )
     conn.commit()
     conn.close()
 
     print("POPULATING WORKFLOW RUNS")
 
-    workflow_runs = repo.get_workflow_runs()
-    workflow_run_values = []
-    i = 0
-    for workflow_run in workflow_runs:
-        if i > args.max_runs and args.max_runs != -1:
-            break
-        workflow_run_input = get_workflow_run_row(workflow_run, args.repo)
-        workflow_run_values.append(workflow_run_input)
-        i += 1
-    conn = connector(args.password)
-    c = conn.cursor()
-    c.execute("USE shark_dashboard_db")
-    print("ADDING WORKFLOW RUNS")
-    for i in tqdm(range(len(workflow_run_values)), desc="Adding workflow runs"):
-        workflow_run_value = workflow_run_values[i]
-        c.execute(
-            """
-            INSERT INTO workflowruns 
-                (gitid, author, runtime, createtime, starttime, endtime, queuetime, status, conclusion, url, branchname, commithash, workflowname, repo)
-            VALUES 
-                (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                author = VALUES(author),
-                runtime = VALUES(runtime),
-                createtime = VALUES(createtime),
-                starttime = VALUES(starttime),
-                endtime = VALUES(endtime),
-                queuetime = VALUES(queuetime),
-                status = VALUES(status),
-                conclusion = VALUES(conclusion),
-                url = VALUES(url),
-                branchname = VALUES(branchname),
-                commithash = VALUES(commithash),
-                workflowname = VALUES(workflowname),
-                repo = VALUES(repo);
-            """,
-            workflow_run_value,
-        )
-    conn.commit()
+    runs_since = since("workflowruns")
+    workflow_runs = client.paginate(
+        f"{repo_path}/actions/runs",
+        {"created": f">={runs_since:%Y-%m-%dT%H:%M:%SZ}"} if runs_since else None,
+        key="workflow_runs",
+    )
+    conn = storage.connect()
+    conn.cursor().execute("USE shark_dashboard_db")
+    oldest_run = sync(
+        conn,
+        args.repo,
+        "workflowruns",
+        workflow_runs,
+        lambda workflow_run: get_workflow_run_row(client, workflow_run, args.repo),
+        lambda workflow_run: parse_time(workflow_run["created_at"]),
+        lambda workflow_run: str(workflow_run["id"]),
+        args.incremental,
+        args.max_runs,
+        mapper=client.map,
+        chunk_size=args.chunk_size,
+        item_updated=lambda workflow_run: parse_time(workflow_run["updated_at"]),
+        item_done=lambda workflow_run: workflow_run["status"] == "completed",
+    )
+    if oldest_run is not None:
+        print("UPDATING DAILY STATISTICS")
+        daily_stats.rebuild(conn, oldest_run.date())
+        run_sketches.rebuild(conn, oldest_run.date())
+        flaky_runs.rebuild(conn, oldest_run.date())
     conn.close()
+    client.close()
+    etags.close()
+    print(
+        f"GitHub API: {client.stats['requests']} requests, "
+        f"{client.stats['not_modified']} not modified, "
+        f"{client.stats['retries']} retries"
+    )
+    print(f"Peak memory: {getrusage(RUSAGE_SELF).ru_maxrss // 1024} MB")
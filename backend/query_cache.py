@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """LRU cache of encoded API responses, bounded by total size and age
+
+    Each entry remembers the data version it was computed at; a lookup with a
+    different version is a miss, so writers invalidate entries by bumping the
+    version rather than by reaching into the cache. Entries also expire after
+    `ttl` seconds because some responses depend on the current time.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key, version):
+        """Return the cached (body, headers) for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                body, headers, entry_version, expires = entry
+                if entry_version == version and time.monotonic() < expires:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return body, headers
+                self._remove(key)
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, version, body, headers):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self._bytes + len(body) > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+            self._entries[key] = (body, headers, version, time.monotonic() + self.ttl)
+            self._bytes += len(body)
+            self._stats["stores"] += 1
+
+    def _remove(self, key):
+        body = self._entries.pop(key)[0]
+        self._bytes -= len(body)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            return stats
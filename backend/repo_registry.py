@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+import time
+
+
+class RepoRegistry:
+    """Set of repositories the listener accepts events for
+
+    Repositories come from the command line, an optional JSON config file
+    (a list of "owner/name" strings, or {"repos": [...]}) and the `repos`
+    table. A background thread re-reads the file and table every
+    `refresh_interval` seconds, and at most once per `miss_interval` seconds
+    when an event arrives for an unknown repository, so new repos are picked
+    up without a restart. Lookups never query the database themselves, and a
+    source that fails to load keeps the repositories it last returned.
+    """
+
+    def __init__(
+        self, static=(), config=None, pool=None, refresh_interval=60, miss_interval=10
+    ):
+        self.static = set(static or ())
+        self.config = config
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.miss_interval = miss_interval
+        self._repos = set(self.static)
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_refresh = 0.0
+        self.refresh()
+        threading.Thread(target=self._run, name="repo-refresh", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            self.refresh()
+
+    def _from_config(self):
+        if not self.config or not os.path.exists(self.config):
+            return set()
+        with open(self.config) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("repos", [])
+        return set(data)
+
+    def _from_db(self):
+        if self.pool is None:
+            return set()
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT name FROM repos")
+            names = {row[0] for row in c.fetchall()}
+            c.close()
+        return names
+
+    def refresh(self):
+        repos = set(self.static)
+        for source in (self._from_config, self._from_db):
+            try:
+                self._loaded[source.__name__] = source()
+            except Exception as e:
+                # A transient failure must not unregister the source's repos
+                print(f"Could not load repositories from {source.__name__}: {e}")
+            repos |= self._loaded.get(source.__name__, set())
+        with self._lock:
+            added = repos - self._repos
+            self._repos = repos
+            self._last_refresh = time.monotonic()
+        for name in sorted(added):
+            print(f"Listening for events from {name}")
+
+    def __contains__(self, name):
+        if name in self._repos:
+            return True
+        with self._lock:
+            if time.monotonic() - self._last_refresh >= self.miss_interval:
+                # Claim the refresh so a burst of misses wakes the thread once
+                self._last_refresh = time.monotonic()
+                self._wake.set()
+        return False
+
+    def names(self):
+        with self._lock:
+            return sorted(self._repos)
@@ -0,0 +1,223 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+from storage import Table
+
+# Changelog of workflow run updates, written by the listener in the same
+# transaction as the runs themselves and tailed by the API servers
+RUN_EVENTS_TABLE = Table(
+    "run_events",
+    [
+        ("kind", "VARCHAR(20) NOT NULL"),
+        ("gitid", "BIGINT NOT NULL"),
+        ("created", "TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    indexes={"created": ("created",)},
+    auto_id="id",
+    id_type="BIGINT",
+)
+
+# Add with BatchWriter.add(..., last=True) so the run row is already written,
+# and repeated updates of one run within a batch collapse into one event
+RECORD_EVENT = "INSERT INTO run_events (kind, gitid) VALUES (%s, %s)"
+
+PRUNE_EVENTS = "DELETE FROM run_events WHERE created < NOW() - INTERVAL %s DAY"
+
+# webhook workflow_run action -> event kind
+RUN_EVENT_KINDS = {
+    "requested": "run_created",
+    "in_progress": "run_updated",
+    "completed": "run_completed",
+}
+
+_EVENTS_QUERY = """
+    SELECT
+        e.id,
+        e.kind,
+        wr.gitid,
+        wr.repo,
+        wr.branchname,
+        wr.commithash,
+        wr.workflowname,
+        wr.os,
+        wr.status,
+        wr.conclusion,
+        wr.url,
+        wr.createtime,
+        wr.queuetime
+    FROM run_events e
+    JOIN workflowruns wr ON wr.gitid = e.gitid
+    WHERE e.id > %s
+    ORDER BY e.id
+    LIMIT %s
+"""
+
+
+class HubFull(Exception):
+    """Raised by EventHub.subscribe when `max_subscribers` streams are open"""
+
+
+class Subscription:
+    """One client's view of the event stream"""
+
+    def __init__(self, repo, branch, max_queue):
+        self.repo = repo
+        self.branch = branch
+        self.queue = queue.Queue(maxsize=max_queue)
+        # Set when the client fell too far behind; it must reload and reconnect
+        self.overflowed = False
+
+    def wants(self, event):
+        return (self.repo is None or event["repo"] == self.repo) and (
+            self.branch is None or event["branch"] == self.branch
+        )
+
+    def offer(self, event):
+        if self.overflowed or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class EventHub:
+    """Tails run_events with one poller and fans new events out to subscribers
+
+    The most recent `backlog` events are kept in memory so reconnecting
+    clients can resume from their Last-Event-ID. Each subscriber has a queue
+    of at most `max_queue` events; a subscriber that falls further behind is
+    flagged as overflowed instead of buffering without limit. Each open
+    stream holds a server worker thread, so at most `max_subscribers` are
+    accepted.
+    """
+
+    def __init__(
+        self,
+        pool,
+        format_event,
+        interval=1.0,
+        backlog=1000,
+        max_queue=256,
+        max_subscribers=None,
+    ):
+        self.pool = pool
+        self.format_event = format_event
+        self.interval = interval
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._backlog = deque(maxlen=backlog)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_id = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {"events": 0, "overflows": 0, "poll_errors": 0, "rejected": 0}
+
+    def _start(self):
+        # Started on first use so importing the app does not touch the database.
+        # The backlog is loaded before the first subscriber is accepted, so a
+        # resume right after a restart can be checked against it.
+        with self._start_lock:
+            if self._thread is None:
+                try:
+                    self.poll()
+                except Exception as e:
+                    self._stats["poll_errors"] += 1
+                    print(f"Could not read run events: {e}")
+                self._thread = threading.Thread(
+                    target=self._run, name="event-hub", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self._stats["poll_errors"] += 1
+                print(f"Could not read run events: {e}")
+            time.sleep(self.interval)
+
+    def poll(self):
+        with self.pool.connection() as conn:
+            c = conn.cursor(dictionary=True)
+            if self._last_id is None:
+                self._load_backlog(c)
+            while True:
+                c.execute(_EVENTS_QUERY, (self._last_id, self._backlog.maxlen))
+                rows = c.fetchall()
+                for row in rows:
+                    self.publish(self.format_event(row))
+                if len(rows) < self._backlog.maxlen:
+                    break
+            c.close()
+
+    def _load_backlog(self, c):
+        # The latest events fill the backlog without being published again
+        c.execute("SELECT COALESCE(MAX(id), 0) AS id FROM run_events")
+        latest = c.fetchone()["id"]
+        size = self._backlog.maxlen
+        c.execute(_EVENTS_QUERY, (latest - size, size))
+        events = [self.format_event(row) for row in c.fetchall()]
+        with self._lock:
+            self._backlog.extend(events)
+            self._last_id = max([latest] + [event["id"] for event in events])
+
+    def publish(self, event):
+        with self._lock:
+            self._last_id = event["id"]
+            self._backlog.append(event)
+            self._stats["events"] += 1
+            for subscription in self._subscribers:
+                was_overflowed = subscription.overflowed
+                subscription.offer(event)
+                if subscription.overflowed and not was_overflowed:
+                    self._stats["overflows"] += 1
+
+    def subscribe(self, repo=None, branch=None, last_id=None):
+        """Register a client; events after `last_id` are queued for it first
+
+        Returns None when `last_id` is older than the backlog, or the backlog
+        could not be loaded yet, in which case the client has to reload before
+        following the stream. Raises HubFull
+        when `max_subscribers` clients are already subscribed.
+        """
+        self._start()
+        subscription = Subscription(repo, branch, self.max_queue)
+        with self._lock:
+            if (
+                self.max_subscribers is not None
+                and len(self._subscribers) >= self.max_subscribers
+            ):
+                self._stats["rejected"] += 1
+                raise HubFull(f"{self.max_subscribers} event streams already open")
+            if last_id is not None:
+                oldest = self._backlog[0]["id"] - 1 if self._backlog else self._last_id
+                if oldest is None or last_id < oldest:
+                    return None
+                for event in self._backlog:
+                    if event["id"] > last_id:
+                        subscription.offer(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["subscribers"] = len(self._subscribers)
+            stats["max_subscribers"] = self.max_subscribers
+            stats["last_id"] = self._last_id
+            return stats
+
+
+def sse(event_id, kind, data):
+    """Encode one Server-Sent Events message"""
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
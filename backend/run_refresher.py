@@ -0,0 +1,69 @@
+import threading
+import time
+
+from data_versions import BUMP_VERSION
+
+
+class RunRefresher:
+    """Keeps the tables derived from workflow runs current as runs are written
+
+    `touch(gitid)` only records the run; the listener calls it once the
+    run's rows are committed. Every `interval` seconds a background thread
+    passes the touched gitids to each of `refreshers`. Each one rebuilds the
+    buckets those runs fall in from their rows and returns the repositories
+    it changed, whose data versions are bumped in the same transaction.
+    Rebuilding from rows keeps the tables correct when events are redelivered
+    or replayed, and a busy bucket is rebuilt once per interval however many
+    of its runs changed.
+    """
+
+    def __init__(self, pool, refreshers, interval=5):
+        self.pool = pool
+        self.refreshers = refreshers
+        self.interval = interval
+        self.refreshed = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        # Held while refreshing, so a final flush waits for a running one
+        self._flushing = threading.Lock()
+        threading.Thread(target=self._run, name="run-refresh", daemon=True).start()
+
+    def touch(self, gitid):
+        with self._lock:
+            self._pending.add(gitid)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self._flushing:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            gitids, self._pending = self._pending, set()
+        if not gitids:
+            return
+        try:
+            with self.pool.connection() as conn:
+                c = conn.cursor()
+                repos = set()
+                for refresh in self.refreshers:
+                    repos |= refresh(c, gitids)
+                for repo in repos:
+                    c.execute(BUMP_VERSION, (repo, ""))
+                conn.commit()
+                c.close()
+        except Exception as e:
+            print(f"Could not refresh derived run tables: {e}")
+            with self._lock:
+                self._pending |= gitids
+            return
+        self.refreshed += len(gitids)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending_runs": pending, "refreshed_runs": self.refreshed}
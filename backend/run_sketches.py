@@ -0,0 +1,279 @@
+import argparse
+import datetime
+import math
+
+from sqlauthenticator import connector
+from storage import MySQLStorage, Table, create_tables, open_storage
+
+# Every quantile is within 1% of the true value. About 700 bins cover one
+# second to eleven days, and a sketch stores two or three bytes per bin used.
+RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# Smaller values, such as queue times of 0s, are counted as zero
+MIN_VALUE = 0.01
+FORMAT_VERSION = 1
+
+METRICS = ("runtime", "queuetime")
+# Cancelled and skipped runs stop early, so their runtimes are left out
+TIMED_CONCLUSIONS = ("success", "failure")
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class Sketch:
+    """DDSketch: counts of values in logarithmically sized bins
+
+    Bin i holds values in (gamma^(i-1), gamma^i], so any quantile read from
+    a sketch is within RELATIVE_ACCURACY of the exact one. Sketches merge by
+    adding bin counts, which is exact and costs one pass over the bins
+    however many values they hold.
+    """
+
+    def __init__(self):
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        if value < MIN_VALUE:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(value) / _LOG_GAMMA)
+            self.bins[index] = self.bins.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def quantiles(self, qs):
+        """Estimates for each q in `qs` (0 to 1), None for an empty sketch"""
+        if not self.count:
+            return [None] * len(qs)
+        ranks = sorted((q * (self.count - 1), i) for i, q in enumerate(qs))
+        results = [None] * len(qs)
+        pending = iter(ranks)
+        rank, position = next(pending)
+        seen = self.zeros
+        bins = iter(sorted(self.bins.items()))
+        value = 0.0
+        while True:
+            while rank < seen:
+                results[position] = value
+                rank, position = next(pending, (None, None))
+                if rank is None:
+                    return results
+            index, count = next(bins)
+            seen += count
+            # The estimate in the middle of the bin in relative terms
+            value = 2 * _GAMMA**index / (_GAMMA + 1)
+
+    def to_bytes(self):
+        """Version, zero count, bin count, then (index delta, count) varints"""
+        out = bytearray([FORMAT_VERSION])
+        _write_varint(out, self.zeros)
+        _write_varint(out, len(self.bins))
+        previous = 0
+        for index in sorted(self.bins):
+            delta = index - previous
+            # Zigzag, so negative indexes of values below one stay small
+            _write_varint(out, delta * 2 if delta >= 0 else -delta * 2 - 1)
+            _write_varint(out, self.bins[index])
+            previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        if data[0] != FORMAT_VERSION:
+            raise ValueError(f"Unknown sketch format {data[0]}")
+        sketch.zeros, offset = _read_varint(data, 1)
+        bins, offset = _read_varint(data, offset)
+        index = 0
+        for _ in range(bins):
+            delta, offset = _read_varint(data, offset)
+            index += delta // 2 if delta % 2 == 0 else -(delta + 1) // 2
+            sketch.bins[index], offset = _read_varint(data, offset)
+        sketch.count = sketch.zeros + sum(sketch.bins.values())
+        return sketch
+
+
+# One runtime and one queue time sketch per repository, workflow, operating
+# system and day. The day follows the repository and metric in the key, so
+# a range of one repository is one index scan.
+SKETCH_TABLE = Table(
+    "workflowrun_sketches",
+    [
+        ("repo", "VARCHAR(50) NOT NULL"),
+        ("metric", "VARCHAR(16) NOT NULL"),
+        ("day", "DATE NOT NULL"),
+        ("workflowname", "VARCHAR(255) NOT NULL"),
+        ("os", "VARCHAR(100) NOT NULL"),
+        ("runs", "INT NOT NULL"),
+        ("sketch", "BLOB NOT NULL"),
+    ],
+    primary_key=("repo", "metric", "day", "workflowname", "os"),
+    indexes={"day": ("day",)},
+)
+
+_VALUE_COLUMNS = "runtime, queuetime, status, conclusion, starttime"
+
+BUCKETS_OF_RUNS = """
+    SELECT DISTINCT repo, workflowname, os, DATE(createtime)
+    FROM workflowruns
+    WHERE gitid IN ({})
+"""
+
+BUCKET_RUNS = f"""
+    SELECT {_VALUE_COLUMNS}
+    FROM workflowruns
+    WHERE repo <=> %s
+        AND workflowname <=> %s
+        AND os <=> %s
+        AND createtime >= %s
+        AND createtime < %s + INTERVAL 1 DAY
+"""
+
+DAY_RUNS = f"""
+    SELECT repo, workflowname, os, {_VALUE_COLUMNS}
+    FROM workflowruns
+    WHERE createtime >= %s AND createtime < %s + INTERVAL 1 DAY
+"""
+
+STORE_SKETCH = """
+    INSERT INTO workflowrun_sketches (repo, metric, day, workflowname, os, runs, sketch)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE runs = VALUES(runs), sketch = VALUES(sketch)
+"""
+
+DELETE_SKETCH = """
+    DELETE FROM workflowrun_sketches
+    WHERE repo = %s AND metric = %s AND day = %s AND workflowname = %s AND os = %s
+"""
+
+
+def build(rows):
+    """Runtime and queue time sketches of (runtime, queuetime, status,
+    conclusion, starttime) rows"""
+    sketches = {metric: Sketch() for metric in METRICS}
+    for runtime, queuetime, status, conclusion, starttime in rows:
+        if (
+            status == "completed"
+            and conclusion in TIMED_CONCLUSIONS
+            and runtime is not None
+        ):
+            sketches["runtime"].add(float(runtime))
+        # Runs get a start time together with their queue time
+        if starttime is not None and queuetime is not None:
+            sketches["queuetime"].add(float(queuetime))
+    return sketches
+
+
+def store(cursor, repo, workflow, os, day, sketches):
+    key = (repo or "", workflow or "", os or "")
+    for metric, sketch in sketches.items():
+        if sketch.count:
+            cursor.execute(
+                STORE_SKETCH,
+                (key[0], metric, day) + key[1:] + (sketch.count, sketch.to_bytes()),
+            )
+        else:
+            cursor.execute(DELETE_SKETCH, (key[0], metric, day) + key[1:])
+
+
+def refresh(cursor, gitids, chunk_size=500):
+    """Rebuild the buckets the runs with these gitids fall in
+
+    Each bucket is rebuilt from its runs, so it is correct however often a
+    run is refreshed. Returns the repositories whose sketches changed.
+    """
+    gitids = list(gitids)
+    buckets = set()
+    for start in range(0, len(gitids), chunk_size):
+        chunk = gitids[start : start + chunk_size]
+        cursor.execute(BUCKETS_OF_RUNS.format(", ".join(["%s"] * len(chunk))), chunk)
+        buckets.update(cursor.fetchall())
+    for repo, workflow, os, day in buckets:
+        cursor.execute(BUCKET_RUNS, (repo, workflow, os, day, day))
+        store(cursor, repo, workflow, os, day, build(cursor.fetchall()))
+    return {repo or "" for repo, _, _, _ in buckets}
+
+
+def rebuild(conn, since=None):
+    """Recompute the sketches one day at a time, committing after each day"""
+    create_tables(conn, [SKETCH_TABLE])
+    c = conn.cursor()
+    c.execute("SELECT MIN(createtime) FROM workflowruns")
+    first = c.fetchone()[0]
+    if first is None:
+        c.close()
+        return 0
+    day = max(first.date(), since) if since else first.date()
+    days = 0
+    while day <= datetime.datetime.utcnow().date():
+        c.execute(DAY_RUNS, (day, day))
+        buckets = {}
+        for repo, workflow, os, *values in c.fetchall():
+            buckets.setdefault((repo, workflow, os), []).append(values)
+        c.execute("DELETE FROM workflowrun_sketches WHERE day = %s", (day,))
+        for (repo, workflow, os), rows in buckets.items():
+            store(c, repo, workflow, os, day, build(rows))
+        conn.commit()
+        day += datetime.timedelta(days=1)
+        days += 1
+    c.close()
+    return days
+
+
+def load(rows):
+    """Merge (day, sketch) rows into one sketch per day"""
+    days = {}
+    for day, data in rows:
+        sketch = Sketch.from_bytes(bytes(data))
+        if day in days:
+            days[day].merge(sketch)
+        else:
+            days[day] = sketch
+    return days
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Run-Sketches",
+        description="rebuild the workflowrun_sketches percentile sketches",
+    )
+    parser.add_argument("-pwd", "--password", help="Password to remote database")
+    parser.add_argument(
+        "--db", help="database URL, e.g. sqlite:///dashboard.db (default: RDS)"
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.date.fromisoformat,
+        help="only rebuild days from this date (YYYY-MM-DD) on",
+    )
+    args = parser.parse_args()
+    storage = open_storage(args.db, MySQLStorage(lambda: connector(args.password)))
+    conn = storage.connect()
+    days = rebuild(conn, args.since)
+    conn.close()
+    print(f"Rebuilt {days} days of run percentile sketches")
@@ -0,0 +1,21 @@
+try:
+    import waitress
+except ImportError:  # optional; falls back to Werkzeug's threaded server
+    waitress = None
+
+from werkzeug.serving import run_simple
+
+
+def serve(app, host="0.0.0.0", port=5000, threads=32):
+    """Serve a WSGI app with a pool of `threads` worker threads
+
+    Waitress writes responses from its own I/O loop, so a worker is free
+    again as soon as a large response is buffered, however slow the client.
+    Each open /api/stream connection keeps one worker, so the app caps them
+    below `threads` (SSE_MAX_CLIENTS). Without waitress, Werkzeug starts a thread per connection.
+    """
+    if waitress is not None:
+        waitress.serve(app, host=host, port=port, threads=threads)
+    else:
+        print("waitress is not installed; using Werkzeug's threaded server")
+        run_simple(host, port, app, threaded=True)
@@ -0,0 +1,255 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Each record is framed as <length:uint32><crc32:uint32><payload>, big endian
+_HEADER = struct.Struct(">II")
+_SEGMENT_SUFFIX = ".seg"
+_OFFSET_FILE = "committed"
+
+
+class Spool:
+    """Append-only, segment-rotated log of webhook payloads
+
+    Payloads are appended before they are applied to the database and acked
+    once their writes have been committed. The committed offset is the position
+    of the oldest record that has not been acked yet, so `replay` after a crash
+    only re-applies what was received but never made it into the database.
+
+    A background thread fsyncs the segment as soon as records are waiting,
+    and with `durable=True` (the default) `append` returns only once its record
+    is on disk, so an acknowledged webhook survives power loss. Appends that
+    arrive while an fsync is running share the next one (group commit). The
+    committed offset is persisted at most every `fsync_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        directory,
+        segment_bytes=64 * 1024 * 1024,
+        fsync_interval=0.05,
+        durable=True,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.durable = durable
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._in_flight = {}
+        self._committed = self._read_committed()
+        self._committed_dirty = False
+        self._committed_at = 0.0
+        self._appended = 0
+        self._synced = 0
+        self._fsyncs = 0
+        self._closed = False
+        segments = self._segments()
+        self._segno = segments[-1] if segments else max(self._committed[0], 1)
+        self._truncate_torn_tail(self._segno)
+        self._file = open(self._segment_path(self._segno), "ab")
+        self._thread = threading.Thread(
+            target=self._sync_loop, name="spool-sync", daemon=True
+        )
+        self._thread.start()
+
+    def _segment_path(self, segno):
+        return os.path.join(self.directory, f"{segno:010d}{_SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        return sorted(
+            int(name[: -len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(_SEGMENT_SUFFIX)
+        )
+
+    def _read_committed(self):
+        try:
+            with open(os.path.join(self.directory, _OFFSET_FILE)) as f:
+                segno, offset = json.load(f)
+                return (segno, offset)
+        except (OSError, ValueError):
+            segments = self._segments()
+            return (segments[0], 0) if segments else (1, 0)
+
+    def _write_committed(self, position):
+        path = os.path.join(self.directory, _OFFSET_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(list(position), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _read_frames(self, segno, offset=0):
+        """Yield (start, end, payload) for each intact frame in a segment"""
+        with open(self._segment_path(segno), "rb") as f:
+            f.seek(offset)
+            while True:
+                start = f.tell()
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                yield start, f.tell(), payload
+
+    def _truncate_torn_tail(self, segno):
+        path = self._segment_path(segno)
+        if not os.path.exists(path):
+            return
+        end = 0
+        for _, end, _ in self._read_frames(segno):
+            pass
+        if end < os.path.getsize(path):
+            print(f"Spool: truncating torn record at {path}:{end}")
+            with open(path, "r+b") as f:
+                f.truncate(end)
+
+    def append(self, payload):
+        """Append a payload and return its position for a later `ack`
+
+        With `durable` set this waits until the record has been fsynced.
+        """
+        data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        frame = _HEADER.pack(len(data), zlib.crc32(data)) + data
+        with self._cond:
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
+            position = (self._segno, self._file.tell())
+            self._file.write(frame)
+            self._file.flush()
+            self._in_flight[position] = True
+            self._appended += 1
+            sequence = self._appended
+            self._cond.notify_all()
+            while self.durable and self._synced < sequence and not self._closed:
+                self._cond.wait()
+        return position
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced = self._appended
+        self._cond.notify_all()
+        self._file.close()
+        self._segno += 1
+        self._file = open(self._segment_path(self._segno), "ab")
+
+    def ack(self, position):
+        """Mark a record as applied so the committed offset can move past it"""
+        with self._lock:
+            self._in_flight.pop(position, None)
+            if self._in_flight:
+                committed = min(self._in_flight)
+            else:
+                committed = (self._segno, self._file.tell())
+            if committed != self._committed:
+                self._committed = committed
+                self._committed_dirty = True
+
+    def replay(self, handler, retry_interval=1.0):
+        """Call handler(payload, position) for every record after the committed offset
+
+        The handler returns False when it could not take the record; it is then
+        offered again every `retry_interval` seconds until it is taken or the
+        spool is closed, so a record is never left in flight without being
+        applied. Returns the number of records handed over.
+        """
+        with self._lock:
+            segno, offset = self._committed
+            head = (self._segno, self._file.tell())
+        pending = [
+            (seg, start)
+            for seg in self._segments()
+            if seg >= segno
+            for start, _, _ in self._read_frames(seg, offset if seg == segno else 0)
+            if (seg, start) < head
+        ]
+        # Register everything up front so acks for new records cannot move the
+        # committed offset past records that have not been replayed yet
+        with self._lock:
+            for position in pending:
+                self._in_flight[position] = True
+        for count, (seg, start) in enumerate(pending):
+            _, _, data = next(self._read_frames(seg, start))
+            payload = json.loads(data)
+            while not handler(payload, (seg, start)):
+                with self._cond:
+                    # Left in flight, so the next start replays them again
+                    if self._closed:
+                        return count
+                    self._cond.wait(retry_interval)
+        return len(pending)
+
+    def sync(self, force=True):
+        """fsync appended records and persist the committed offset
+
+        Appends can continue while the fsync runs; they are covered by the next
+        one. Without `force` the committed offset is only written once
+        `fsync_interval` has passed since the last write.
+        """
+        with self._cond:
+            sequence = self._appended
+            fd = os.dup(self._file.fileno()) if sequence > self._synced else None
+        if fd is not None:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self._cond:
+                self._synced = max(self._synced, sequence)
+                self._fsyncs += 1
+                self._cond.notify_all()
+        now = time.monotonic()
+        with self._cond:
+            committed = None
+            if self._committed_dirty and (
+                force or now - self._committed_at >= self.fsync_interval
+            ):
+                committed = self._committed
+                self._committed_dirty = False
+                self._committed_at = now
+        if committed is not None:
+            self._write_committed(committed)
+            self._remove_segments_before(committed[0])
+
+    def _remove_segments_before(self, segno):
+        for seg in self._segments():
+            if seg >= segno:
+                break
+            os.remove(self._segment_path(seg))
+
+    def _sync_loop(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if self._appended == self._synced:
+                    self._cond.wait(self.fsync_interval)
+            self.sync(force=False)
+
+    def close(self):
+        self.sync()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.sync()
+        with self._lock:
+            self._file.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "segment": self._segno,
+                "committed": list(self._committed),
+                "in_flight": len(self._in_flight),
+                "fsyncs": self._fsyncs,
+            }
@@ -0,0 +1,89 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # optional; without it only gzip variants are built
+    brotli = None
+
+# Build tools put a content hash in the names of files that never change
+# (main.3f2a1b4c.js, static/media/logo.5d5d9eef.svg)
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+COMPRESSIBLE = re.compile(
+    r"^(text/|image/svg|application/(javascript|json|xml|manifest\+json))"
+)
+MIN_COMPRESS_BYTES = 1024
+
+
+class Asset:
+    def __init__(self, path, body):
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self.cache_control = IMMUTABLE if HASHED_NAME.search(path) else REVALIDATE
+        # encoding -> (body, etag); each encoding needs its own strong ETag
+        self.variants = {"identity": (body, digest)}
+        if len(body) >= MIN_COMPRESS_BYTES and COMPRESSIBLE.match(self.mimetype):
+            candidates = {"gzip": gzip.compress(body, 9, mtime=0)}
+            if brotli is not None:
+                candidates["br"] = brotli.compress(body, quality=11)
+            for encoding, compressed in candidates.items():
+                if len(compressed) < len(body):
+                    self.variants[encoding] = (compressed, f"{digest}-{encoding}")
+
+    def size(self):
+        return sum(len(body) for body, _ in self.variants.values())
+
+
+class AssetCache:
+    """The frontend build held in memory with precompressed variants
+
+    Every file under `root` is read once by `load` and compressed ahead of
+    time, so requests never touch the disk or compress anything. Content-
+    hashed files are served as immutable for a year; others, such as
+    index.html, are revalidated with their ETag on every load.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+
+    def load(self):
+        assets = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                with open(path, "rb") as f:
+                    body = f.read()
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                assets[key] = Asset(key, body)
+        self.assets = assets
+        return len(assets)
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    @staticmethod
+    def encoding(asset, accept_encodings):
+        """Smallest variant the client accepts"""
+        accepted = [
+            encoding
+            for encoding in asset.variants
+            if encoding == "identity" or accept_encodings[encoding]
+        ]
+        return min(accepted, key=lambda encoding: len(asset.variants[encoding][0]))
+
+    def stats(self):
+        return {
+            "assets": len(self.assets),
+            "bytes": sum(asset.size() for asset in self.assets.values()),
+            "compressed": sum(
+                len(asset.variants) > 1 for asset in self.assets.values()
+            ),
+            "brotli": brotli is not None,
+        }
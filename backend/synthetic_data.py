@@ -0,0 +1,365 @@
+import argparse
+import datetime
+import hashlib
+import json
+import random
+
+import daily_stats
+import flaky_runs
+import run_sketches
+from bulk_loader import bulk_upsert
+from data_versions import DATA_VERSIONS_TABLE, BUMP_VERSION
+from run_events import RUN_EVENTS_TABLE
+from sqlauthenticator import connector
+from storage import SCHEMA, MySQLStorage, create_tables, open_storage
+
+COMMIT_COLUMNS = ("hash", "author", "message", "time", "repo", "authorurl")
+
+RUN_COLUMNS = (
+    "gitid",
+    "author",
+    "runtime",
+    "createtime",
+    "starttime",
+    "endtime",
+    "queuetime",
+    "status",
+    "conclusion",
+    "url",
+    "branchname",
+    "commithash",
+    "workflowname",
+    "repo",
+    "os",
+)
+
+# Workflow name, chance it runs for a commit, failure rate and median runtime
+# in seconds. A few workflows run on nearly every commit and a long tail only
+# occasionally, like real CI.
+WORKFLOWS = [
+    ("CI", 0.95, 0.08, 1500),
+    ("PkgCI", 0.7, 0.05, 2400),
+    ("Lint", 0.6, 0.03, 90),
+    ("Linux", 0.4, 0.1, 1800),
+    ("Test Suite", 0.3, 0.15, 3000),
+    ("Docs", 0.2, 0.02, 300),
+    ("Windows", 0.15, 0.2, 2700),
+    ("Mac", 0.12, 0.12, 2100),
+    ("LLVM", 0.08, 0.25, 5400),
+    ("Debug", 0.05, 0.1, 3600),
+    ("TSAN", 0.03, 0.3, 7200),
+    ("GCC", 0.03, 0.1, 2000),
+]
+
+# Operating system matrix entries; most runs only use the first
+OPERATING_SYSTEMS = ["linux", "windows", "macos"]
+OS_WEIGHTS = [0.8, 0.12, 0.08]
+
+AUTHORS = [f"dev{i}" for i in range(40)]
+
+# Chance that a failed run is retried on the same commit
+RETRY_CHANCE = 0.3
+
+# SQLite allows 32766 parameters per statement
+ROWS_PER_STATEMENT = 1000
+
+
+class Generator:
+    """Deterministic stream of synthetic repos, branches, commits and runs
+
+    The same seed always yields the same data. Runs are spread evenly over
+    the `days` before `end`, oldest first. Repositories, branches and authors
+    are drawn with Zipf-like skew (one busy repository, a few long-lived
+    branches next to main) and each commit fans out to a random set of
+    workflows, some of which run an OS matrix, so a handful of commits
+    produce most of the runs. Some failed runs are retried on the same
+    commit, a little later than the runs around them.
+    """
+
+    def __init__(self, runs, repos=3, branches=20, days=90, seed=0, end=None):
+        self.runs = runs
+        self.repos = [f"synthetic/repo-{i}" for i in range(repos)]
+        self.branches = ["main"] + [f"feature-{i}" for i in range(branches)]
+        self.days = days
+        self.seed = seed
+        self.end = end or datetime.datetime.utcnow().replace(microsecond=0)
+        # Seeds further apart than any run count keep gitids from colliding
+        self.first_gitid = 10**9 + seed * 10**8
+
+    @staticmethod
+    def _zipf(rng, items, s=1.2):
+        weights = [1 / (rank + 1) ** s for rank in range(len(items))]
+        return rng.choices(items, weights)[0]
+
+    def branches_of(self, repo):
+        return [(branch, repo) for branch in self.branches]
+
+    def workflows_of(self, repo):
+        return [
+            (name, f"https://github.com/{repo}/actions/workflows/{name}", repo)
+            for name, _, _, _ in WORKFLOWS
+        ]
+
+    def _runs_of(self, rng):
+        """Workflows and operating systems one commit triggers"""
+        runs = []
+        for name, chance, failure_rate, median in WORKFLOWS:
+            if rng.random() >= chance:
+                continue
+            # Heavy-tailed matrix size: usually one OS, sometimes all of them
+            width = min(len(OPERATING_SYSTEMS), int(rng.paretovariate(2.5)))
+            systems = {rng.choices(OPERATING_SYSTEMS, OS_WEIGHTS)[0]}
+            while len(systems) < width:
+                systems.add(rng.choice(OPERATING_SYSTEMS))
+            runs += [(name, failure_rate, median, os) for os in sorted(systems)]
+        if not runs:
+            name, _, failure_rate, median = WORKFLOWS[0]
+            runs.append((name, failure_rate, median, "linux"))
+        return runs
+
+    def __iter__(self):
+        """Yield ("commit", row, branch) and ("run", row, branch), commits first"""
+        rng = random.Random(self.seed)
+        start = self.end - datetime.timedelta(days=self.days)
+        span = (self.end - start).total_seconds()
+        gitid = self.first_gitid
+        made = commits = 0
+        while made < self.runs:
+            repo = self._zipf(rng, self.repos)
+            branch = "main" if rng.random() < 0.5 else self._zipf(rng, self.branches)
+            author = self._zipf(rng, AUTHORS, 0.8)
+            created = start + datetime.timedelta(seconds=span * made / self.runs)
+            digest = hashlib.sha1(f"{self.seed}:{commits}".encode()).hexdigest()
+            commits += 1
+            yield "commit", (
+                digest,
+                author,
+                f"Synthetic change {commits} on {branch}",
+                created,
+                repo,
+                f"https://github.com/{author}",
+            ), branch
+            for name, failure_rate, median, os in self._runs_of(rng):
+                if branch != "main":
+                    failure_rate *= 2
+                requested = created
+                while made < self.runs:
+                    queuetime = int(rng.expovariate(1 / 60))
+                    runtime = round(rng.lognormvariate(0, 0.5) * median, 1)
+                    starttime = requested + datetime.timedelta(seconds=queuetime)
+                    endtime = starttime + datetime.timedelta(seconds=runtime)
+                    roll = rng.random()
+                    if endtime > self.end:
+                        status, conclusion = "in_progress", None
+                    elif roll < failure_rate:
+                        status, conclusion = "completed", "failure"
+                    elif roll < failure_rate + 0.02:
+                        status, conclusion = "completed", "cancelled"
+                    else:
+                        status, conclusion = "completed", "success"
+                    yield "run", (
+                        gitid,
+                        author,
+                        runtime,
+                        requested,
+                        starttime,
+                        endtime,
+                        queuetime,
+                        status,
+                        conclusion,
+                        f"https://github.com/{repo}/actions/runs/{gitid}",
+                        branch,
+                        digest,
+                        name,
+                        repo,
+                        os,
+                    ), branch
+                    gitid += 1
+                    made += 1
+                    if conclusion != "failure" or rng.random() >= RETRY_CHANCE:
+                        break
+                    # Retried on the same commit, which makes it flaky if it passes
+                    requested = endtime + datetime.timedelta(
+                        seconds=int(rng.expovariate(1 / 600))
+                    )
+
+
+def load(conn, generator, chunk_size=5000):
+    """Write everything `generator` yields, committing every `chunk_size` runs
+
+    Returns the number of runs written. The daily statistics rollup, the
+    percentile sketches and the flakiness counts are rebuilt afterwards and
+    every repository's data version is bumped.
+    """
+    create_tables(
+        conn,
+        SCHEMA
+        + [
+            DATA_VERSIONS_TABLE,
+            RUN_EVENTS_TABLE,
+            daily_stats.DAILY_STATS_TABLE,
+            run_sketches.SKETCH_TABLE,
+            flaky_runs.FLAKINESS_TABLE,
+        ],
+    )
+    c = conn.cursor()
+    for repo in generator.repos:
+        c.execute(
+            "INSERT INTO repos (name) VALUES (%s)"
+            " ON DUPLICATE KEY UPDATE name = VALUES(name)",
+            (repo,),
+        )
+        bulk_upsert(
+            c, "branches", ("name", "repo"), ("name",), generator.branches_of(repo)
+        )
+        bulk_upsert(
+            c,
+            "workflows",
+            ("name", "url", "repo"),
+            ("name",),
+            generator.workflows_of(repo),
+        )
+    conn.commit()
+    commits, runs = [], []
+    written = 0
+
+    def flush():
+        bulk_upsert(
+            c, "commits", COMMIT_COLUMNS, ("hash",), commits, ROWS_PER_STATEMENT
+        )
+        bulk_upsert(
+            c, "workflowruns", RUN_COLUMNS, ("gitid",), runs, ROWS_PER_STATEMENT
+        )
+        conn.commit()
+        commits.clear()
+        runs.clear()
+
+    for kind, row, _ in generator:
+        if kind == "commit":
+            commits.append(row)
+            continue
+        runs.append(row)
+        written += 1
+        if len(runs) >= chunk_size:
+            flush()
+            print(f"Wrote {written} of {generator.runs} runs", end="\r", flush=True)
+    flush()
+    print()
+    first_day = generator.end - datetime.timedelta(days=generator.days)
+    daily_stats.rebuild(conn, first_day.date())
+    run_sketches.rebuild(conn, first_day.date())
+    flaky_runs.rebuild(conn, first_day.date())
+    for repo in generator.repos:
+        c.execute(BUMP_VERSION, (repo, ""))
+    conn.commit()
+    c.close()
+    return written
+
+
+def _timestamp(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ") if value else None
+
+
+def webhooks(generator):
+    """The webhook payloads GitHub would send for the generator's data
+
+    Each commit becomes a push, and each run a workflow_run "requested", a
+    workflow_job "in_progress" and, once finished, a workflow_run
+    "completed" delivery, in the shape listener.py reads.
+    """
+    for kind, row, branch in generator:
+        if kind == "commit":
+            digest, author, message, created, repo, _ = row
+            yield {
+                "ref": f"refs/heads/{branch}",
+                "repository": {"full_name": repo},
+                "pusher": {"name": author},
+                "forced": False,
+                "head_commit": {"timestamp": _timestamp(created)},
+                "commits": [{"id": digest, "message": message}],
+            }
+            continue
+        run = dict(zip(RUN_COLUMNS, row))
+        workflow_run = {
+            "id": run["gitid"],
+            "name": run["workflowname"],
+            "head_branch": run["branchname"],
+            "head_sha": run["commithash"],
+            "actor": {"login": run["author"]},
+            "html_url": run["url"],
+            "created_at": _timestamp(run["createtime"]),
+            "run_started_at": _timestamp(run["createtime"]),
+            "updated_at": _timestamp(run["createtime"]),
+            "status": "queued",
+            "conclusion": None,
+        }
+        repository = {"full_name": run["repo"]}
+        yield {
+            "action": "requested",
+            "repository": repository,
+            "workflow_run": workflow_run,
+        }
+        yield {
+            "action": "in_progress",
+            "repository": repository,
+            "workflow_job": {
+                "run_id": run["gitid"],
+                "started_at": _timestamp(run["starttime"]),
+            },
+        }
+        if run["conclusion"]:
+            yield {
+                "action": "completed",
+                "repository": repository,
+                "workflow_run": dict(
+                    workflow_run,
+                    run_started_at=_timestamp(run["starttime"]),
+                    updated_at=_timestamp(run["endtime"]),
+                    status=run["status"],
+                    conclusion=run["conclusion"],
+                ),
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Synthetic-Data",
+        description="fill a dashboard database with reproducible synthetic data",
+    )
+    parser.add_argument(
+        "--db", help="database URL, e.g. sqlite:///bench.db (default: RDS)"
+    )
+    parser.add_argument("-pwd", "--password", help="Password to remote database")
+    parser.add_argument(
+        "--runs", type=int, default=10000, help="workflow runs to generate"
+    )
+    parser.add_argument(
+        "--repos", type=int, default=3, help="repositories to spread them over"
+    )
+    parser.add_argument(
+        "--branches", type=int, default=20, help="feature branches per repository"
+    )
+    parser.add_argument("--days", type=int, default=90, help="days the runs cover")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--chunk-size", type=int, default=5000, help="runs written per commit"
+    )
+    parser.add_argument(
+        "--webhooks",
+        help="write the data as webhook payloads (one JSON object per line)"
+        " to this file instead of the database",
+    )
+    args = parser.parse_args()
+    generator = Generator(args.runs, args.repos, args.branches, args.days, args.seed)
+    if args.webhooks:
+        with open(args.webhooks, "w") as f:
+            for payload in webhooks(generator):
+                f.write(json.dumps(payload) + "\n")
+    else:
+        storage = open_storage(
+            args.db, MySQLStorage(lambda: connector(args.password))
+        )
+        conn = storage.connect()
+        written = load(conn, generator, args.chunk_size)
+        conn.close()
+        print(f"Wrote {written} synthetic workflow runs")
@@ -0,0 +1,97 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("requests")
+
+from github_client import GitHubClient, MemoryEtagStore
+
+BRANCHES = [[{"name": f"branch-{page}-{i}"} for i in range(2)] for page in range(3)]
+
+
+class FakeGitHub(BaseHTTPRequestHandler):
+    """Serves a paginated /branches listing with ETags and rate-limit headers"""
+
+    requests = []
+    fail_next = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        FakeGitHub.requests.append((self.path, self.headers.get("If-None-Match")))
+        if FakeGitHub.fail_next:
+            FakeGitHub.fail_next -= 1
+            self.send_response(502)
+            self.end_headers()
+            return
+        page = int(parse_qs(urlparse(self.path).query).get("page", ["0"])[0])
+        etag = f'"branches-{page}"'
+        self.send_response(304 if self.headers.get("If-None-Match") == etag else 200)
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Remaining", "4999")
+        self.send_header("X-RateLimit-Reset", "0")
+        if page + 1 < len(BRANCHES):
+            base = f"http://127.0.0.1:{self.server.server_port}"
+            self.send_header(
+                "Link", f'<{base}/repos/o/r/branches?page={page + 1}>; rel="next"'
+            )
+        if self.headers.get("If-None-Match") == etag:
+            self.end_headers()
+            return
+        body = json.dumps(BRANCHES[page]).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PersistentStore(MemoryEtagStore):
+    persistent = True
+
+
+@pytest.fixture
+def api_url():
+    FakeGitHub.requests = []
+    FakeGitHub.fail_next = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def names(client):
+    return [branch["name"] for branch in client.paginate("/repos/o/r/branches")]
+
+
+def test_paginate_follows_link_headers(api_url):
+    client = GitHubClient(base_url=api_url, max_workers=2)
+    assert names(client) == [b["name"] for page in BRANCHES for b in page]
+    assert client.stats["requests"] == 3
+    assert client.limiter.remaining == 4999
+    client.close()
+
+
+def test_persisted_etags_turn_a_rerun_into_304s(api_url):
+    store = PersistentStore()
+    first = GitHubClient(base_url=api_url, etags=store)
+    expected = names(first)
+    first.close()
+    # A later run with the same store sends If-None-Match for every page
+    second = GitHubClient(base_url=api_url, etags=store)
+    assert names(second) == expected
+    assert second.stats["not_modified"] == 3
+    assert all(etag for _, etag in FakeGitHub.requests[3:])
+    second.close()
+
+
+def test_server_errors_are_retried(api_url):
+    FakeGitHub.fail_next = 2
+    client = GitHubClient(base_url=api_url, backoff=0.01)
+    body, response = client.get("/repos/o/r/branches")
+    assert body == BRANCHES[0]
+    assert client.stats["retries"] == 2
+    client.close()
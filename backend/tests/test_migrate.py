@@ -0,0 +1,25 @@
+import pytest
+
+from init_db import init_database
+from migrate import MIGRATIONS, Migrator
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def migrator(tmp_path):
+    path = str(tmp_path / "dashboard.db")
+    init_database(path)
+    migrator = Migrator(SQLiteStorage(path).connect(), "sqlite")
+    yield migrator
+    migrator.conn.close()
+
+
+def test_migrate_is_idempotent(migrator):
+    assert migrator.migrate() == [version for version, _, _ in MIGRATIONS]
+    assert migrator.migrate() == []
+
+
+def test_hot_queries_use_their_indexes(migrator):
+    migrator.migrate()
+    assert migrator.verify()
+
@@ -0,0 +1,143 @@
+import pytest
+
+from batch_writer import BatchWriter
+from db_pool import ConnectionPool
+from init_db import init_database
+from spool import Spool
+from storage import SQLiteStorage
+
+INSERT_RUN = """
+    INSERT INTO workflowruns (gitid, status, conclusion, repo)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE status = VALUES(status), conclusion = VALUES(conclusion)
+"""
+
+
+def run_event(gitid, status="completed", conclusion="success"):
+    return {
+        "repository": {"full_name": "org/repo"},
+        "workflow_run": {"id": gitid, "status": status, "conclusion": conclusion},
+    }
+
+
+@pytest.fixture
+def pool(tmp_path):
+    path = str(tmp_path / "dashboard.db")
+    init_database(path)
+    pool = ConnectionPool(SQLiteStorage(path).connect)
+    yield pool
+    pool.close()
+
+
+def apply(writer, spool, data, position):
+    run = data["workflow_run"]
+    writer.add(
+        INSERT_RUN,
+        (run["id"], run["status"], run["conclusion"], data["repository"]["full_name"]),
+    )
+    writer.barrier(lambda: spool.ack(position))
+
+
+def stored_runs(pool):
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT gitid, status FROM workflowruns ORDER BY gitid")
+        return c.fetchall()
+
+
+def test_replay_applies_only_uncommitted_events(tmp_path, pool):
+    spool_dir = str(tmp_path / "spool")
+    spool = Spool(spool_dir)
+    writer = BatchWriter(pool)
+    for gitid in (1, 2):
+        apply(writer, spool, run_event(gitid), spool.append(run_event(gitid)))
+    writer.flush()
+    # Received but never written, as if the database was down at shutdown
+    spool.append(run_event(3))
+    spool.append(run_event(4, status="in_progress", conclusion=None))
+    spool.close()
+    writer.close()
+    assert stored_runs(pool) == [(1, "completed"), (2, "completed")]
+
+    spool = Spool(spool_dir)
+    writer = BatchWriter(pool)
+    replayed = []
+    count = spool.replay(
+        lambda data, position: (
+            replayed.append(data["workflow_run"]["id"]),
+            apply(writer, spool, data, position),
+        )
+    )
+    writer.close()
+    spool.close()
+    assert count == 2
+    assert replayed == [3, 4]
+    assert stored_runs(pool) == [
+        (1, "completed"),
+        (2, "completed"),
+        (3, "completed"),
+        (4, "in_progress"),
+    ]
+
+    # Everything is committed now, so a further restart has nothing to replay
+    spool = Spool(spool_dir)
+    assert spool.replay(lambda data, position: None) == 0
+    spool.close()
+
+
+def test_replay_offers_refused_events_again(tmp_path):
+    spool = Spool(str(tmp_path))
+    for gitid in (1, 2):
+        spool.append(run_event(gitid))
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+    offered = []
+
+    def handler(data, position):
+        offered.append(data["workflow_run"]["id"])
+        if len(offered) == 1:
+            return False
+        spool.ack(position)
+        return True
+
+    assert spool.replay(handler, retry_interval=0.01) == 2
+    assert offered == [1, 1, 2]
+    assert spool.stats()["in_flight"] == 0
+    spool.close()
+
+
+def test_refused_events_stay_spooled_when_closed(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(run_event(1))
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+
+    def refuse(data, position):
+        spool.close()
+        return False
+
+    assert spool.replay(refuse) == 0
+    spool = Spool(str(tmp_path))
+    assert spool.replay(lambda data, position: True) == 1
+    spool.close()
+
+
+def test_rotated_segments_are_reclaimed_once_committed(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64)
+    positions = [spool.append(run_event(gitid)) for gitid in range(5)]
+    assert spool.stats()["segment"] == 5
+    for position in positions:
+        spool.ack(position)
+    spool.sync()
+    assert sorted(p.name for p in tmp_path.glob("*.seg")) == ["0000000005.seg"]
+    spool.close()
+
+
+def test_append_waits_for_fsync(tmp_path):
+    spool = Spool(str(tmp_path), fsync_interval=60)
+    spool.append(run_event(1))
+    # The sync thread is woken by the append rather than the interval
+    assert spool.stats()["fsyncs"] >= 1
+    spool.close()
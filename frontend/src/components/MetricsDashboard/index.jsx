@@ -2,6 +2,11 @@ import React, { useState, useEffect } from 'react';
 import { BarChart, Bar, LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 import { Loader2 } from 'lucide-react';
 
+// When the server refuses the live stream, fall back to the old 5 minute
+// poll, backing off further while it keeps refusing
+const STREAM_RETRY_MS = 300000;
+const STREAM_RETRY_MAX_MS = 1800000;
+
 const MetricCard = ({ title, value, isRed, subtitle, size = 'default' }) => (
   <div className="bg-white rounded-lg shadow-sm hover:shadow-lg transition-shadow p-6">
     <div className="text-sm font-medium text-gray-500">{title}</div>
@@ -23,7 +28,7 @@ const MetricsDashboard = () => {
   const fetchDashboardData = async () => {
     try {
       setLoading(true);
-      const response = await fetch(`/api/metrics/dashboard?range=${timeRange}`);
+      const response = await fetch(`/api/metrics/dashboard?range=${timeRange}&branch=main&bucket=${timeRange === '1y' ? 'week' : 'day'}`);
       
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
@@ -42,8 +47,49 @@ const MetricsDashboard = () => {
 
   useEffect(() => {
     fetchDashboardData();
-    const interval = setInterval(fetchDashboardData, 300000); // 5 minutes
-    return () => clearInterval(interval);
+    // Refresh shortly after runs on main change instead of polling
+    let refreshTimer = null;
+    let retryTimer = null;
+    let retryDelay = STREAM_RETRY_MS;
+    let source = null;
+    const scheduleRefresh = () => {
+      if (!refreshTimer) {
+        refreshTimer = setTimeout(() => {
+          refreshTimer = null;
+          fetchDashboardData();
+        }, 10000);
+      }
+    };
+    const connect = () => {
+      source = new EventSource('/api/stream?branch=main');
+      ['run_created', 'run_updated', 'run_completed', 'queue_time'].forEach(kind => {
+        source.addEventListener(kind, scheduleRefresh);
+      });
+      source.addEventListener('reset', () => {
+        source.close();
+        scheduleRefresh();
+        connect();
+      });
+      source.onopen = () => {
+        retryDelay = STREAM_RETRY_MS;
+      };
+      // The server turns streams away when it is busy; poll and try again later
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+          retryTimer = setTimeout(() => {
+            fetchDashboardData();
+            connect();
+          }, retryDelay);
+          retryDelay = Math.min(retryDelay * 2, STREAM_RETRY_MAX_MS);
+        }
+      };
+    };
+    connect();
+    return () => {
+      source.close();
+      clearTimeout(refreshTimer);
+      clearTimeout(retryTimer);
+    };
   }, [timeRange]);
 
   if (loading && !data) {
@@ -101,6 +147,8 @@ const MetricsDashboard = () => {
             <option value="7d">Last 7 Days</option>
             <option value="14d">Last 14 Days</option>
             <option value="30d">Last 30 Days</option>
+            <option value="90d">Last 90 Days</option>
+            <option value="1y">Last Year</option>
           </select>
           <button 
             onClick={fetchDashboardData}
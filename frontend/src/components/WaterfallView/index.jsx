@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Loader2 } from 'lucide-react';
 import { Alert, AlertDescription } from '../ui/alert';
 
@@ -24,6 +24,14 @@ const REPO_WORKFLOWS = {
   ]
 };
 
+// Commits fetched per page
+const PAGE_SIZE = 100;
+
+// When the server refuses the live stream, fall back to the old 5 minute
+// poll, backing off further while it keeps refusing
+const STREAM_RETRY_MS = 300000;
+const STREAM_RETRY_MAX_MS = 1800000;
+
 // Default workflows when no specific repo is selected
 const DEFAULT_WORKFLOWS = [
   { id: 'CI', display: 'CI', description: 'Main CI workflow' },
@@ -78,6 +86,8 @@ const WaterfallView = () => {
   const [workflowRuns, setWorkflowRuns] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const runsRef = useRef([]);
   const [filter, setFilter] = useState('');
   const [selectedRepo, setSelectedRepo] = useState('iree-org/iree');
   const [selectedBranch, setSelectedBranch] = useState('main');
@@ -126,112 +136,47 @@ const WaterfallView = () => {
     fetchRepos();
   }, []);
 
+  const fetchPage = async (cursor) => {
+    const params = {
+      days: '30',
+      limit: String(PAGE_SIZE),
+      repo: selectedRepo === 'all' ? '' : selectedRepo,
+      branch: selectedBranch === 'all' ? '' : selectedBranch,
+      columns: workflows.map(workflow => workflow.id).join(',')
+    };
+    if (cursor) {
+      params.cursor = cursor;
+    }
+    const queryParams = new URLSearchParams(params).toString();
+
+    const response = await fetch(`/api/metrics/waterfall?${queryParams}`, {
+      method: 'GET',
+      headers: {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+      }
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const data = await response.json();
+    if (data.error) {
+      throw new Error(data.error);
+    }
+    return data;
+  };
+
   useEffect(() => {
     const fetchData = async () => {
       try {
         setLoading(true);
-        const queryParams = new URLSearchParams({
-          days: '30', // Increased to 30 days to get more results
-          repo: selectedRepo === 'all' ? '' : selectedRepo,
-          branch: selectedBranch === 'all' ? '' : selectedBranch
-        }).toString();
-        
-        console.log('Fetching from:', `/api/metrics/workflowruns?${queryParams}`);
-        
-        const response = await fetch(`/api/metrics/workflowruns?${queryParams}`, {
-          method: 'GET',
-          headers: {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-          }
-        });
-        
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const data = await response.json();
-        console.log('Workflow data sample:', data[0]); // Log first item for debugging
-        
-        if (data.error) {
-          throw new Error(data.error);
-        }
-
-        // Group data by commit hash to reduce duplication
-        const commitGroups = {};
-        data.forEach(run => {
-          if (!commitGroups[run.commitHash]) {
-            commitGroups[run.commitHash] = {
-              ...run,
-              allRuns: [],  // Store all runs for this commit
-              workflowResults: {}  // Store results for each workflow type
-            };
-            
-            // Initialize workflow results
-            workflows.forEach(workflow => {
-              commitGroups[run.commitHash].workflowResults[workflow.id] = { 
-                status: '?', 
-                url: null 
-              };
-            });
-          }
-          
-          // Add this run to the commit's run collection
-          commitGroups[run.commitHash].allRuns.push(run);
-          
-          // Direct mapping from workflow name
-          if (run.workflowname) {
-            const workflowId = run.workflowname;
-            const exactWorkflow = workflows.find(w => w.id === workflowId);
-            
-            if (exactWorkflow) {
-              commitGroups[run.commitHash].workflowResults[exactWorkflow.id] = { 
-                status: run.conclusion === 'success' ? 'O' : (run.conclusion === 'failure' ? 'X' : '?'),
-                url: run.workflowUrl
-              };
-            }
-          }
-          
-          // Also map OS-specific results
-          if (run.os) {
-            // Handle OS mappings
-            let osKey = run.os;
-            if (osKey.toLowerCase() === 'windows') {
-              osKey = 'Windows';
-            } else if (osKey.toLowerCase() === 'macos') {
-              osKey = 'Mac';
-            }
-            
-            const osWorkflow = workflows.find(w => w.id === osKey);
-            if (osWorkflow) {
-              commitGroups[run.commitHash].workflowResults[osWorkflow.id] = { 
-                status: run.conclusion === 'success' ? 'O' : (run.conclusion === 'failure' ? 'X' : '?'),
-                url: run.workflowUrl
-              };
-            }
-          }
-          
-          // Also directly map results from the 'results' object if present
-          if (run.results) {
-            Object.entries(run.results).forEach(([key, value]) => {
-              const resultWorkflow = workflows.find(w => w.id === key);
-              if (resultWorkflow && value !== '?') {
-                commitGroups[run.commitHash].workflowResults[resultWorkflow.id] = { 
-                  status: value,
-                  url: run.workflowUrl
-                };
-              }
-            });
-          }
-        });
-
-        // Convert back to array for display and sort by createTime
-        const groupedData = Object.values(commitGroups)
-          .sort((a, b) => new Date(b.createTime) - new Date(a.createTime));
-          
-        setWorkflowRuns(groupedData);
+        // Rows arrive grouped by commit with one cell per workflow column
+        const data = await fetchPage(null);
+        setWorkflowRuns(data.rows);
+        setNextCursor(data.nextCursor);
         setError(null);
-        console.log('Processed data:', groupedData);
       } catch (err) {
         console.error('Error fetching data:', err);
         setError(err.message);
@@ -240,11 +185,99 @@ const WaterfallView = () => {
       }
     };
 
+    // Live updates: patch cells in place, reload when a new commit shows up
+    let source = null;
+    let reloadTimer = null;
+    let retryTimer = null;
+    let retryDelay = STREAM_RETRY_MS;
+
+    const scheduleReload = () => {
+      if (!reloadTimer) {
+        reloadTimer = setTimeout(() => {
+          reloadTimer = null;
+          fetchData();
+        }, 5000);
+      }
+    };
+
+    const applyEvent = (message) => {
+      const event = JSON.parse(message.data);
+      const matches = run => run.commitHash === event.commitHash && run.repo === event.repo;
+      if (!runsRef.current.some(matches)) {
+        scheduleReload();
+        return;
+      }
+      setWorkflowRuns(runs => runs.map(run => {
+        if (!matches(run)) {
+          return run;
+        }
+        const cells = [...run.cells];
+        workflows.forEach((workflow, i) => {
+          if (event.columns.includes(workflow.id)) {
+            cells[i] = { status: event.result, url: event.workflowUrl };
+          }
+        });
+        return { ...run, cells };
+      }));
+    };
+
+    const connect = () => {
+      const params = new URLSearchParams({
+        repo: selectedRepo === 'all' ? '' : selectedRepo,
+        branch: selectedBranch === 'all' ? '' : selectedBranch
+      }).toString();
+      source = new EventSource(`/api/stream?${params}`);
+      ['run_created', 'run_updated', 'run_completed', 'queue_time'].forEach(kind => {
+        source.addEventListener(kind, applyEvent);
+      });
+      // The server could not resume this stream; start over from a fresh load
+      source.addEventListener('reset', () => {
+        source.close();
+        fetchData();
+        connect();
+      });
+      source.onopen = () => {
+        retryDelay = STREAM_RETRY_MS;
+      };
+      // The server turns streams away when it is busy; poll and try again later
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+          retryTimer = setTimeout(() => {
+            fetchData();
+            connect();
+          }, retryDelay);
+          retryDelay = Math.min(retryDelay * 2, STREAM_RETRY_MAX_MS);
+        }
+      };
+    };
+
     fetchData();
-    const interval = setInterval(fetchData, 300000); // 5 minutes
-    return () => clearInterval(interval);
+    connect();
+    return () => {
+      source.close();
+      clearTimeout(reloadTimer);
+      clearTimeout(retryTimer);
+    };
   }, [selectedRepo, selectedBranch, workflows]);
 
+  useEffect(() => {
+    runsRef.current = workflowRuns;
+  }, [workflowRuns]);
+
+  const loadMore = async () => {
+    try {
+      setLoading(true);
+      const data = await fetchPage(nextCursor);
+      setWorkflowRuns(runs => [...runs, ...data.rows]);
+      setNextCursor(data.nextCursor);
+    } catch (err) {
+      console.error('Error fetching data:', err);
+      setError(err.message);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const filteredRuns = workflowRuns.filter(run => {
     if (!filter) return true;
     const searchTerm = filter.toLowerCase();
@@ -423,11 +456,11 @@ const WaterfallView = () => {
                   <td className="px-2 py-1 text-gray-500">
                     {run.author}
                   </td>
-                  {workflows.map(workflow => (
+                  {workflows.map((workflow, i) => (
                     <td key={workflow.id} className="px-1 py-1 text-center">
                       <StatusIcon 
-                        status={run.workflowResults[workflow.id]?.status || '?'} 
-                        url={run.workflowResults[workflow.id]?.url}
+                        status={run.cells[i]?.status || '?'} 
+                        url={run.cells[i]?.url}
                       />
                     </td>
                   ))}
@@ -435,6 +468,17 @@ const WaterfallView = () => {
               ))}
             </tbody>
           </table>
+          {nextCursor && (
+            <div className="text-center py-2">
+              <button
+                className="px-3 py-1 border rounded text-sm bg-gray-100 hover:bg-gray-200"
+                onClick={loadMore}
+                disabled={loading}
+              >
+                {loading ? 'Loading...' : 'Load more'}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>